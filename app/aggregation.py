@@ -0,0 +1,271 @@
+import logging
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+from typing import Any, Dict, Optional, Tuple, Union
+
+from .constants import FIGURE_MAX_POINTS, FIGURE_MIN_TRACE_POINTS
+
+# Calendar frequencies accepted by `resample` and `envelope`, seasons are meteorological (DJF, MAM, JJA, SON)
+FREQUENCIES = {
+    "daily": "D",
+    "weekly": "W-MON",
+    "monthly": "MS",
+    "seasonal": "QS-DEC",
+    "yearly": "YS",
+}
+
+# Trace types whose points are x/y pairs that can be downsampled
+DOWNSAMPLED_TRACE_TYPES = ("scatter", "scattergl")
+
+# Per-point trace attributes that must be subset along with x and y
+POINT_ATTRIBUTES = ("text", "hovertext", "customdata", "ids")
+MARKER_POINT_ATTRIBUTES = ("color", "size", "symbol", "opacity")
+
+
+def _frequency(freq: str) -> str:
+    return FREQUENCIES.get(freq, freq)
+
+
+def resample(
+    data: Union[pd.DataFrame, pd.Series],
+    freq: str = "monthly",
+    how: Union[str, Dict[str, str]] = "mean",
+    min_count: int = 1,
+) -> Union[pd.DataFrame, pd.Series]:
+    """
+    Aggregate a time series to a coarser calendar frequency
+
+    Args:
+        data (Union[pd.DataFrame, pd.Series]): Series indexed by a DatetimeIndex, e.g. `hourly_data`
+        freq (str): `daily`, `weekly`, `monthly`, `seasonal`, `yearly` or any pandas offset alias
+        how (Union[str, Dict[str, str]]): Aggregation, e.g. `mean`, `sum`, `min`, `max`, or one per column
+        min_count (int): Periods with fewer valid values are NaN
+
+    Returns:
+        Union[pd.DataFrame, pd.Series]: One row per period, labelled by its first day
+    """
+    resampler = data.resample(_frequency(freq))
+    aggregated = resampler.agg(how)
+    if min_count > 1:
+        aggregated = aggregated.where(resampler.count() >= min_count)
+    return aggregated
+
+
+def envelope(series: pd.Series, freq: str = "monthly") -> pd.DataFrame:
+    """
+    Min, mean and max of a series per period, to draw a band instead of every point
+
+    Args:
+        series (pd.Series): Series indexed by a DatetimeIndex
+        freq (str): Period, as for `resample`
+
+    Returns:
+        pd.DataFrame: Columns `min`, `mean` and `max`, one row per period
+    """
+    return series.resample(_frequency(freq)).agg(["min", "mean", "max"])
+
+
+def minmax_indices(y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Indices of the minimum and maximum of `n_out // 2` equal buckets, in order
+
+    Keeps every peak of a noisy series, which LTTB may smooth over.
+    """
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    if n <= n_out or n_out < 2:
+        return np.arange(n)
+    buckets = n_out // 2
+    edges = np.linspace(0, n, buckets + 1).astype(np.int64)
+    filled = np.where(np.isnan(y), np.nanmean(y) if np.isfinite(y).any() else 0.0, y)
+    # positions of each bucket's extremes, found with one reduceat per extreme
+    starts = edges[:-1]
+    minimum = np.minimum.reduceat(filled, starts)
+    maximum = np.maximum.reduceat(filled, starts)
+    bucket = np.repeat(np.arange(buckets), np.diff(edges))
+    is_min = filled == minimum[bucket]
+    is_max = filled == maximum[bucket]
+    first_min = np.full(buckets, n, dtype=np.int64)
+    first_max = np.full(buckets, n, dtype=np.int64)
+    np.minimum.at(first_min, bucket[is_min], np.flatnonzero(is_min))
+    np.minimum.at(first_max, bucket[is_max], np.flatnonzero(is_max))
+    return np.unique(np.concatenate([first_min, first_max, [0, n - 1]]))
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Indices kept by Largest-Triangle-Three-Buckets downsampling
+
+    The first and last points are kept, and each of the `n_out - 2` buckets in between
+    keeps the point forming the largest triangle with the point kept in the previous
+    bucket and the average of the next one. Bucket bounds and averages are computed
+    once, each bucket then takes one vectorized step.
+
+    Args:
+        x (np.ndarray): Numeric x values, sorted
+        y (np.ndarray): Values, NaN for gaps
+        n_out (int): Number of points to keep
+
+    Returns:
+        np.ndarray: Sorted indices into x and y
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    starts, ends = edges[:-1], edges[1:]
+    finite = np.isfinite(y)
+    y_filled = np.where(finite, y, 0.0)
+    counts = np.add.reduceat(finite.astype(np.int64), starts)
+    sums_x = np.add.reduceat(np.where(finite, x, 0.0), starts)
+    sums_y = np.add.reduceat(y_filled, starts)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_x = np.where(counts > 0, sums_x / counts, (x[starts] + x[ends - 1]) / 2)
+        mean_y = np.where(counts > 0, sums_y / counts, np.nan)
+    # the last bucket looks ahead to the last point
+    next_x = np.append(mean_x[1:], x[-1])
+    next_y = np.append(mean_y[1:], y[-1])
+
+    kept = np.empty(n_out, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+    previous = 0
+    for bucket, (start, end) in enumerate(zip(starts, ends)):
+        ax, ay = x[previous], y[previous]
+        areas = np.abs((ax - next_x[bucket]) * (y[start:end] - ay) - (ax - x[start:end]) * (next_y[bucket] - ay))
+        if not np.isfinite(ay) or not np.isfinite(next_y[bucket]):
+            # next to a gap: keep the bucket's most extreme value so the gap stays visible
+            areas = np.abs(y[start:end] - np.nanmean(y[start:end])) if counts[bucket] else np.zeros(end - start)
+        areas = np.where(np.isfinite(areas), areas, -1.0)
+        previous = start + int(np.argmax(areas))
+        kept[bucket + 1] = previous
+    return kept
+
+
+def lttb(x: Any, y: Any, n_out: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Downsample a line to `n_out` points while keeping its visual shape
+
+    Args:
+        x (Any): X values: numbers, datetimes or a DatetimeIndex, sorted
+        y (Any): Y values
+        n_out (int): Number of points to keep
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Downsampled x and y
+    """
+    x = np.asarray(x)
+    y = np.asarray(y, dtype=np.float64)
+    indices = lttb_indices(_numeric(x), y, n_out)
+    return x[indices], y[indices]
+
+
+def _numeric(values: np.ndarray) -> Optional[np.ndarray]:
+    """X values as float64, converting datetimes and ISO strings"""
+    if values.dtype.kind in "biuf":
+        return values.astype(np.float64)
+    if values.dtype.kind == "M":
+        return values.astype("datetime64[ns]").astype(np.int64).astype(np.float64)
+    try:
+        return pd.to_datetime(values).asi8.astype(np.float64)
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_sorted(values: np.ndarray) -> bool:
+    return bool(np.all(values[1:] >= values[:-1]))
+
+
+def _subset(value: Any, indices: np.ndarray, length: int) -> Any:
+    if isinstance(value, (list, tuple, np.ndarray, pd.Series, pd.Index)) and len(value) == length:
+        return np.asarray(value)[indices]
+    return value
+
+
+def downsample_trace(trace: Any, n_out: int) -> bool:
+    """
+    Downsample a scatter trace in place, along with its per-point text, hover and marker arrays
+
+    Lines use LTTB, marker-only traces keep the extremes of each bucket.
+
+    Returns:
+        bool: Whether the trace was downsampled
+    """
+    if trace.type not in DOWNSAMPLED_TRACE_TYPES or trace.x is None or trace.y is None:
+        return False
+    x, y = np.asarray(trace.x), trace.y
+    length = len(x)
+    if length <= n_out or len(y) != length:
+        return False
+    try:
+        y = np.asarray(y, dtype=np.float64)
+    except (TypeError, ValueError):
+        return False
+    numeric_x = _numeric(x)
+    if numeric_x is None or not _is_sorted(numeric_x):
+        return False
+
+    mode = trace.mode or ("lines" if length > 20 else "lines+markers")
+    indices = lttb_indices(numeric_x, y, n_out) if "lines" in mode else minmax_indices(y, n_out)
+
+    updates: Dict[str, Any] = {"x": x[indices], "y": y[indices]}
+    for attribute in POINT_ATTRIBUTES:
+        updates[attribute] = _subset(trace[attribute], indices, length)
+    trace.update(updates)
+    for attribute in MARKER_POINT_ATTRIBUTES:
+        value = trace.marker[attribute]
+        if value is not None:
+            trace.marker[attribute] = _subset(value, indices, length)
+    for error in ("error_y", "error_x"):
+        for attribute in ("array", "arrayminus"):
+            value = trace[error][attribute]
+            if value is not None:
+                trace[error][attribute] = _subset(value, indices, length)
+    return True
+
+
+def downsample_figure(
+    fig: go.Figure, max_points: int = FIGURE_MAX_POINTS, min_trace_points: int = FIGURE_MIN_TRACE_POINTS
+) -> go.Figure:
+    """
+    Bound the number of points a figure ships, whatever date range it was built from
+
+    Traces within their share of the budget are untouched, the budget they leave is
+    split evenly between the larger ones, which are downsampled in place.
+
+    Args:
+        fig (go.Figure): Figure returned by generated code
+        max_points (int): Total number of x/y points across scatter traces
+        min_trace_points (int): Points every downsampled trace keeps at least
+
+    Returns:
+        go.Figure: The same figure
+    """
+    sizes = [
+        len(trace.x) if trace.type in DOWNSAMPLED_TRACE_TYPES and trace.x is not None else 0
+        for trace in fig.data
+    ]
+    if sum(sizes) <= max_points:
+        return fig
+
+    budget = max_points
+    large = sorted(range(len(sizes)), key=lambda i: sizes[i])
+    while large:
+        share = budget // len(large)
+        if sizes[large[0]] > share:
+            break
+        budget -= sizes[large.pop(0)]
+    share = max(budget // max(len(large), 1), min_trace_points)
+
+    before = sum(sizes)
+    with fig.batch_update():
+        for i in large:
+            downsample_trace(fig.data[i], share)
+    after = sum(len(trace.x) if trace.x is not None else 0 for trace in fig.data)
+    logging.info(f"Downsampled figure from {before} to {after} points")
+    return fig
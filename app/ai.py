@@ -1,22 +1,19 @@
 import os
 import json
+import logging
+import threading
 
 from abc import ABC, abstractmethod
 from enum import Enum
 
-from openai import OpenAI
-from anthropic import Anthropic
 from pydantic import BaseModel
-from typing import Type, Dict, AsyncGenerator, List
-import asyncio
+from typing import Any, Type, Dict, AsyncGenerator, List, Optional, Tuple
 
-from .constants import GPT_4o_MINI, SONNET_3_7, DEVELOPER, USER, ASSISTANT
-from .prompts import OUTPUT_LANGUAGE_PROMPT, ANTHROPIC_SYSTEM_PROMPT, ANTHROPIC_STRUCTURED_OUTPUT_PROMPT
-from .models import LLMMessageType
+from .constants import GPT_4o_MINI, SONNET_3_7, SONNET_3_7_STREAMING, DEVELOPER, USER, ASSISTANT, PROMPT_CACHE_CONTROL
+from .prompts import ANTHROPIC_SYSTEM_PROMPT
+from .prompt_assembly import prompt_assembler
 from .utils import handle_exceptions
-import tiktoken
-
-enc = tiktoken.encoding_for_model(GPT_4o_MINI)
+from .usage import usage_meter
 
 class LLMProvider(str, Enum):
     OPENAI = "openai"
@@ -25,26 +22,34 @@ class LLMProvider(str, Enum):
 class LLMClient(ABC):
     """
     Abstract class for a Language Model client
+
+    The SDK is imported and its clients built on first use, which keeps them out of
+    the app import on cold starts.
     """
 
-    def __init__(self, client):
-        self.client = client
-        with open('./tokens.csv', "r") as f:
-            tokens = f.read().split(",")
-        self.input_token = int(tokens[0]) or 0
-        self.output_token = int(tokens[1]) or 0
-    
-    def get_total_tokens(self):
-        return self.input_token, self.output_token
+    def __init__(self):
+        self._clients: Optional[Tuple[Any, Any]] = None
+        self._lock = threading.Lock()
 
-    def reset_token_count(self):
-        self.input_tokens = 0
-        self.output_tokens = 0
-    
-    def write_tokens_to_file(self):
-        input_token, output_token = self.get_total_tokens()
-        with open('./tokens.csv', "w") as f:
-            f.write(f"{input_token},{output_token}\n")
+    @property
+    def client(self):
+        return self.connect()[0]
+
+    @property
+    def async_client(self):
+        return self.connect()[1]
+
+    def connect(self) -> Tuple[Any, Any]:
+        """Synchronous and asynchronous SDK clients, built on the first call"""
+        if self._clients is None:
+            with self._lock:
+                if self._clients is None:
+                    self._clients = self._create_clients()
+        return self._clients
+
+    @abstractmethod
+    def _create_clients(self) -> Tuple[Any, Any]:
+        pass
 
     @abstractmethod
     def completion(self, messages: list[Dict[str, str]], max_tokens: int = 100, lang:str = 'en') -> str:
@@ -74,14 +79,64 @@ class LLMClient(ABC):
         """
         pass
 
+    @abstractmethod
+    async def acompletion(self, messages: list[Dict[str, str]], max_tokens: int = 100, lang:str = 'en') -> str:
+        """
+        Asynchronous counterpart of `completion`, safe to await from request handlers
+        """
+        pass
+
+    @abstractmethod
+    async def astructured_completion(self, messages: list[Dict[str, str]], response_format: Type[BaseModel], max_tokens: int = 100, lang:str = 'en') -> BaseModel:
+        """
+        Asynchronous counterpart of `structured_completion`, safe to await from request handlers
+        """
+        pass
+
 
 class OpenAIClient(LLMClient):
     """
     OpenAI Language Model client
     """
 
-    def __init__(self):
-        super().__init__(OpenAI(api_key=os.environ.get("OPENAI_API_KEY")))
+    def _create_clients(self) -> Tuple[Any, Any]:
+        from openai import OpenAI, AsyncOpenAI
+        api_key = os.environ.get("OPENAI_API_KEY")
+        return OpenAI(api_key=api_key), AsyncOpenAI(api_key=api_key)
+
+    def _prepare_messages(self, messages: list[Dict[str, str]], lang: str) -> list[Dict[str, str]]:
+        messages.insert(0, {"role": DEVELOPER, "content": prompt_assembler.language(lang).text})
+        messages.insert(1, {"role": DEVELOPER, "content": ANTHROPIC_SYSTEM_PROMPT})
+        return messages
+
+    @staticmethod
+    def _record_usage(model: str, usage) -> None:
+        # OpenAI caches long prompt prefixes by itself, cached tokens are part of prompt_tokens
+        details = getattr(usage, "prompt_tokens_details", None)
+        usage_meter.record(
+            model,
+            input_tokens=usage.prompt_tokens,
+            output_tokens=usage.completion_tokens,
+            cache_read_input_tokens=getattr(details, "cached_tokens", None),
+        )
+
+    def _request_kwargs(
+        self,
+        messages: list[Dict[str, str]],
+        model: str,
+        max_tokens: int,
+        temperature: int,
+        lang: str,
+        **kwargs,
+    ) -> Dict[str, Any]:
+        """Arguments of a chat completion request, shared by the synchronous and asynchronous calls"""
+        return dict(
+            model=model,
+            messages=self._prepare_messages(messages, lang),
+            max_tokens=max_tokens,
+            temperature=temperature,
+            **kwargs,
+        )
 
     @handle_exceptions(default_return="")
     def completion(
@@ -92,17 +147,10 @@ class OpenAIClient(LLMClient):
         temperature: int = 1,
         lang:str = 'en'
     ) -> str:
-        messages.insert(0, {"role": DEVELOPER, "content": OUTPUT_LANGUAGE_PROMPT.format(lang=lang)})
-        messages.insert(1, {"role": DEVELOPER, "content": ANTHROPIC_SYSTEM_PROMPT})
-
         response = self.client.chat.completions.create(
-            model=model,
-            messages=messages,
-            max_tokens=max_tokens,
-            temperature=temperature,
+            **self._request_kwargs(messages, model, max_tokens, temperature, lang)
         )
-        self.input_token += response.usage.prompt_tokens
-        self.output_token += response.usage.completion_tokens
+        self._record_usage(model, response.usage)
         return response.choices[0].message.content
 
     @handle_exceptions(default_return=None)
@@ -116,31 +164,61 @@ class OpenAIClient(LLMClient):
         temperature: int = 1,
         lang:str = 'en',
     ) -> BaseModel:
-        """ """
-        messages.insert(0, {"role": DEVELOPER, "content": OUTPUT_LANGUAGE_PROMPT.format(lang=lang)})
-        messages.insert(1, {"role": DEVELOPER, "content": ANTHROPIC_SYSTEM_PROMPT})
+        response = self.client.beta.chat.completions.parse(**self._request_kwargs(
+            messages, model, max_tokens, temperature, lang,
+            max_completion_tokens=max_completion_tokens, response_format=response_format,
+        ))
+        self._record_usage(model, response.usage)
+        return response.choices[0].message.parsed
 
-        response = self.client.beta.chat.completions.parse(
-            model=model,
-            messages=messages,
-            max_tokens=max_tokens,
-            max_completion_tokens=max_completion_tokens,
-            temperature=temperature,
-            response_format=response_format,
+    @handle_exceptions(default_return="")
+    async def acompletion(
+        self,
+        messages: list[Dict[str, str]],
+        model: str = GPT_4o_MINI,
+        max_tokens: int = 100,
+        temperature: int = 1,
+        lang:str = 'en'
+    ) -> str:
+        response = await self.async_client.chat.completions.create(
+            **self._request_kwargs(messages, model, max_tokens, temperature, lang)
         )
+        self._record_usage(model, response.usage)
+        return response.choices[0].message.content
 
-        self.input_token += response.usage.prompt_tokens
-        self.output_token += response.usage.completion_tokens
+    @handle_exceptions(default_return=None)
+    async def astructured_completion(
+        self,
+        messages: list[Dict[str, str]],
+        response_format: Type[BaseModel],
+        model: str = GPT_4o_MINI,
+        max_tokens: int = 100,
+        max_completion_tokens: int = None,
+        temperature: int = 1,
+        lang:str = 'en',
+    ) -> BaseModel:
+        response = await self.async_client.beta.chat.completions.parse(**self._request_kwargs(
+            messages, model, max_tokens, temperature, lang,
+            max_completion_tokens=max_completion_tokens, response_format=response_format,
+        ))
+        self._record_usage(model, response.usage)
         return response.choices[0].message.parsed
 
 
 class AnthropicClient(LLMClient):
     """
     Anthropic Language Model client
+
+    Requests are laid out for prompt caching: the system prompt and any static context
+    (e.g. the API catalog) form a prefix marked cacheable, ahead of the language
+    instruction and the messages, so it is reused across calls and sessions.
+    Message content blocks can carry their own `cache_control`.
     """
 
-    def __init__(self):
-        super().__init__(Anthropic(api_key=os.environ.get("ANTHROPIC_API_KEY")))
+    def _create_clients(self) -> Tuple[Any, Any]:
+        from anthropic import Anthropic, AsyncAnthropic
+        api_key = os.environ.get("ANTHROPIC_API_KEY")
+        return Anthropic(api_key=api_key), AsyncAnthropic(api_key=api_key)
     
     def _convert_to_anthropic_format(self, messages: list[Dict[str,str]]) -> list[Dict[str, str]]:
         """
@@ -158,40 +236,100 @@ class AnthropicClient(LLMClient):
 
         return messages
 
+    def _system_blocks(self, system_prompt: str, lang: str, context: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """
+        Build the system blocks, with a cache breakpoint after the static prefix
 
-    @handle_exceptions(default_return="")
-    def completion(self, messages: list[Dict[str,str]], max_tokens: int = 100, temperature=.9, lang:str='en', model: str=SONNET_3_7) -> str:
-        self._convert_to_anthropic_format(messages)
+        Args:
+            system_prompt (str): Static system prompt
+            lang (str): Output language, kept after the breakpoint since it varies between users
+            context (Optional[List[str]]): Static documents shared across calls, e.g. the API catalog
 
-        system_prompt = f"{ANTHROPIC_SYSTEM_PROMPT}\n{OUTPUT_LANGUAGE_PROMPT.format(lang=lang or 'en')}"
-        response = self.client.messages.create(
-            model=SONNET_3_7,
-            system=system_prompt,
+        Returns:
+            List[Dict[str, Any]]: System content blocks
+        """
+        blocks = [{"type": "text", "text": text} for text in [system_prompt, *(context or [])]]
+        blocks[-1]["cache_control"] = PROMPT_CACHE_CONTROL
+        blocks.append({"type": "text", "text": prompt_assembler.language(lang).text})
+        return blocks
+
+    @staticmethod
+    def _record_usage(model: str, usage) -> None:
+        usage_meter.record(
+            model,
+            input_tokens=usage.input_tokens,
+            output_tokens=usage.output_tokens,
+            cache_creation_input_tokens=getattr(usage, "cache_creation_input_tokens", None),
+            cache_read_input_tokens=getattr(usage, "cache_read_input_tokens", None),
+        )
+
+    @classmethod
+    def _record_partial_usage(cls, model: str, stream) -> None:
+        """Record the usage of a stream stopped before its end, as far as it got"""
+        try:
+            snapshot = stream.current_message_snapshot
+        except AssertionError:
+            # no message started yet
+            return
+        cls._record_usage(model, snapshot.usage)
+
+    def _request_kwargs(
+        self,
+        messages: list[Dict[str,str]],
+        model: str,
+        max_tokens: int,
+        temperature: float,
+        lang: str,
+        context: Optional[List[str]] = None,
+        system_prompt: str = ANTHROPIC_SYSTEM_PROMPT,
+        response_format: Optional[Type[BaseModel]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Arguments of a messages request, shared by the synchronous, asynchronous and streaming calls
+
+        Args:
+            response_format (Optional[Type[BaseModel]]): Pydantic model of a structured output, whose
+                format instructions are appended to the messages
+        """
+        messages = self._convert_to_anthropic_format(messages)
+        if response_format is not None:
+            messages.append({
+                "role": USER,
+                "content": prompt_assembler.structured_output(response_format).text
+            })
+        return dict(
+            model=model,
+            system=self._system_blocks(system_prompt, lang, context),
             messages=messages,
             max_tokens=max_tokens,
             temperature=temperature,
         )
 
-        self.input_token += response.usage.input_tokens
-        self.output_token += response.usage.output_tokens
-        self.write_tokens_to_file()
+    @handle_exceptions(default_return="")
+    def completion(self, messages: list[Dict[str,str]], max_tokens: int = 100, temperature=.9, lang:str='en', model: str=SONNET_3_7, context: Optional[List[str]] = None) -> str:
+        response = self.client.messages.create(
+            **self._request_kwargs(messages, model, max_tokens, temperature, lang, context)
+        )
+        self._record_usage(model, response.usage)
         return response.content[0].text
     
     @handle_exceptions(default_return=None)
-    async def streaming(self, messages: list[Dict[str,str]], max_tokens: int = 100, temperature=.9, lang:str='en') -> AsyncGenerator[str, None]:
-        self._convert_to_anthropic_format(messages)
-        system_prompt = f"{ANTHROPIC_SYSTEM_PROMPT}\n{OUTPUT_LANGUAGE_PROMPT.format(lang=lang or 'en')}"
-        with self.client.messages.stream(
-            model="claude-3-7-sonnet-20250219",
-            max_tokens=max_tokens,
-            temperature=temperature,
-            messages=messages,
-            system=system_prompt
+    async def streaming(self, messages: list[Dict[str,str]], max_tokens: int = 100, temperature=.9, lang:str='en', model: str=SONNET_3_7_STREAMING, context: Optional[List[str]] = None) -> AsyncGenerator[str, None]:
+        async with self.async_client.messages.stream(
+            **self._request_kwargs(messages, model, max_tokens, temperature, lang, context)
         ) as stream:
-            for text in stream.text_stream:
-                print(text, flush=True)
-                yield f"{text}"
-                await asyncio.sleep(0.1)
+            completed = False
+            try:
+                async for text in stream.text_stream:
+                    yield text
+                completed = True
+            finally:
+                if not completed:
+                    # stopped early, e.g. the client disconnected: leaving the block closes the upstream response
+                    self._record_partial_usage(model, stream)
+
+            message = await stream.get_final_message()
+            self._record_usage(message.model, message.usage)
 
     @handle_exceptions(default_return=None)
     def structured_completion(
@@ -202,36 +340,54 @@ class AnthropicClient(LLMClient):
         max_tokens: int = 1024,
         temperature: float = .9,
         system_prompt: str = ANTHROPIC_SYSTEM_PROMPT,
-        lang:str='en'
+        lang:str='en',
+        context: Optional[List[str]] = None,
     ) -> BaseModel:
-        messages = self._convert_to_anthropic_format(messages)
-        system_prompt = f"{system_prompt}\n{OUTPUT_LANGUAGE_PROMPT.format(lang=lang or 'en')}"
-        output_format_prompt = ANTHROPIC_STRUCTURED_OUTPUT_PROMPT.format(response_format=f"{response_format.__name__}\n{response_format.model_json_schema()}")
-        messages.append({
-            "role": USER,
-            "content": output_format_prompt
-        })
-
         response = self.client.messages.create(
-            model=model,
-            messages=messages,
-            max_tokens=max_tokens,
-            system=system_prompt,
-            temperature=temperature
+            **self._request_kwargs(messages, model, max_tokens, temperature, lang, context, system_prompt, response_format)
         )
+        self._record_usage(model, response.usage)
+        return self._parse_structured_response(response.content[0].text, response_format)
 
-        self.input_token += response.usage.input_tokens
-        self.output_token += response.usage.output_tokens
-        self.write_tokens_to_file()
+    @handle_exceptions(default_return="")
+    async def acompletion(self, messages: list[Dict[str,str]], max_tokens: int = 100, temperature=.9, lang:str='en', model: str=SONNET_3_7, context: Optional[List[str]] = None) -> str:
+        response = await self.async_client.messages.create(
+            **self._request_kwargs(messages, model, max_tokens, temperature, lang, context)
+        )
+        self._record_usage(model, response.usage)
+        return response.content[0].text
 
-        # Parse the response into JSON and then into the Pydantic model
-        try:
+    @handle_exceptions(default_return=None)
+    async def astructured_completion(
+        self,
+        messages: list[Dict[str,str]],
+        response_format: Type[BaseModel],
+        model: str = SONNET_3_7,
+        max_tokens: int = 1024,
+        temperature: float = .9,
+        system_prompt: str = ANTHROPIC_SYSTEM_PROMPT,
+        lang:str='en',
+        context: Optional[List[str]] = None,
+    ) -> BaseModel:
+        response = await self.async_client.messages.create(
+            **self._request_kwargs(messages, model, max_tokens, temperature, lang, context, system_prompt, response_format)
+        )
+        self._record_usage(model, response.usage)
+        return self._parse_structured_response(response.content[0].text, response_format)
 
-            print('*****************')
-            print(type(response.content[0].text))
-            print(f"\033[96m{response.content[0].text}\033[96m")
-            print('*****************')
-            json_response = json.loads(response.content[0].text)
+    def _parse_structured_response(self, text: str, response_format: Type[BaseModel]) -> BaseModel:
+        """
+        Parse the response into JSON and then into the Pydantic model
+
+        Args:
+            text (str): Raw text returned by the model
+            response_format (Type[BaseModel]): Pydantic model to validate the response
+        Returns:
+            BaseModel: Validated Pydantic model
+        """
+        logging.debug(f"Structured response for {response_format.__name__}: {text}")
+        try:
+            json_response = json.loads(text)
             return response_format.model_validate(json_response)
         except json.JSONDecodeError as e:
             raise ValueError(f"Invalid JSON in response: {str(e)}")
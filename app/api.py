@@ -9,6 +9,7 @@ class Endpoint:
     url: str
     description: str
     parameters: Optional[Dict[str, str]] = None
+    cache: Optional[Dict[str, Optional[int]]] = None
 
     def __str__(self):
         return f"{self.url}: {self.description} \n Parameters: {self.parameters}"
@@ -22,6 +23,7 @@ class API():
     def __init__(self, name: str):
         self.name = name
         self.endpoints = []
+        self._rendered: Optional[str] = None
 
         if name == "OpenMeteo":
             with open('known_apis.json', 'r') as file:
@@ -31,11 +33,23 @@ class API():
                 self.endpoints.append(Endpoint(
                     url=endpoint['url'],
                     description=endpoint['description'],
-                    parameters=endpoint['parameters']
+                    parameters=endpoint['parameters'],
+                    cache=endpoint.get('cache')
                 ))
 
+    def find_endpoint(self, url: str) -> Optional[Endpoint]:
+        """Return the endpoint whose base URL matches the given request URL"""
+        base_url = url.split("?", 1)[0].rstrip("/")
+        for endpoint in self.endpoints:
+            if endpoint.url.rstrip("/") == base_url:
+                return endpoint
+        return None
+
     def __str__(self):
-        endpoint_str = "\n".join([str(endpoint) for endpoint in self.endpoints])
-        return f"{self.name} API \n Endpoints: {endpoint_str}"
+        # endpoints don't change after loading, render them once
+        if self._rendered is None:
+            endpoint_str = "\n".join([str(endpoint) for endpoint in self.endpoints])
+            self._rendered = f"{self.name} API \n Endpoints: {endpoint_str}"
+        return self._rendered
 
 OpenMeteoAPI = API("OpenMeteo")
\ No newline at end of file
@@ -0,0 +1,478 @@
+import io
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+import unicodedata
+
+import numpy as np
+
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date, timedelta
+from types import CodeType
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from .api import API, OpenMeteoAPI
+from .ingest import TIME_SERIES_KEYS, to_column_array
+from .models import VisualizationType, DataProcessingType, APIEndpointResponse, NormalizedOpenMeteoData
+from .constants import (
+    OPENMETEO_CACHE_DIR,
+    OPENMETEO_CACHE_COORDINATE_PRECISION,
+    OPENMETEO_CACHE_DEFAULT_TTL_SECONDS,
+    PLAN_CACHE_MAX_ENTRIES,
+    PLAN_CACHE_TTL_SECONDS,
+    PLAN_CACHE_SIMILARITY_THRESHOLD,
+    VISUALIZATION_CODE_CACHE_MAX_ENTRIES,
+)
+
+COORDINATE_PARAMETERS = {"latitude", "longitude"}
+LIST_PARAMETERS = {"hourly", "daily", "current", "models"}
+# words that change which data a question asks for, besides the catalog's variable names
+PLAN_KEY_WORDS = {
+    "maximum", "minimum", "average", "highest", "lowest", "total",
+    "hourly", "daily", "weekly", "monthly", "yearly", "annual", "seasonal",
+    "summer", "winter", "spring", "autumn", "fall",
+}
+NUMBER = re.compile(r"\d+")
+
+
+class OpenMeteoResponseCache:
+    """
+    Persistent on-disk cache for OpenMeteo responses.
+
+    Entries are keyed by the normalized request URL and stored as compressed
+    `.npz` archives with one array per hourly/daily column. Expiry follows the
+    `cache` policy of each endpoint family in `known_apis.json`.
+    """
+
+    VERSION = "v2"
+
+    def __init__(
+        self,
+        directory: str = OPENMETEO_CACHE_DIR,
+        api: API = OpenMeteoAPI,
+        coordinate_precision: int = OPENMETEO_CACHE_COORDINATE_PRECISION,
+    ):
+        self.directory = os.path.join(directory, self.VERSION)
+        self.api = api
+        self.coordinate_precision = coordinate_precision
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "expired": 0, "stores": 0, "bytes_saved": 0, "seconds_saved": 0.0}
+
+    def normalize_url(self, url: str) -> str:
+        """
+        Normalize an endpoint URL so equivalent requests share a cache entry
+
+        Query parameters are sorted, variable lists are sorted and coordinates are rounded.
+
+        Args:
+            url (str): Endpoint URL with inline parameters
+
+        Returns:
+            str: Normalized URL
+        """
+        parts = urlsplit(url.strip())
+        params = []
+        for name, value in parse_qsl(parts.query, keep_blank_values=True):
+            if name in COORDINATE_PARAMETERS:
+                value = ",".join(self._round_coordinate(v) for v in value.split(","))
+            elif name in LIST_PARAMETERS:
+                value = ",".join(sorted(v.strip() for v in value.split(",") if v.strip()))
+            params.append((name, value))
+
+        query = urlencode(sorted(params), safe=",:")
+        return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path.rstrip("/"), query, ""))
+
+    def get(self, url: str) -> Optional[Dict[str, Any]]:
+        """
+        Load a cached payload
+
+        Args:
+            url (str): Normalized endpoint URL
+
+        Returns:
+            Optional[Dict[str, Any]]: Payload with typed hourly/daily columns, or None on a miss
+        """
+        path = self._path(url)
+        try:
+            with np.load(path, allow_pickle=False) as archive:
+                expires_at = float(archive["__expires_at__"])
+                if expires_at < time.time():
+                    self._record(expired=1, misses=1)
+                    os.remove(path)
+                    return None
+
+                payload = json.loads(str(archive["__metadata__"]))
+                for key in archive.files:
+                    if "/" in key:
+                        series, column = key.split("/", 1)
+                        payload.setdefault(series, {})[column] = archive[key]
+
+                self._record(
+                    hits=1,
+                    bytes_saved=int(archive["__nbytes__"]),
+                    seconds_saved=float(archive["__fetch_seconds__"]),
+                )
+        except FileNotFoundError:
+            self._record(misses=1)
+            return None
+        except Exception as e:
+            logging.warning(f"Discarding unreadable cache entry for {url}: {str(e)}")
+            self._record(misses=1)
+            return None
+
+        logging.info(f"OpenMeteo cache hit for {url}")
+        return payload
+
+    def set(self, url: str, payload: Dict[str, Any], nbytes: int = 0, fetch_seconds: float = 0.0) -> None:
+        """
+        Store a payload
+
+        Args:
+            url (str): Normalized endpoint URL
+            payload (Dict[str, Any]): Decoded OpenMeteo response
+            nbytes (int): Size of the response body, used to report bandwidth saved
+            fetch_seconds (float): Time the request took, used to report latency saved
+        """
+        arrays = {
+            "__expires_at__": np.float64(self._expires_at(url)),
+            "__nbytes__": np.int64(nbytes),
+            "__fetch_seconds__": np.float64(fetch_seconds),
+        }
+        metadata = {}
+        for key, value in payload.items():
+            if key in TIME_SERIES_KEYS and isinstance(value, dict):
+                for column, values in value.items():
+                    arrays[f"{key}/{column}"] = to_column_array(column, values)
+            else:
+                metadata[key] = value
+        arrays["__metadata__"] = np.array(json.dumps(metadata))
+
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, **arrays)
+
+        path = self._path(url)
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(buffer.getvalue())
+        os.replace(tmp_path, path)
+        self._record(stores=1)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    def _expires_at(self, url: str) -> float:
+        endpoint = self.api.find_endpoint(url)
+        policy = (endpoint.cache if endpoint else None) or {}
+
+        immutable_after_days = policy.get("immutable_after_days")
+        if immutable_after_days is not None:
+            end_date = dict(parse_qsl(urlsplit(url).query)).get("end_date")
+            try:
+                if end_date and date.fromisoformat(end_date) <= date.today() - timedelta(days=immutable_after_days):
+                    return float("inf")
+            except ValueError:
+                pass
+
+        return time.time() + policy.get("ttl_seconds", OPENMETEO_CACHE_DEFAULT_TTL_SECONDS)
+
+    def _round_coordinate(self, value: str) -> str:
+        try:
+            return f"{float(value):.{self.coordinate_precision}f}"
+        except ValueError:
+            return value.strip()
+
+    def _path(self, url: str) -> str:
+        return os.path.join(self.directory, f"{hashlib.sha256(url.encode()).hexdigest()}.npz")
+
+    def _record(self, **increments) -> None:
+        with self._lock:
+            for name, value in increments.items():
+                self._stats[name] += value
+
+
+@dataclass
+class CachedPlan:
+    """
+    Output of the LLM planning stages of the visualization pipeline.
+
+    Attributes:
+        visualization_type (VisualizationType): Chosen visualization
+        data_requirements (DataProcessingType): Needed data and processing steps
+        api_endpoints (APIEndpointResponse): Endpoints to query
+    """
+    visualization_type: VisualizationType
+    data_requirements: DataProcessingType
+    api_endpoints: APIEndpointResponse
+
+
+class PlanCache:
+    """
+    In-memory LRU cache of visualization plans with TTL.
+
+    Plans are keyed on the request context (topic, location, complexity level,
+    scenario options) and the normalized last user message. When a similarity
+    threshold is set, a message that is close enough to a cached one within
+    the same context also counts as a hit, unless the two differ in a number
+    (e.g. a year) or a variable word (e.g. max and min), which would make the
+    cached plan query the wrong data.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = PLAN_CACHE_MAX_ENTRIES,
+        ttl: float = PLAN_CACHE_TTL_SECONDS,
+        similarity_threshold: Optional[float] = PLAN_CACHE_SIMILARITY_THRESHOLD,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self._entries: OrderedDict[Tuple[str, str], Tuple[float, CachedPlan]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "similar_hits": 0, "misses": 0, "evictions": 0}
+        self._key_words: Optional[frozenset] = None
+
+    def get(self, topic: str, location: str, complexity_level: str, options: List[str], message: str) -> Optional[CachedPlan]:
+        """
+        Look up a plan for the given request
+
+        Args:
+            topic (str): Topic of interest
+            location (str): Location of interest
+            complexity_level (str): Complexity level prompt
+            options (List[str]): Scenario options
+            message (str): Last user message
+
+        Returns:
+            Optional[CachedPlan]: Cached plan, or None on a miss
+        """
+        context = self._context_key(topic, location, complexity_level, options)
+        message = self._normalize_message(message)
+        now = time.time()
+
+        with self._lock:
+            for key, (expires_at, _) in list(self._entries.items()):
+                if expires_at < now:
+                    del self._entries[key]
+
+            entry = self._entries.get((context, message))
+            if entry is not None:
+                self._entries.move_to_end((context, message))
+                self._stats["hits"] += 1
+                return entry[1]
+
+            if self.similarity_threshold is not None:
+                best_key, best_score = None, 0.0
+                terms = self._key_terms(message)
+                for key in self._entries:
+                    if key[0] != context or self._key_terms(key[1]) != terms:
+                        continue
+                    score = self._similarity(message, key[1])
+                    if score > best_score:
+                        best_key, best_score = key, score
+                if best_key is not None and best_score >= self.similarity_threshold:
+                    self._entries.move_to_end(best_key)
+                    self._stats["similar_hits"] += 1
+                    return self._entries[best_key][1]
+
+            self._stats["misses"] += 1
+            return None
+
+    def set(self, topic: str, location: str, complexity_level: str, options: List[str], message: str, plan: CachedPlan) -> None:
+        """
+        Store a plan for the given request
+        """
+        key = (self._context_key(topic, location, complexity_level, options), self._normalize_message(message))
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, plan)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def recent_endpoints(self, topic: str, location: str, complexity_level: str, options: List[str], limit: int) -> List[str]:
+        """
+        Endpoint URLs of the most recent plans made in the same context, newest first
+
+        Follow-up questions in a chat usually need the same data, which makes these
+        good candidates for speculative prefetching.
+
+        Args:
+            topic (str): Topic of interest
+            location (str): Location of interest
+            complexity_level (str): Complexity level prompt
+            options (List[str]): Scenario options
+            limit (int): Maximum number of URLs
+
+        Returns:
+            List[str]: Endpoint URLs
+        """
+        context = self._context_key(topic, location, complexity_level, options)
+        now = time.time()
+        urls: List[str] = []
+        with self._lock:
+            for key, (expires_at, plan) in reversed(self._entries.items()):
+                if key[0] != context or expires_at < now:
+                    continue
+                for endpoint in plan.api_endpoints.endpoints:
+                    if endpoint.url not in urls:
+                        urls.append(endpoint.url)
+                if len(urls) >= limit:
+                    break
+        return urls[:limit]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats, entries=len(self._entries))
+        lookups = stats["hits"] + stats["similar_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["hits"] + stats["similar_hits"]) / lookups if lookups else 0.0
+        return stats
+
+    @classmethod
+    def _context_key(cls, topic: str, location: str, complexity_level: str, options: List[str]) -> str:
+        parts = [cls._normalize_message(topic), cls._normalize_message(location), complexity_level or ""]
+        parts.extend(cls._normalize_message(option) for option in options or [])
+        return hashlib.sha256("\x1f".join(parts).encode()).hexdigest()
+
+    @staticmethod
+    def _normalize_message(message: Any) -> str:
+        text = unicodedata.normalize("NFKC", str(message or "")).lower()
+        text = "".join(c if c.isalnum() or c.isspace() else " " for c in text)
+        return " ".join(text.split())
+
+    def _key_terms(self, message: str) -> Tuple[frozenset, frozenset]:
+        """Numbers and variable words of a normalized message, which must match for a similar hit"""
+        if self._key_words is None:
+            # variable names of the catalog, e.g. temperature_2m_max, split into words
+            self._key_words = frozenset(PLAN_KEY_WORDS | {
+                word
+                for endpoint in OpenMeteoAPI.endpoints
+                for group, parameters in (endpoint.parameters or {}).items() if group in ("hourly_parameters", "daily_parameters")
+                for name in parameters
+                for word in name.split("_") if len(word) > 2 and word.isalpha()
+            })
+        words = set()
+        for word in message.split():
+            if word in self._key_words:
+                words.add(word)
+            elif word.endswith("s") and word[:-1] in self._key_words:
+                words.add(word[:-1])
+        return frozenset(NUMBER.findall(message)), frozenset(words)
+
+    @staticmethod
+    def _similarity(a: str, b: str) -> float:
+        """Jaccard similarity of character trigrams, which works for both spaced and unspaced scripts"""
+        trigrams_a = {a[i:i + 3] for i in range(max(len(a) - 2, 1))}
+        trigrams_b = {b[i:i + 3] for i in range(max(len(b) - 2, 1))}
+        return len(trigrams_a & trigrams_b) / len(trigrams_a | trigrams_b)
+
+
+@dataclass
+class CachedCode:
+    """
+    A generated function that executed successfully.
+
+    Attributes:
+        source (str): Source returned by the LLM
+        code (CodeType): Compiled source, ready to be executed
+    """
+    source: str
+    code: CodeType
+
+
+class VisualizationCodeCache:
+    """
+    In-memory LRU cache of generated `visualize()` functions.
+
+    Entries are keyed by a fingerprint of the visualization spec and of the column
+    schema of the input data, so a hit can render a figure without calling the LLM.
+    """
+
+    def __init__(self, max_entries: int = VISUALIZATION_CODE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, CachedCode] = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    @staticmethod
+    def fingerprint(
+        visualization_type: VisualizationType,
+        complexity_level: str,
+        processing_steps: str,
+        data: List[NormalizedOpenMeteoData],
+        lang: str = 'en',
+    ) -> str:
+        """
+        Fingerprint a visualization request
+
+        Args:
+            visualization_type (VisualizationType): Visualization specification
+            complexity_level (str): Complexity level prompt
+            processing_steps (str): Data processing steps
+            data (List[NormalizedOpenMeteoData]): Input data, only its schema is used
+            lang (str): Output language of the labels baked into the code
+
+        Returns:
+            str: Hex digest identifying the request
+        """
+        schema = []
+        for entry in data:
+            for name in ("metadata", "hourly_data", "daily_data"):
+                df = getattr(entry, name)
+                if df is None:
+                    schema.append((name, None))
+                    continue
+                schema.append((name, str(df.index.dtype), [(str(column), str(dtype)) for column, dtype in df.dtypes.items()]))
+
+        spec = {
+            "visualization_type": visualization_type.model_dump() if visualization_type else None,
+            "complexity_level": complexity_level,
+            "processing_steps": processing_steps,
+            "lang": lang,
+            "schema": schema,
+        }
+        return hashlib.sha256(json.dumps(spec, sort_keys=True, default=str).encode()).hexdigest()
+
+    def get(self, fingerprint: str) -> Optional[CachedCode]:
+        with self._lock:
+            entry = self._entries.get(fingerprint)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(fingerprint)
+            self._stats["hits"] += 1
+            return entry
+
+    def set(self, fingerprint: str, source: str, code: CodeType) -> None:
+        with self._lock:
+            self._entries[fingerprint] = CachedCode(source, code)
+            self._entries.move_to_end(fingerprint)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, fingerprint: str) -> None:
+        with self._lock:
+            if self._entries.pop(fingerprint, None) is not None:
+                self._stats["invalidations"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats, entries=len(self._entries))
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+openmeteo_cache = OpenMeteoResponseCache()
+plan_cache = PlanCache()
+visualization_code_cache = VisualizationCodeCache()
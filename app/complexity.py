@@ -0,0 +1,238 @@
+import re
+import json
+import hashlib
+import logging
+import threading
+import unicodedata
+
+import numpy as np
+
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .constants import (
+    COMPLEXITY_EXAMPLES_PATH,
+    PERSONAS_PATH,
+    COMPLEXITY_LEVELS,
+    COMPLEXITY_CACHE_MAX_ENTRIES,
+    COMPLEXITY_TRAINING_ITERATIONS,
+    COMPLEXITY_L2_PENALTY,
+)
+
+_ascii_word = re.compile(r"[a-z0-9]+")
+# runs of CJK characters, which aren't separated by spaces
+_cjk_run = re.compile(r"[぀-ヿ㐀-鿿豈-﫿]+")
+_number = re.compile(r"\d+")
+
+PREFIX_LENGTH = 4
+
+AGE_BUCKETS = ((13, "child"), (20, "teen"), (35, "young"), (65, "adult"))
+
+
+def age_feature(age_group: Optional[str]) -> Optional[str]:
+    """Age bucket of an age group like `72`, `30s` or `18-24`, None if it holds no age"""
+    match = _number.search(age_group or "")
+    if match is None or int(match.group()) < 5:
+        return None
+    age = int(match.group())
+    for limit, bucket in AGE_BUCKETS:
+        if age < limit:
+            return f"age:{bucket}"
+    return "age:senior"
+
+
+def features(description: str, age_group: Optional[str] = None) -> List[str]:
+    """
+    Text features of a persona: lowercase words and their prefixes, CJK character bigrams and the age bucket
+    """
+    text = unicodedata.normalize("NFKC", description or "").casefold()
+    tokens = _ascii_word.findall(text)
+    # word prefixes match other forms of the same word, e.g. research/researcher
+    tokens.extend(f"{word[:PREFIX_LENGTH]}*" for word in tokens[:] if len(word) > PREFIX_LENGTH)
+    for run in _cjk_run.findall(text):
+        tokens.extend(run[i:i + 2] for i in range(max(len(run) - 1, 1)))
+    age = age_feature(age_group)
+    if age is not None:
+        tokens.append(age)
+    return tokens
+
+
+@dataclass(frozen=True)
+class ComplexityPrediction:
+    """
+    Complexity level predicted for a persona.
+
+    Attributes:
+        level (int): Complexity level
+        confidence (float): Probability of the level
+    """
+    level: int
+    confidence: float
+
+
+class ComplexityClassifier:
+    """
+    In-process complexity level classifier for persona descriptions.
+
+    A multinomial logistic regression over binary text features, trained at load on
+    the labelled examples and the personas. Predictions take microseconds; results,
+    including those of the LLM fallback, are cached by a hash of the normalized input.
+    """
+
+    def __init__(
+        self,
+        examples_path: str = COMPLEXITY_EXAMPLES_PATH,
+        personas_path: str = PERSONAS_PATH,
+        max_cache_entries: int = COMPLEXITY_CACHE_MAX_ENTRIES,
+    ):
+        self.examples_path = examples_path
+        self.personas_path = personas_path
+        self.max_cache_entries = max_cache_entries
+        self._vocabulary: Dict[str, int] = {}
+        self._weights: Optional[np.ndarray] = None
+        self._bias: Optional[np.ndarray] = None
+        self._cache: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "local": 0, "llm": 0}
+
+    def load(self) -> None:
+        """Train the classifier on the labelled examples"""
+        with self._lock:
+            if self._weights is not None:
+                return
+            descriptions, age_groups, levels = self._examples()
+            self._vocabulary, self._weights, self._bias = self._train(descriptions, age_groups, levels)
+        logging.info(f"Complexity classifier trained on {len(levels)} examples, {len(self._vocabulary)} features")
+
+    def predict(self, description: str, age_group: Optional[str] = None) -> ComplexityPrediction:
+        """
+        Predict the complexity level of a persona
+
+        Args:
+            description (str): Description of the user
+            age_group (Optional[str]): Age group of the user
+
+        Returns:
+            ComplexityPrediction: The most likely level and its probability
+        """
+        if self._weights is None:
+            self.load()
+        probabilities = self._probabilities(self._vocabulary, self._weights, self._bias, features(description, age_group))
+        level = int(np.argmax(probabilities))
+        return ComplexityPrediction(level, float(probabilities[level]))
+
+    @staticmethod
+    def key(description: str, age_group: Optional[str] = None) -> str:
+        text = unicodedata.normalize("NFKC", f"{description}\x1f{age_group or ''}").casefold()
+        return hashlib.sha256(" ".join(text.split()).encode()).hexdigest()
+
+    def cached(self, key: str) -> Optional[int]:
+        with self._lock:
+            level = self._cache.get(key)
+            if level is None:
+                self._stats["misses"] += 1
+                return None
+            self._cache.move_to_end(key)
+            self._stats["hits"] += 1
+            return level
+
+    def remember(self, key: str, level: int, source: str) -> None:
+        """Cache the level of an input, `source` being `local` or `llm`"""
+        with self._lock:
+            self._cache[key] = level
+            self._cache.move_to_end(key)
+            if len(self._cache) > self.max_cache_entries:
+                self._cache.popitem(last=False)
+            self._stats[source] += 1
+
+    def evaluate(self, folds: int = 5, threshold: float = 0.0, seed: int = 0) -> Dict[str, float]:
+        """
+        Cross-validate the classifier on the labelled examples
+
+        Args:
+            folds (int): Number of folds
+            threshold (float): Confidence under which predictions would go to the LLM
+            seed (int): Seed of the fold assignment
+
+        Returns:
+            Dict[str, float]: Accuracy overall, share of confident predictions and their accuracy
+        """
+        descriptions, age_groups, levels = self._examples()
+        assignment = np.random.default_rng(seed).permutation(len(levels)) % folds
+        correct = confident = confident_correct = 0
+        for fold in range(folds):
+            train = [i for i in range(len(levels)) if assignment[i] != fold]
+            vocabulary, weights, bias = self._train(
+                [descriptions[i] for i in train], [age_groups[i] for i in train], [levels[i] for i in train]
+            )
+            for i in np.flatnonzero(assignment == fold):
+                probabilities = self._probabilities(vocabulary, weights, bias, features(descriptions[i], age_groups[i]))
+                hit = int(np.argmax(probabilities)) == levels[i]
+                correct += hit
+                if probabilities.max() >= threshold:
+                    confident += 1
+                    confident_correct += hit
+        return {
+            "accuracy": correct / len(levels),
+            "coverage": confident / len(levels),
+            "confident_accuracy": confident_correct / confident if confident else 0.0,
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats, entries=len(self._cache))
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    def _examples(self) -> Tuple[List[str], List[Optional[str]], List[int]]:
+        with open(self.examples_path, "r", encoding="utf-8") as file:
+            examples = json.load(file)
+        descriptions = [example["description"] for example in examples]
+        age_groups = [example.get("age_group") for example in examples]
+        levels = [int(example["level"]) for example in examples]
+        # personas are numbered from 1, in the order of the levels
+        with open(self.personas_path, "r", encoding="utf-8") as file:
+            for persona in json.load(file):
+                descriptions.append(persona["tuning"])
+                age_groups.append(None)
+                levels.append(int(persona["id"]) - 1)
+        return descriptions, age_groups, levels
+
+    @staticmethod
+    def _train(
+        descriptions: Sequence[str], age_groups: Sequence[Optional[str]], levels: Sequence[int]
+    ) -> Tuple[Dict[str, int], np.ndarray, np.ndarray]:
+        tokens = [set(features(description, age)) for description, age in zip(descriptions, age_groups)]
+        vocabulary = {token: index for index, token in enumerate(sorted(set().union(*tokens)))}
+        x = np.zeros((len(tokens), len(vocabulary)))
+        for row, example in enumerate(tokens):
+            x[row, [vocabulary[token] for token in example]] = 1.0
+        x /= np.sqrt(np.maximum(x.sum(axis=1, keepdims=True), 1.0))
+        y = np.eye(COMPLEXITY_LEVELS)[list(levels)]
+
+        # full batch gradient descent on the L2 regularized cross entropy
+        weights = np.zeros((len(vocabulary), COMPLEXITY_LEVELS))
+        bias = np.zeros(COMPLEXITY_LEVELS)
+        rate = 1.0
+        for _ in range(COMPLEXITY_TRAINING_ITERATIONS):
+            probabilities = _softmax(x @ weights + bias)
+            error = (probabilities - y) / len(tokens)
+            weights -= rate * (x.T @ error + COMPLEXITY_L2_PENALTY * weights)
+            bias -= rate * error.sum(axis=0)
+        return vocabulary, weights, bias
+
+    @staticmethod
+    def _probabilities(vocabulary: Dict[str, int], weights: np.ndarray, bias: np.ndarray, tokens: List[str]) -> np.ndarray:
+        indices = list({vocabulary[token] for token in tokens if token in vocabulary})
+        scores = bias + (weights[indices].sum(axis=0) / np.sqrt(len(indices)) if indices else 0.0)
+        return _softmax(scores)
+
+
+def _softmax(scores: np.ndarray) -> np.ndarray:
+    exp = np.exp(scores - scores.max(axis=-1, keepdims=True))
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+complexity_classifier = ComplexityClassifier()
@@ -1,3 +1,5 @@
+import os
+
 ## Output Types
 VISUALIZATION = "visualization"
 TEXT = "text"
@@ -6,15 +8,152 @@ TEXT = "text"
 GPT_4o_MINI = "gpt-4o-mini"
 GPT_4o = "gpt-4o"
 SONNET_3_7 = "claude-3-5-sonnet-20241022"
+SONNET_3_7_STREAMING = "claude-3-7-sonnet-20250219"
 
 ## LLM Options
 DEVELOPER = "developer"
 USER = "user"
 ASSISTANT = "assistant"
 
+## Prompt assembly
+# Endpoint families relevant to each scenario topic, the catalog sent to the LLM is reduced to them
+TOPIC_ENDPOINTS = {
+    "Temperature": (
+        "https://archive-api.open-meteo.com/v1/archive",
+        "https://climate-api.open-meteo.com/v1/climate",
+    ),
+    "Air Pollution": (
+        "https://air-quality-api.open-meteo.com/v1/air-quality",
+        "https://archive-api.open-meteo.com/v1/archive",
+    ),
+}
+PRERENDERED_LANGUAGES = ("en", "ja")
+
+## Complexity classification
+COMPLEXITY_EXAMPLES_PATH = "complexity_examples.json"
+PERSONAS_PATH = "personas.json"
+COMPLEXITY_LEVELS = 3
+# Predictions less likely than this are left to the LLM
+COMPLEXITY_CONFIDENCE_THRESHOLD = 0.7
+COMPLEXITY_CACHE_MAX_ENTRIES = 1024
+COMPLEXITY_TRAINING_ITERATIONS = 1000
+COMPLEXITY_L2_PENALTY = 1e-3
+
+## Data previews
+# Tokens of the data description given to the code generation prompts
+DATA_PREVIEW_TOKEN_BUDGET = 600
+
+## Data statistics
+# Anomalies compare the mean of the last years of the data to the first ones, each at most half of the data
+STATS_BASELINE_YEARS = 30
+STATS_RECENT_YEARS = 10
+STATS_CACHE_MAX_ENTRIES = 256
+
+## Prompt caching
+PROMPT_CACHE_CONTROL = {"type": "ephemeral"}
+
 ## Scenarios
 
 AVAILABLE_SCENARIOS = [
     "Temperature",
     "Air Pollution",
-]
\ No newline at end of file
+]
+
+# Scenarios generated ahead of time per gazetteer place, topic and language, the common locations are filled at startup
+SCENARIO_POOL_SIZE = 3
+SCENARIO_POOL_TTL_SECONDS = 24 * 3600
+SCENARIO_POOL_MAX_KEYS = 64
+SCENARIO_POOL_MAX_TRACKED_CHATS = 1000
+SCENARIO_POOL_CONCURRENCY = 2
+SCENARIO_POOL_LOCATIONS = tuple(filter(None, os.getenv("SCENARIO_POOL_LOCATIONS", "Nagoya").split(",")))
+
+## OpenMeteo fetching
+FETCH_MAX_CONNECTIONS = 10
+FETCH_MAX_CONCURRENCY = 8
+FETCH_TIMEOUT_SECONDS = 30.0
+FETCH_MAX_RETRIES = 2
+FETCH_BACKOFF_SECONDS = 0.5
+# Requests every OpenMeteo host from this base URL instead, with the host as first path segment, e.g. a local stub
+OPENMETEO_BASE_URL = os.getenv("OPENMETEO_BASE_URL")
+
+## OpenMeteo response cache
+OPENMETEO_CACHE_DIR = os.getenv("OPENMETEO_CACHE_DIR", ".cache/openmeteo")
+OPENMETEO_CACHE_COORDINATE_PRECISION = 2
+OPENMETEO_CACHE_DEFAULT_TTL_SECONDS = 3600
+
+## Visualization plan cache
+PLAN_CACHE_MAX_ENTRIES = 256
+PLAN_CACHE_TTL_SECONDS = 24 * 3600
+# None serves exact matches only; similar messages must also share every number and variable word
+PLAN_CACHE_SIMILARITY_THRESHOLD = None
+
+## Generated visualize() code cache
+VISUALIZATION_CODE_CACHE_MAX_ENTRIES = 128
+
+## Generated code sandbox
+SANDBOX_WORKERS = int(os.getenv("SANDBOX_WORKERS", "2"))
+SANDBOX_TIMEOUT_SECONDS = float(os.getenv("SANDBOX_TIMEOUT_SECONDS", "30"))
+SANDBOX_MAX_RSS_MB = int(os.getenv("SANDBOX_MAX_RSS_MB", "512"))
+SANDBOX_WATCHDOG_INTERVAL_SECONDS = 0.1
+
+## Geocoding
+GAZETTEER_PATH = "cities.json"
+GEOCODING_MIN_SIMILARITY = 0.5
+GEOCODING_SNAP_DEGREES = 0.25
+
+## OpenMeteo query builder
+QUERY_CHUNK_MIN_DAYS = 366
+
+## Speculative prefetching
+# endpoints prefetched while the LLM plans, only the first yearly chunk of each
+SPECULATIVE_MAX_FETCHES = 1
+
+## Figure downsampling
+FIGURE_MAX_POINTS = 20000
+FIGURE_MIN_TRACE_POINTS = 500
+
+## Figure serialization
+FIGURE_BINARY_ARRAYS = os.getenv("FIGURE_BINARY_ARRAYS", "1") == "1"
+FIGURE_BINARY_MIN_LENGTH = 8
+RESPONSE_GZIP_MIN_BYTES = 1024
+RESPONSE_GZIP_LEVEL = 6
+
+## Plotly templates
+DEFAULT_PLOT_TEMPLATE = "climate"
+PUBLISHED_PLOT_TEMPLATES = (DEFAULT_PLOT_TEMPLATE, "plotly", "plotly_white", "simple_white")
+TEMPLATE_CACHE_MAX_AGE_SECONDS = 24 * 3600
+
+## Visualization pipeline events
+EVENT_PLAN = "plan"
+EVENT_DATA_REQUIREMENTS = "data_requirements"
+EVENT_ENDPOINTS = "endpoints"
+EVENT_DATA = "data"
+EVENT_FIGURE = "figure"
+EVENT_ERROR = "error"
+
+## Streaming
+EVENT_TOKEN = "token"
+EVENT_DONE = "done"
+# Tokens are sent in frames, at most this late, or as soon as this many characters are buffered
+STREAM_FLUSH_INTERVAL_SECONDS = 0.05
+STREAM_FLUSH_MAX_CHARS = 256
+STREAM_HEARTBEAT_SECONDS = 15
+
+## LLM usage accounting
+USAGE_LOG_PATH = os.getenv("USAGE_LOG_PATH", "usage.jsonl")
+USAGE_FLUSH_INTERVAL_SECONDS = 30
+USAGE_MAX_TRACKED_CHATS = 1000
+
+## Session store
+SESSION_STORE_BACKEND = os.getenv("SESSION_STORE_BACKEND", "memory")
+SESSION_STORE_PATH = os.getenv("SESSION_STORE_PATH", "sessions.sqlite3")
+SESSION_MAX_ENTRIES = 200
+SESSION_MAX_MEMORY_MB = 256
+SESSION_TTL_SECONDS = 6 * 3600
+
+## Startup
+# `lazy` serves as soon as the app is imported and warms up in the background, `eager` warms up before serving
+STARTUP_MODE = os.getenv("STARTUP_MODE", "lazy")
+COLD_START_TARGET_SECONDS = float(os.getenv("COLD_START_TARGET_SECONDS", "3"))
+# BPE files of the tokenizer, downloaded at image build so none is fetched at boot
+TIKTOKEN_CACHE_DIR = os.getenv("TIKTOKEN_CACHE_DIR", ".tiktoken")
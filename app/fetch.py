@@ -0,0 +1,225 @@
+import time
+import asyncio
+import logging
+
+import httpx
+import orjson
+
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from .cache import OpenMeteoResponseCache, openmeteo_cache
+from .ingest import decode_payload
+from .constants import (
+    FETCH_MAX_CONNECTIONS,
+    FETCH_MAX_CONCURRENCY,
+    FETCH_TIMEOUT_SECONDS,
+    FETCH_MAX_RETRIES,
+    FETCH_BACKOFF_SECONDS,
+    OPENMETEO_BASE_URL,
+)
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class OpenMeteoFetcher:
+    """
+    Concurrent HTTP fetcher for OpenMeteo endpoints.
+
+    All requests share a single keep-alive connection pool, the number of requests
+    in flight is bounded, and transient failures are retried with exponential backoff.
+    When a response cache is given, URLs are normalized and served from it first.
+    Concurrent requests for the same URL share a single download, which also lets
+    callers join a speculative prefetch that is already in flight. With a base URL,
+    downloads go to it instead of the OpenMeteo hosts, keys stay the original URLs.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = FETCH_MAX_CONNECTIONS,
+        max_concurrency: int = FETCH_MAX_CONCURRENCY,
+        timeout: float = FETCH_TIMEOUT_SECONDS,
+        max_retries: int = FETCH_MAX_RETRIES,
+        backoff: float = FETCH_BACKOFF_SECONDS,
+        cache: Optional[OpenMeteoResponseCache] = None,
+        base_url: Optional[str] = OPENMETEO_BASE_URL,
+    ):
+        self.max_connections = max_connections
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.cache = cache
+        self.base_url = base_url.rstrip("/") if base_url else None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[str, int] = {}
+        self._prefetchers: Dict[str, int] = {}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+            )
+        return self._client
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def key(self, url: str) -> str:
+        """Key under which a URL is cached and deduplicated"""
+        return self.cache.normalize_url(url) if self.cache is not None else url
+
+    def request_url(self, url: str) -> str:
+        """URL actually requested for an endpoint URL, e.g. `{base_url}/archive-api.open-meteo.com/v1/archive?...`"""
+        if self.base_url is None:
+            return url
+        parts = urlsplit(url)
+        return f"{self.base_url}/{parts.netloc}{parts.path}" + (f"?{parts.query}" if parts.query else "")
+
+    async def fetch(self, url: str) -> Optional[Dict[str, Any]]:
+        """
+        Fetch a single endpoint and decode its JSON payload
+
+        Args:
+            url (str): Endpoint URL with inline parameters
+
+        Returns:
+            Optional[Dict[str, Any]]: Decoded payload with typed hourly/daily arrays, or None if the request failed
+        """
+        url = self.key(url)
+        task = self._shared_task(url)
+        self._waiters[url] = self._waiters.get(url, 0) + 1
+        try:
+            # shielded so a cancelled caller doesn't abort the download for other waiters
+            return await asyncio.shield(task)
+        finally:
+            self._waiters[url] -= 1
+            if not self._waiters[url]:
+                del self._waiters[url]
+
+    def prefetch(self, url: str) -> asyncio.Task:
+        """
+        Start fetching an endpoint in the background, e.g. speculatively
+
+        Every call must be paired with a `release_prefetch` once the caller no longer needs it.
+
+        Args:
+            url (str): Endpoint URL with inline parameters
+
+        Returns:
+            asyncio.Task: The shared download, later `fetch` calls for the same URL join it
+        """
+        url = self.key(url)
+        self._prefetchers[url] = self._prefetchers.get(url, 0) + 1
+        return self._shared_task(url)
+
+    def release_prefetch(self, url: str) -> bool:
+        """
+        Give up a prefetch; the download is cancelled once no other prefetch or `fetch` caller needs it
+
+        Returns:
+            bool: Whether the download was cancelled
+        """
+        url = self.key(url)
+        owners = self._prefetchers.get(url, 0) - 1
+        if owners > 0:
+            self._prefetchers[url] = owners
+            return False
+        self._prefetchers.pop(url, None)
+        task = self._inflight.get(url)
+        if task is None or task.done() or self._waiters.get(url):
+            return False
+        task.cancel()
+        return True
+
+    def _shared_task(self, url: str) -> asyncio.Task:
+        task = self._inflight.get(url)
+        if task is None:
+            task = asyncio.create_task(self._fetch(url))
+            self._inflight[url] = task
+            task.add_done_callback(lambda _: self._inflight.pop(url, None))
+        return task
+
+    async def _fetch(self, url: str) -> Optional[Dict[str, Any]]:
+        if self.cache is None:
+            json_data, _ = await self._download(url)
+            return json_data
+
+        json_data = await asyncio.to_thread(self.cache.get, url)
+        if json_data is not None:
+            return json_data
+
+        started = time.perf_counter()
+        json_data, nbytes = await self._download(url)
+        if json_data is not None:
+            try:
+                await asyncio.to_thread(
+                    self.cache.set, url, json_data,
+                    nbytes=nbytes,
+                    fetch_seconds=time.perf_counter() - started,
+                )
+            except Exception as e:
+                logging.warning(f"Could not cache response for {url}: {str(e)}")
+        return json_data
+
+    async def _download(self, url: str) -> Tuple[Optional[Dict[str, Any]], int]:
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self.semaphore:
+                    response = await self.client.get(self.request_url(url))
+
+                if response.status_code in RETRYABLE_STATUS_CODES and attempt < self.max_retries:
+                    raise httpx.HTTPStatusError(
+                        f"Retryable status code {response.status_code}", request=response.request, response=response
+                    )
+                if response.status_code != 200:
+                    raise ValueError(f"Invalid response status code {response.status_code} from {url}")
+
+                try:
+                    json_data = decode_payload(response.content)
+                except orjson.JSONDecodeError as e:
+                    raise ValueError(f"Invalid JSON response from {url}: {str(e)}")
+                if json_data is None:
+                    raise ValueError(f"Null JSON response from {url}")
+                return json_data, len(response.content)
+
+            except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                if attempt >= self.max_retries:
+                    logging.error(f"API Request Error for {url}: {str(e)}")
+                    return None, 0
+                delay = self.backoff * (2 ** attempt)
+                logging.warning(f"Retrying {url} in {delay:.1f}s ({attempt + 1}/{self.max_retries}): {str(e)}")
+                await asyncio.sleep(delay)
+            except ValueError as e:
+                logging.error(f"Data Validation Error for {url}: {str(e)}")
+                return None, 0
+
+    async def fetch_all(self, urls: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """
+        Fetch all endpoints concurrently
+
+        Args:
+            urls (List[str]): Endpoint URLs
+
+        Returns:
+            List[Optional[Dict[str, Any]]]: Payloads in the same order as `urls`, None for failed requests
+        """
+        return await asyncio.gather(*(self.fetch(url) for url in urls))
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+openmeteo_fetcher = OpenMeteoFetcher(cache=openmeteo_cache)
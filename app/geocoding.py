@@ -0,0 +1,290 @@
+import json
+import bisect
+import unicodedata
+
+import numpy as np
+
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from .constants import GAZETTEER_PATH, GEOCODING_MIN_SIMILARITY, GEOCODING_SNAP_DEGREES
+
+SEPARATORS = ",、，/()（）"
+STOP_WORDS = {"city", "prefecture", "pref", "ken", "shi", "metropolis"}
+# names a location may be qualified with, by country code; the code itself also qualifies
+COUNTRY_NAMES = {
+    "AE": ["United Arab Emirates", "UAE", "アラブ首長国連邦"],
+    "AR": ["Argentina", "アルゼンチン"],
+    "AT": ["Austria", "オーストリア"],
+    "AU": ["Australia", "オーストラリア"],
+    "BE": ["Belgium", "ベルギー"],
+    "BR": ["Brazil", "Brasil", "ブラジル"],
+    "CA": ["Canada", "カナダ"],
+    "CH": ["Switzerland", "スイス"],
+    "CL": ["Chile", "チリ"],
+    "CN": ["China", "中国"],
+    "CO": ["Colombia", "コロンビア"],
+    "CZ": ["Czechia", "Czech Republic", "チェコ"],
+    "DE": ["Germany", "Deutschland", "ドイツ"],
+    "DK": ["Denmark", "デンマーク"],
+    "EG": ["Egypt", "エジプト"],
+    "ES": ["Spain", "España", "スペイン"],
+    "FI": ["Finland", "フィンランド"],
+    "FR": ["France", "フランス"],
+    "GB": ["United Kingdom", "UK", "Great Britain", "Britain", "England", "Scotland", "Wales", "イギリス", "英国"],
+    "GR": ["Greece", "ギリシャ"],
+    "HK": ["Hong Kong", "香港"],
+    "HU": ["Hungary", "ハンガリー"],
+    "ID": ["Indonesia", "インドネシア"],
+    "IE": ["Ireland", "アイルランド"],
+    "IN": ["India", "インド"],
+    "IR": ["Iran", "イラン"],
+    "IT": ["Italy", "Italia", "イタリア"],
+    "JP": ["Japan", "Nippon", "Nihon", "日本"],
+    "KE": ["Kenya", "ケニア"],
+    "KR": ["South Korea", "Korea", "韓国"],
+    "MX": ["Mexico", "México", "メキシコ"],
+    "MY": ["Malaysia", "マレーシア"],
+    "NG": ["Nigeria", "ナイジェリア"],
+    "NL": ["Netherlands", "Holland", "オランダ"],
+    "NO": ["Norway", "ノルウェー"],
+    "NZ": ["New Zealand", "ニュージーランド"],
+    "PE": ["Peru", "ペルー"],
+    "PH": ["Philippines", "フィリピン"],
+    "PL": ["Poland", "ポーランド"],
+    "PT": ["Portugal", "ポルトガル"],
+    "RU": ["Russia", "ロシア"],
+    "SA": ["Saudi Arabia", "サウジアラビア"],
+    "SE": ["Sweden", "スウェーデン"],
+    "SG": ["Singapore", "シンガポール"],
+    "TH": ["Thailand", "タイ"],
+    "TR": ["Turkey", "Türkiye", "トルコ"],
+    "TW": ["Taiwan", "台湾"],
+    "US": ["United States", "United States of America", "USA", "America", "アメリカ", "米国"],
+    "VN": ["Vietnam", "Viet Nam", "ベトナム"],
+    "ZA": ["South Africa", "南アフリカ"],
+}
+JAPANESE_SUFFIXES = ("市", "区")
+MIN_PREFIX_LENGTH = 3
+
+
+@dataclass(frozen=True)
+class Place:
+    """
+    A location of the gazetteer.
+
+    Attributes:
+        name (str): English name
+        name_ja (str): Japanese name
+        country (str): ISO 3166-1 alpha-2 country code
+        latitude (float): Canonical latitude
+        longitude (float): Canonical longitude
+    """
+    name: str
+    name_ja: str
+    country: str
+    latitude: float
+    longitude: float
+
+    @property
+    def coordinates(self) -> Tuple[float, float]:
+        return self.latitude, self.longitude
+
+    def __str__(self):
+        return f"{self.name} ({self.name_ja}), {self.country} (latitude={self.latitude}, longitude={self.longitude})"
+
+
+def normalize_name(text: str) -> str:
+    """
+    Normalize a place name for lookups: width, case, Latin accents and punctuation are ignored
+
+    Args:
+        text (str): Free-text place name, in English or Japanese
+
+    Returns:
+        str: Space separated normalized words
+    """
+    chars: List[str] = []
+    for c in unicodedata.normalize("NFKD", str(text or "")):
+        # drop accents on Latin letters only, kana voicing marks are meaningful
+        if unicodedata.combining(c) and chars and chars[-1].isascii():
+            continue
+        chars.append(c)
+    text = unicodedata.normalize("NFKC", "".join(chars)).lower()
+    text = "".join(c if c.isalnum() else " " for c in text)
+    return " ".join(text.split())
+
+
+def _trigrams(key: str) -> Set[str]:
+    padded = f"^{key}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class Gazetteer:
+    """
+    Local geocoder over a bundled list of cities.
+
+    Every English name, Japanese name and alias is indexed under a normalized key.
+    Lookups try exact keys first, then unambiguous prefixes through a sorted key list,
+    then fuzzy matching on character trigrams, which works for both English and
+    Japanese names. When the text has several comma separated parts, a place found
+    from one part must agree with every other part, e.g. "Paris, France" but not
+    "Paris, Texas": a qualifier that doesn't match leaves the location unresolved.
+    """
+
+    def __init__(self, path: str = GAZETTEER_PATH, min_similarity: float = GEOCODING_MIN_SIMILARITY):
+        self.min_similarity = min_similarity
+        self.places: List[Place] = []
+        self._keys: Dict[str, int] = {}
+        self._trigram_index: Dict[str, Set[str]] = {}
+
+        with open(path, "r") as file:
+            entries = json.load(file)
+
+        for entry in entries:
+            place = Place(
+                name=entry["name"],
+                name_ja=entry["name_ja"],
+                country=entry["country"],
+                latitude=float(entry["latitude"]),
+                longitude=float(entry["longitude"]),
+            )
+            self.places.append(place)
+            for name in [place.name, place.name_ja, *entry.get("aliases", [])]:
+                key = normalize_name(name).replace(" ", "")
+                if key and key not in self._keys:
+                    self._keys[key] = len(self.places) - 1
+                    for trigram in _trigrams(key):
+                        self._trigram_index.setdefault(trigram, set()).add(key)
+
+        self._sorted_keys = sorted(self._keys)
+        self._place_keys: Dict[int, Set[str]] = {}
+        for key, index in self._keys.items():
+            self._place_keys.setdefault(index, set()).add(key)
+        self._country_keys: Dict[str, Set[str]] = {
+            code: {normalize_name(name).replace(" ", "") for name in [code, *names]}
+            for code, names in COUNTRY_NAMES.items()
+        }
+        self._coordinates = np.array([place.coordinates for place in self.places], dtype=np.float64).reshape(-1, 2)
+
+    def resolve(self, text: str) -> Optional[Place]:
+        """
+        Resolve a free-text location to a place
+
+        Args:
+            text (str): Location, e.g. "Nagoya, Japan", "名古屋市" or "Sao Paulo"
+
+        Returns:
+            Optional[Place]: Best matching place, or None if nothing is close enough or
+                a qualifier contradicts it, e.g. "Paris, Texas"
+        """
+        whole = normalize_name(text).replace(" ", "")
+        if whole in self._keys:
+            return self.places[self._keys[whole]]
+
+        parts = self._split(text)
+        if len(parts) <= 1:
+            return self._match(text)
+        for position, part in enumerate(parts):
+            place = self._match(part)
+            if place is not None and all(
+                self._qualifies(place, other) for other in parts[:position] + parts[position + 1:]
+            ):
+                return place
+        return None
+
+    def _match(self, text: str) -> Optional[Place]:
+        candidates = list(self._candidate_keys(text))
+
+        for key in candidates:
+            if key in self._keys:
+                return self.places[self._keys[key]]
+
+        for key in candidates:
+            place = self._match_prefix(key)
+            if place is not None:
+                return place
+
+        best_key, best_score = None, 0.0
+        for key in candidates:
+            trigrams = _trigrams(key)
+            for other in set().union(*(self._trigram_index.get(trigram, set()) for trigram in trigrams)):
+                other_trigrams = _trigrams(other)
+                score = len(trigrams & other_trigrams) / len(trigrams | other_trigrams)
+                if score > best_score:
+                    best_key, best_score = other, score
+        if best_key is not None and best_score >= self.min_similarity:
+            return self.places[self._keys[best_key]]
+        return None
+
+    def _qualifies(self, place: Place, part: str) -> bool:
+        """Whether a part of the text is consistent with the place: its name, an alias, its country or only generic words"""
+        significant = [word for word in normalize_name(part).split() if word not in STOP_WORDS]
+        if not significant:
+            return True
+        key = "".join(significant)
+        variants = {key} | {key[:-len(suffix)] for suffix in JAPANESE_SUFFIXES if key.endswith(suffix) and len(key) > 1}
+        index = self.places.index(place)
+        return bool(variants & (self._place_keys.get(index, set()) | self._country_keys.get(place.country, set())))
+
+    def nearest(self, latitude: float, longitude: float, max_distance: float = GEOCODING_SNAP_DEGREES) -> Optional[Place]:
+        """
+        Closest place to the given coordinates, if within `max_distance` degrees
+        """
+        if not self.places:
+            return None
+        distances = np.hypot(self._coordinates[:, 0] - latitude, self._coordinates[:, 1] - longitude)
+        index = int(np.argmin(distances))
+        return self.places[index] if distances[index] <= max_distance else None
+
+    def _candidate_keys(self, text: str) -> Iterable[str]:
+        """
+        The whole text first, then each comma separated part, with and without generic words
+        and suffixes, then the leading words of each part
+        """
+        seen = set()
+        for piece in [text, *self._split(text)]:
+            words = normalize_name(piece).split()
+            significant = [word for word in words if word not in STOP_WORDS]
+            keys = ["".join(words), "".join(significant)]
+            keys.extend("".join(significant[:count]) for count in range(len(significant) - 1, 0, -1))
+            for key in keys:
+                variants = [key] + [key[:-len(suffix)] for suffix in JAPANESE_SUFFIXES if key.endswith(suffix) and len(key) > 1]
+                for variant in variants:
+                    if variant and variant not in seen:
+                        seen.add(variant)
+                        yield variant
+
+    @staticmethod
+    def _split(text: str) -> List[str]:
+        """Non-empty comma separated parts of the text"""
+        pieces = [text]
+        for separator in SEPARATORS:
+            pieces = [part for piece in pieces for part in piece.split(separator)]
+        return [piece for piece in pieces if normalize_name(piece)]
+
+    def _match_prefix(self, key: str) -> Optional[Place]:
+        if len(key) < MIN_PREFIX_LENGTH:
+            return None
+
+        # the query is the start of a single known place, e.g. "nago"
+        start = bisect.bisect_left(self._sorted_keys, key)
+        matches = set()
+        for other in self._sorted_keys[start:]:
+            if not other.startswith(key):
+                break
+            matches.add(self._keys[other])
+        if len(matches) == 1:
+            return self.places[matches.pop()]
+
+        # a known place is the start of an unspaced query, e.g. "名古屋駅"
+        if key.isascii():
+            return None
+        for length in range(len(key) - 1, MIN_PREFIX_LENGTH - 1, -1):
+            prefix = key[:length]
+            if prefix in self._keys:
+                return self.places[self._keys[prefix]]
+        return None
+
+
+gazetteer = Gazetteer()
@@ -0,0 +1,292 @@
+import orjson
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from typing import Any, Dict, Optional
+
+from .models import NormalizedOpenMeteoData
+
+TIME_SERIES_KEYS = ("hourly", "daily")
+TIME_COLUMN = "time"
+VALUE_DTYPE = np.float32
+
+JSON_WHITESPACE = b" \t\r\n"
+
+
+def to_column_array(column: str, values: Any) -> np.ndarray:
+    """
+    Convert an hourly/daily column of an OpenMeteo payload to a typed numpy array
+
+    Times become `datetime64[s]`, from ISO 8601 strings or UNIX timestamps. Values become
+    float32 with nulls as NaN, or strings when they aren't numeric.
+
+    Args:
+        column (str): Column name
+        values (Any): List or array of values
+
+    Returns:
+        np.ndarray: Typed column
+    """
+    if column == TIME_COLUMN:
+        # parses ISO 8601 strings and takes integers as seconds, without an intermediate string array
+        return np.asarray(values, dtype="datetime64[s]")
+    try:
+        return np.asarray(values, dtype=VALUE_DTYPE)
+    except (TypeError, ValueError):
+        return np.asarray(values, dtype=str)
+
+
+def to_columnar(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Convert the hourly/daily series of a payload to typed arrays, in place
+
+    The decoded Python lists are released column by column, so a long series
+    never exists twice as lists.
+
+    Args:
+        payload (Dict[str, Any]): Decoded OpenMeteo response
+
+    Returns:
+        Dict[str, Any]: The same payload
+    """
+    for key in TIME_SERIES_KEYS:
+        series = payload.get(key)
+        if isinstance(series, dict):
+            for column in list(series):
+                series[column] = to_column_array(column, series[column])
+    return payload
+
+
+# positions of the separators in the ISO 8601 times OpenMeteo returns, by length
+ISO_SEPARATORS = {10: {4: b"-", 7: b"-"}, 16: {4: b"-", 7: b"-", 10: b"T", 13: b":"}}
+
+
+def parse_iso_times(values: np.ndarray) -> np.ndarray:
+    """
+    Parse fixed-width `YYYY-MM-DD` or `YYYY-MM-DDTHH:MM` byte strings to datetime64[s]
+
+    The digits are read as a byte matrix with vectorized arithmetic, which is several
+    times faster than numpy's string conversion. Other layouts use the latter.
+
+    Args:
+        values (np.ndarray): Byte strings, dtype `S10` or `S16`
+
+    Returns:
+        np.ndarray: Times as datetime64[s]
+    """
+    width = values.dtype.itemsize
+    separators = ISO_SEPARATORS.get(width)
+    if separators is None or len(values) == 0:
+        return values.astype("datetime64[s]")
+    chars = values.view(np.uint8).reshape(-1, width)
+    digit_positions = [i for i in range(width) if i not in separators]
+    digits = chars[:, digit_positions].astype(np.int64) - ord("0")
+    if (digits < 0).any() or (digits > 9).any() or any((chars[:, i] != ord(c)).any() for i, c in separators.items()):
+        return values.astype("datetime64[s]")
+
+    year = digits[:, 0] * 1000 + digits[:, 1] * 100 + digits[:, 2] * 10 + digits[:, 3]
+    month = digits[:, 4] * 10 + digits[:, 5]
+    day = digits[:, 6] * 10 + digits[:, 7]
+    if (month < 1).any() or (month > 12).any() or (day < 1).any() or (day > 31).any():
+        return values.astype("datetime64[s]")
+    times = ((year - 1970) * 12 + month - 1).astype("datetime64[M]").astype("datetime64[D]") + (day - 1)
+    times = times.astype("datetime64[s]")
+    if width == 16:
+        times += (digits[:, 8] * 10 + digits[:, 9]) * 3600 + (digits[:, 10] * 10 + digits[:, 11]) * 60
+    return times
+
+
+def parse_column(column: str, span: bytes) -> np.ndarray:
+    """
+    Parse the inside of a flat JSON array straight into the typed column `to_column_array` would give
+
+    Numbers (with nulls as NaN) are parsed by numpy in C, and ISO 8601 times of equal
+    length are viewed as fixed-width byte strings, so no Python object is created per
+    value. Anything else is decoded with orjson, one column at a time.
+
+    Args:
+        column (str): Column name
+        span (bytes): Array content, without the brackets
+
+    Returns:
+        np.ndarray: Typed column
+    """
+    span = span.strip()
+    if not span:
+        return to_column_array(column, [])
+
+    if column == TIME_COLUMN and span[:1] == b'"':
+        width = span.index(b'"', 1) - 1
+        separator = span[width + 2:span.find(b'"', width + 2)]
+        record = np.dtype([("open", "S1"), ("value", f"S{width}"), ("close", f"S{1 + len(separator)}")])
+        buffer = span + separator
+        if separator.strip() == b"," and len(buffer) % record.itemsize == 0:
+            times = np.frombuffer(buffer, dtype=record)
+            if (times["open"] == b'"').all() and (times["close"] == b'"' + separator).all():
+                return parse_iso_times(np.ascontiguousarray(times["value"]))
+    elif span[:1] != b'"':
+        dtype = np.int64 if column == TIME_COLUMN else np.float64
+        with warnings.catch_warnings():
+            # a token numpy can't read stops the parse early, which the length check catches
+            warnings.simplefilter("ignore", DeprecationWarning)
+            try:
+                values = np.fromstring(span.replace(b"null", b"nan"), dtype=dtype, sep=",")
+            except ValueError:
+                values = None
+        if values is not None and len(values) == span.count(b",") + 1:
+            return values.astype("datetime64[s]") if column == TIME_COLUMN else values.astype(VALUE_DTYPE)
+
+    return to_column_array(column, orjson.loads(b"[" + span + b"]"))
+
+
+def _skip_whitespace(content: bytes, position: int, end: int) -> int:
+    while position < end and content[position] in JSON_WHITESPACE:
+        position += 1
+    return position
+
+
+def _expect(content: bytes, position: int, end: int, token: bytes) -> int:
+    """Position after `token`, past any whitespace before it, or -1 when something else comes first"""
+    position = _skip_whitespace(content, position, end)
+    return position + 1 if content[position:position + 1] == token else -1
+
+
+def _decode_columns(content: bytes, start: int, end: int) -> Optional[Dict[str, np.ndarray]]:
+    """Parse the `"name": [...]` members between `start` and `end` into typed columns, None if one isn't a flat array"""
+    columns = {}
+    position = _skip_whitespace(content, start, end)
+    while position < end:
+        name_end = content.find(b'"', position + 1, end)
+        if content[position:position + 1] != b'"' or name_end < 0:
+            return None
+        name = content[position + 1:name_end]
+        position = _expect(content, name_end + 1, end, b":")
+        position = _expect(content, position, end, b"[") if position >= 0 else -1
+        if position < 0 or b"\\" in name:
+            return None
+        close = content.find(b"]", position, end)
+        if close < 0 or content.find(b"[", position, close) >= 0:
+            return None
+        columns[name.decode()] = parse_column(name.decode(), content[position:close])
+        position = _skip_whitespace(content, close + 1, end)
+        if position < end:
+            position = _expect(content, position, end, b",")
+            if position < 0:
+                return None
+            position = _skip_whitespace(content, position, end)
+    return columns
+
+
+def _decode_series(content: bytes) -> Optional[Dict[str, Any]]:
+    """
+    Decode a payload whose hourly/daily objects hold flat arrays, parsing each array
+    into a typed column without building a Python list of its values
+
+    Only `bytes.find` scans the body, the rest of the payload goes to orjson with
+    the series objects emptied.
+
+    Returns:
+        Optional[Dict[str, Any]]: The columnar payload, or None when the body isn't laid out that way
+    """
+    if content[:1] != b"{":
+        return None
+    objects = []
+    for key in TIME_SERIES_KEYS:
+        position = content.find(f'"{key}"'.encode())
+        while position >= 0:
+            start = _expect(content, position + len(key) + 2, len(content), b":")
+            start = _expect(content, start, len(content), b"{") if start >= 0 else -1
+            if start >= 0:
+                end = content.find(b"}", start)
+                if end < 0 or content.find(b"{", start, end) >= 0:
+                    return None
+                objects.append((start, end, key))
+                break
+            position = content.find(f'"{key}"'.encode(), position + 1)
+    if not objects:
+        return None
+
+    skeleton, series, position = [], {}, 0
+    for start, end, key in sorted(objects):
+        columns = _decode_columns(content, start, end)
+        if columns is None:
+            return None
+        series[key] = columns
+        skeleton.append(content[position:start])
+        position = end
+    skeleton.append(content[position:])
+
+    payload = orjson.loads(b"".join(skeleton))
+    if not isinstance(payload, dict) or any(payload.get(key) != {} for key in series):
+        # a nested object matched, e.g. a unit dictionary named like a series
+        return None
+    payload.update(series)
+    return payload
+
+
+def decode_payload(content: bytes) -> Optional[Dict[str, Any]]:
+    """
+    Decode an OpenMeteo JSON response straight to columnar form
+
+    The hourly/daily arrays are parsed column by column into typed arrays, so the
+    peak memory of a decode stays close to the body plus the resulting columns.
+    Bodies laid out differently are decoded with orjson as a whole.
+
+    Args:
+        content (bytes): Response body
+
+    Returns:
+        Optional[Dict[str, Any]]: Payload with typed hourly/daily arrays, or None for a null body
+
+    Raises:
+        orjson.JSONDecodeError: The body isn't valid JSON
+    """
+    payload = _decode_series(content)
+    if payload is not None:
+        return payload
+    payload = orjson.loads(content)
+    if payload is None:
+        return None
+    return to_columnar(payload)
+
+
+def series_frame(series: Dict[str, Any]) -> pd.DataFrame:
+    """
+    Build an hourly/daily dataframe indexed by a DatetimeIndex named `time`
+
+    Args:
+        series (Dict[str, Any]): Columns of the series, as lists or arrays
+
+    Returns:
+        pd.DataFrame: Typed dataframe
+    """
+    columns = {column: to_column_array(column, values) for column, values in series.items()}
+    times = columns.pop(TIME_COLUMN, None)
+    index = pd.DatetimeIndex(times, name=TIME_COLUMN) if times is not None else None
+    return pd.DataFrame(columns, index=index)
+
+
+def normalize_openmeteo_payload(json_data: Dict) -> NormalizedOpenMeteoData:
+    """
+    Split an OpenMeteo JSON payload into metadata, hourly and daily dataframes
+
+    Args:
+        json_data (Dict): Decoded OpenMeteo response
+
+    Returns:
+        NormalizedOpenMeteoData: Normalized data object
+    """
+    json_data = dict(json_data)
+    hourly_df = series_frame(json_data.pop('hourly')) if 'hourly' in json_data else pd.DataFrame()
+    daily_df = series_frame(json_data.pop('daily')) if 'daily' in json_data else pd.DataFrame()
+
+    # Create metadata DataFrame from remaining scalar values
+    metadata_df = pd.DataFrame([json_data])
+
+    return NormalizedOpenMeteoData(
+        metadata=metadata_df,
+        hourly_data=hourly_df,
+        daily_data=daily_df
+    )
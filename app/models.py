@@ -3,6 +3,8 @@ from pydantic import BaseModel, Field
 from typing import Optional, List, Dict
 import pandas as pd
 
+from .summaries import frame_statistics
+
 @dataclass
 class VisualizationNeed(BaseModel):
     need_visualization: int = Field(description="Whether the user needs a visualization or not")
@@ -64,26 +66,21 @@ class ProcessedData:
         summary = ""
         
         for df_name, df in self.nested_dataframes.items():
+            statistics = frame_statistics.summarize(df)
             summary += f"Dataset: {df_name}\n"
-            summary += f"Time range: {df.index.min()} to {df.index.max()}\n\n"
+            summary += f"Time range: {statistics.start} to {statistics.end}\n\n"
             
             # Analyze each numerical column
-            for column in df.select_dtypes(include=['float64', 'int64']).columns:
-                summary += f"Variable: {column}\n"
-                
-                # Basic statistics
-                avg = df[column].mean()
-                min_val = df[column].min()
-                max_val = df[column].max()
-                
-                # Overall trend
-                start_val = df[column].iloc[0]
-                end_val = df[column].iloc[-1]
-                total_change = ((end_val - start_val) / start_val) * 100 if start_val != 0 else 0
-                
-                summary += f"Range: {min_val:.2f} to {max_val:.2f}\n"
-                summary += f"Average: {avg:.2f}\n"
-                summary += f"Overall change: {total_change:.1f}%\n\n"
+            for column in statistics.columns:
+                summary += f"Variable: {column.name}\n"
+                summary += f"Range: {column.minimum:.2f} to {column.maximum:.2f}\n"
+                summary += f"Average: {column.mean:.2f}\n"
+                summary += f"Overall change: {column.change_percent:.1f}%\n"
+                if column.trend_per_decade is not None:
+                    summary += f"Trend: {column.trend_per_decade:+.2f} per decade\n"
+                if column.anomaly is not None:
+                    summary += f"Anomaly: {column.anomaly:+.2f} ({statistics.format_period(statistics.recent)} vs {statistics.format_period(statistics.baseline)})\n"
+                summary += "\n"
             
             summary += "---\n\n"
         
@@ -113,6 +110,20 @@ class APIEndpoint(BaseModel):
 class APIEndpointResponse(BaseModel):
     endpoints: List[APIEndpoint] = Field(description="List of API endpoints to query")
 
+class DataQuery(BaseModel):
+    endpoint: str = Field(description="Endpoint URL without parameters, exactly as listed in the API endpoint information")
+    resolution: str = Field(description="Time resolution of the variables: hourly or daily")
+    variables: List[str] = Field(description="Variables to retrieve, exactly as listed for the endpoint and resolution")
+    start_date: str = Field(description="Start of the date range (yyyy-mm-dd)")
+    end_date: str = Field(description="End of the date range (yyyy-mm-dd)")
+    location: Optional[str] = Field(default=None, description="Location of the data, only when it differs from the area of interest")
+    latitude: Optional[float] = Field(default=None, description="Latitude of the location, only when no coordinates were given for it")
+    longitude: Optional[float] = Field(default=None, description="Longitude of the location, only when no coordinates were given for it")
+    models: Optional[List[str]] = Field(default=None, description="Climate models, only for endpoints that require them")
+
+class DataQueryResponse(BaseModel):
+    queries: List[DataQuery] = Field(description="List of data queries, one per dataset")
+
 class DataProcessingType(BaseModel):
     needed_data: str = Field(description="List of the data needed for visualization, including time range and location")
     data_processing_steps: str = Field(description="Step by step process to prepare data for visualization")
@@ -120,8 +131,8 @@ class DataProcessingType(BaseModel):
 
 class NormalizedOpenMeteoData(BaseModel):
     metadata: Optional[pd.DataFrame] = Field(description="Dataframe containing data unrelated to time resolution")
-    hourly_data: Optional[pd.DataFrame] = Field(description="Dataframe with hourly data")
-    daily_data: Optional[pd.DataFrame] = Field(description="Dataframe with daily data")
+    hourly_data: Optional[pd.DataFrame] = Field(description="Dataframe with hourly data, float32 columns indexed by a DatetimeIndex named 'time'")
+    daily_data: Optional[pd.DataFrame] = Field(description="Dataframe with daily data, float32 columns indexed by a DatetimeIndex named 'time'")
 
     def __str__(self):
         return f"""
@@ -136,34 +147,21 @@ class NormalizedOpenMeteoData(BaseModel):
     def generate_data_description(self) -> str:
         """
         Generate a statistical description of temporal data.
-        Returns overall statistics for each numeric column in hourly and daily data.
+        Returns overall statistics, trend, anomaly and seasonal means for each numeric column in hourly and daily data.
         
         Returns:
             String containing statistical description
         """
         description = []
         
-        if self.hourly_data is not None:
-            numeric_cols = self.hourly_data.select_dtypes(include=['float64', 'int64']).columns
-            numeric_cols = [col for col in numeric_cols if col != 'time']
-            
-            if len(numeric_cols) > 0:
-                stats = self.hourly_data[numeric_cols].describe()
-                description.append("Hourly Data:")
-                description.append(f"Time range: {self.hourly_data['time'].min()} to {self.hourly_data['time'].max()}")
-                for col in numeric_cols:
-                    description.append(f"{col}: mean={stats[col]['mean']:.2f}, min={stats[col]['min']:.2f}, max={stats[col]['max']:.2f}")
-        
-        if self.daily_data is not None:
-            numeric_cols = self.daily_data.select_dtypes(include=['float64', 'int64']).columns
-            numeric_cols = [col for col in numeric_cols if col != 'time']
-            
-            if len(numeric_cols) > 0:
-                stats = self.daily_data[numeric_cols].describe()
-                description.append("\nDaily Data:")
-                description.append(f"Time range: {self.daily_data['time'].min()} to {self.daily_data['time'].max()}")
-                for col in numeric_cols:
-                    description.append(f"{col}: mean={stats[col]['mean']:.2f}, min={stats[col]['min']:.2f}, max={stats[col]['max']:.2f}")
+        for title, df in (("Hourly Data:", self.hourly_data), ("\nDaily Data:", self.daily_data)):
+            if df is None:
+                continue
+            statistics = frame_statistics.summarize(df)
+            if statistics.columns:
+                description.append(title)
+                description.append(f"Time range: {statistics.start} to {statistics.end}")
+                description.extend(statistics.describe())
         
         return "\n".join(description)
 
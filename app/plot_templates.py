@@ -0,0 +1,146 @@
+import gzip
+import hashlib
+import threading
+
+import orjson
+import plotly.io as pio
+import plotly.graph_objects as go
+
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from .constants import DEFAULT_PLOT_TEMPLATE, PUBLISHED_PLOT_TEMPLATES, RESPONSE_GZIP_LEVEL
+
+# Styling applied by `enhance_plotly_figure`, on top of simple_white
+AXIS_STYLE = dict(
+    showgrid=True,
+    gridwidth=1,
+    gridcolor='#E5E5E5',
+    zeroline=True,
+    zerolinewidth=1,
+    zerolinecolor='#808080',
+)
+
+
+def _climate_template() -> go.layout.Template:
+    template = go.layout.Template(pio.templates["simple_white"])
+    template.layout.update(
+        autosize=True,
+        margin=dict(l=50, r=50, t=80, b=50),
+        paper_bgcolor='white',
+        plot_bgcolor='white',
+        font=dict(size=12),
+        title=dict(font=dict(size=16), x=0.5, xanchor='center'),
+        xaxis=AXIS_STYLE,
+        yaxis=AXIS_STYLE,
+    )
+    return template
+
+
+def fingerprint(template: Dict[str, Any]) -> str:
+    """Hash of a template's JSON, independent of key order"""
+    return hashlib.sha256(orjson.dumps(template, option=orjson.OPT_SORT_KEYS | orjson.OPT_SERIALIZE_NUMPY)).hexdigest()
+
+
+@dataclass(frozen=True)
+class PublishedTemplate:
+    """
+    A Plotly template served once and referenced by name from figures.
+
+    Attributes:
+        name (str): Name figures refer to
+        template (go.layout.Template): The template
+        body (bytes): Serialized JSON
+        gzipped (bytes): Gzipped JSON
+        etag (str): Quoted ETag header value
+        fingerprint (str): Hash used to recognize the template inside figures
+    """
+    name: str
+    template: go.layout.Template
+    body: bytes
+    gzipped: bytes
+    etag: str
+    fingerprint: str
+
+
+class TemplateRegistry:
+    """
+    Named Plotly templates published through the API.
+
+    Serialized figures reference a published template by name in `layout.template`
+    instead of embedding a copy; clients fetch each template once and cache it by ETag.
+    Templates are built and serialized on first use.
+    """
+
+    def __init__(self, names=PUBLISHED_PLOT_TEMPLATES):
+        self.names = tuple(names)
+        self._templates: Dict[str, PublishedTemplate] = {}
+        self._by_fingerprint: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, template: go.layout.Template) -> PublishedTemplate:
+        """
+        Publish a template under a name, also making it available to Plotly as `template=name`
+        """
+        content = template.to_plotly_json()
+        body = orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY)
+        digest = fingerprint(content)
+        published = PublishedTemplate(
+            name=name,
+            template=template,
+            body=body,
+            gzipped=gzip.compress(body, RESPONSE_GZIP_LEVEL),
+            etag=f'"{digest[:32]}"',
+            fingerprint=digest,
+        )
+        pio.templates[name] = template
+        self._templates[name] = published
+        self._by_fingerprint[digest] = name
+        return published
+
+    def load(self) -> None:
+        """Build and serialize every published template"""
+        with self._lock:
+            for name in self.names:
+                if name in self._templates:
+                    continue
+                template = _climate_template() if name == DEFAULT_PLOT_TEMPLATE else pio.templates[name]
+                self.register(name, template)
+
+    def get(self, name: str) -> Optional[PublishedTemplate]:
+        if name not in self._templates:
+            self.load()
+        return self._templates.get(name)
+
+    def match(self, template: Any) -> Optional[str]:
+        """
+        Name of the published template equal to the given one
+
+        Args:
+            template (Any): Template of a figure, as returned by `go.Figure.to_dict()`
+
+        Returns:
+            Optional[str]: The template name, or None if it isn't published
+        """
+        if not isinstance(template, dict):
+            return None
+        if len(self._templates) < len(self.names):
+            self.load()
+        return self._by_fingerprint.get(fingerprint(template))
+
+    def detach(self, figure: Dict[str, Any]) -> bool:
+        """
+        Replace the template of a figure by its name if it is published, in place
+
+        Returns:
+            bool: Whether the template was replaced by a reference
+        """
+        layout = figure.get("layout") or {}
+        name = self.match(layout.get("template"))
+        if name is None:
+            return False
+        layout["template"] = name
+        return True
+
+
+template_registry = TemplateRegistry()
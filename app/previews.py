@@ -0,0 +1,208 @@
+import numpy as np
+import pandas as pd
+
+from typing import Any, Dict, List, Optional, Tuple
+
+from .api import API, OpenMeteoAPI
+from .models import NormalizedOpenMeteoData
+from .prompt_assembly import count_tokens
+from .summaries import ColumnStatistics, frame_statistics
+from .constants import DATA_PREVIEW_TOKEN_BUDGET
+
+RESOLUTIONS = (("hourly_data", "hourly"), ("daily_data", "daily"))
+
+# Metadata that changes between identical requests, left out so previews stay deterministic
+VOLATILE_METADATA = {"generationtime_ms"}
+
+# Detail levels tried in order until the preview fits the budget: sampled values, catalog description, value range
+DETAIL_LEVELS = (
+    (5, True, True),
+    (3, True, True),
+    (3, False, True),
+    (0, False, False),
+)
+
+
+def _catalog_units(api: API) -> Dict[Tuple[str, str], Tuple[str, str]]:
+    """
+    Unit and meaning of every variable of the catalog, from descriptions like "Instant, °C (°F); Air temperature"
+    """
+    units: Dict[Tuple[str, str], Tuple[str, str]] = {}
+    for endpoint in api.endpoints:
+        for resolution in ("hourly", "daily"):
+            for name, description in ((endpoint.parameters or {}).get(f"{resolution}_parameters") or {}).items():
+                kind, _, meaning = description.partition(";")
+                unit = kind.split(",")[-1].split("(")[0].strip()
+                units.setdefault((resolution, name), (unit, meaning.strip()))
+    return units
+
+
+class DataPreviewer:
+    """
+    Compact, deterministic descriptions of input data for the code generation prompts.
+
+    Each frame is described by its shape, index range and columns, with dtypes, units
+    (from the response, or the catalog), catalog descriptions, null counts, value ranges
+    and evenly spaced samples. Details are dropped level by level, then columns, until
+    the preview fits the token budget.
+    """
+
+    def __init__(self, api: API = OpenMeteoAPI, token_budget: int = DATA_PREVIEW_TOKEN_BUDGET):
+        self.token_budget = token_budget
+        self._units = _catalog_units(api)
+        self._variables = {resolution: sorted((name for res, name in self._units if res == resolution), key=len, reverse=True) for resolution in ("hourly", "daily")}
+
+    def preview(self, data: List[NormalizedOpenMeteoData], token_budget: Optional[int] = None) -> str:
+        """
+        Describe the data within a token budget
+
+        Args:
+            data (List[NormalizedOpenMeteoData]): Data handed to generated code
+            token_budget (Optional[int]): Maximum tokens, the previewer's default if None
+
+        Returns:
+            str: The description
+        """
+        budget = token_budget or self.token_budget
+        text = ""
+        for samples, descriptions, ranges in DETAIL_LEVELS:
+            text = self._render(data, samples, descriptions, ranges, None)
+            if count_tokens(text) <= budget:
+                return text
+
+        # still too long: detail fewer columns per frame, down to their names only
+        max_columns = self._column_count(data)
+        while max_columns > 0:
+            max_columns //= 2
+            text = self._render(data, 0, False, False, max_columns)
+            if count_tokens(text) <= budget:
+                break
+        return text
+
+    def _render(
+        self,
+        data: List[NormalizedOpenMeteoData],
+        samples: int,
+        descriptions: bool,
+        ranges: bool,
+        max_columns: Optional[int],
+    ) -> str:
+        lines = [f"List of {len(data)} NormalizedOpenMeteoData"]
+        for position, entry in enumerate(data):
+            lines.append(f"data[{position}]:")
+            lines.append(f"  metadata: {self._metadata(entry.metadata)}")
+            units = self._response_units(entry.metadata)
+            for field, resolution in RESOLUTIONS:
+                lines.extend(self._frame(field, resolution, getattr(entry, field), units.get(resolution, {}), samples, descriptions, ranges, max_columns))
+        return "\n".join(lines)
+
+    def _frame(
+        self,
+        field: str,
+        resolution: str,
+        df: Optional[pd.DataFrame],
+        units: Dict[str, str],
+        samples: int,
+        descriptions: bool,
+        ranges: bool,
+        max_columns: Optional[int],
+    ) -> List[str]:
+        if df is None or df.empty:
+            return [f"  {field}: empty"]
+
+        index = df.index
+        if isinstance(index, pd.DatetimeIndex):
+            index_text = f"index '{index.name}' {index.dtype} from {index.min()} to {index.max()}"
+        else:
+            index_text = f"index {index.dtype}"
+        lines = [f"  {field}: {len(df)} rows x {df.shape[1]} columns, {index_text}"]
+
+        columns = list(df.columns)
+        shown = columns if max_columns is None else columns[:max_columns]
+        positions = np.unique(np.linspace(0, len(df) - 1, samples).astype(int)) if samples else []
+        statistics = {column.name: column for column in frame_statistics.summarize(df).columns}
+        for column in shown:
+            lines.append("    " + self._column(
+                resolution, str(column), df[column], statistics.get(str(column)), units, positions, descriptions, ranges
+            ))
+        if not shown:
+            lines.append(f"    columns: {', '.join(map(str, columns))}")
+        elif len(shown) < len(columns):
+            lines.append(f"    ... {len(columns) - len(shown)} more columns: {', '.join(map(str, columns[len(shown):]))}")
+        return lines
+
+    def _column(
+        self,
+        resolution: str,
+        column: str,
+        series: pd.Series,
+        statistics: Optional[ColumnStatistics],
+        units: Dict[str, str],
+        positions,
+        descriptions: bool,
+        ranges: bool,
+    ) -> str:
+        catalog_unit, meaning = self._catalog_entry(resolution, column)
+        unit = units.get(column) or catalog_unit
+        parts = [f"{column}: {series.dtype}"]
+        if unit:
+            parts.append(unit)
+        if descriptions and meaning:
+            parts.append(meaning)
+        nulls = len(series) - statistics.count if statistics is not None else int(series.isna().sum())
+        if nulls:
+            parts.append(f"{nulls} nulls")
+        if ranges and statistics is not None and statistics.count:
+            parts.append(f"range {_format(statistics.minimum)} to {_format(statistics.maximum)}")
+        if len(positions):
+            parts.append("e.g. " + ", ".join(_format(value) for value in series.iloc[positions]))
+        return ", ".join(parts)
+
+    def _catalog_entry(self, resolution: str, column: str) -> Tuple[str, str]:
+        entry = self._units.get((resolution, column))
+        if entry is not None:
+            return entry
+        # multi-model columns, e.g. temperature_2m_max_MRI_AGCM3_2_S
+        for name in self._variables.get(resolution, []):
+            if column.startswith(f"{name}_"):
+                return self._units[(resolution, name)]
+        return "", ""
+
+    @staticmethod
+    def _metadata(metadata: Optional[pd.DataFrame]) -> str:
+        if metadata is None or metadata.empty:
+            return "empty"
+        row = metadata.iloc[0]
+        values = [
+            f"{column}={_format(value)}"
+            for column, value in row.items()
+            if column not in VOLATILE_METADATA and not isinstance(value, (dict, list))
+        ]
+        return ", ".join(values)
+
+    @staticmethod
+    def _response_units(metadata: Optional[pd.DataFrame]) -> Dict[str, Dict[str, str]]:
+        if metadata is None or metadata.empty:
+            return {}
+        row = metadata.iloc[0]
+        return {
+            resolution: row[f"{resolution}_units"]
+            for resolution in ("hourly", "daily")
+            if f"{resolution}_units" in row and isinstance(row[f"{resolution}_units"], dict)
+        }
+
+    @staticmethod
+    def _column_count(data: List[NormalizedOpenMeteoData]) -> int:
+        return max(
+            (getattr(entry, field).shape[1] for entry in data for field, _ in RESOLUTIONS if getattr(entry, field) is not None),
+            default=0,
+        )
+
+
+def _format(value: Any) -> str:
+    if isinstance(value, (float, np.floating)):
+        return "nan" if np.isnan(value) else f"{value:.4g}"
+    return str(value)
+
+
+data_previewer = DataPreviewer()
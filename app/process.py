@@ -1,15 +1,21 @@
+import asyncio
 import logging
 
 from pydantic import BaseModel
 from dotenv import load_dotenv
-from typing import Type, List, Dict
+from typing import Type, List, Dict, Optional
 
 from .prompts import *
-from .models import VisualizationNeed, PersonaSelection, LLMMessageType
+from .models import PersonaSelection, NormalizedOpenMeteoData
 from .utils import figure_to_json, handle_exceptions
 from .visualization import visualization_generation_pipeline
-from .constants import DEVELOPER, USER, DEVELOPER
+from .constants import DEVELOPER, USER, DEVELOPER, COMPLEXITY_CONFIDENCE_THRESHOLD
 from .ai import openai_client
+from .streaming import EventCallback
+from .sessions import session_store
+from .geocoding import Place, gazetteer
+from .prompt_assembly import prompt_assembler
+from .complexity import complexity_classifier
 
 logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s \n\n')
 
@@ -17,7 +23,7 @@ load_dotenv()
 
 
 @handle_exceptions()
-def classify_text(text: str, classification_prompt: str, response_format: Type[BaseModel], max_tokens: int = 20) -> BaseModel:
+async def classify_text(text: str, classification_prompt: str, response_format: Type[BaseModel], max_tokens: int = 20) -> BaseModel:
     """
     Classify the given text based on the provided prompt.
 
@@ -29,7 +35,7 @@ def classify_text(text: str, classification_prompt: str, response_format: Type[B
     Returns:
         BaseModel: The classified result parsed into the specified response format
     """
-    response = openai_client.structured_completion(
+    response = await openai_client.astructured_completion(
         messages=[
             {"role": DEVELOPER, "content": classification_prompt},
             {
@@ -45,20 +51,38 @@ def classify_text(text: str, classification_prompt: str, response_format: Type[B
     return response
 
 
-
-handle_exceptions()
-def set_complexity_level(description: str) -> int:
+async def set_complexity_level(description: str, age_group: Optional[str] = None) -> int:
     """
     Set the complexity level based on the persona.
 
+    The local classifier answers unless it isn't confident enough, then the LLM does.
+    If the LLM call fails, e.g. when rate limited, the local prediction is kept.
+
     Args:
-        persona (str): The persona name
+        description (str): The description of the user
+        age_group (Optional[str]): The age group of the user
 
     Returns:
-        str: The complexity level prompt
+        int: The complexity level
     """
+    key = complexity_classifier.key(description, age_group)
+    complexity_level = complexity_classifier.cached(key)
+    if complexity_level is not None:
+        return complexity_level
+
+    prediction = complexity_classifier.predict(description, age_group)
+    if prediction.confidence >= COMPLEXITY_CONFIDENCE_THRESHOLD:
+        complexity_level, source = prediction.level, "local"
+    else:
+        text = f"{description}. My age group is {age_group}" if age_group else description
+        try:
+            selection = await classify_text(text, COMPLEXITY_MATCHING_PROMPT, PersonaSelection)
+            complexity_level, source = selection.persona_id, "llm"
+        except Exception as e:
+            logging.warning(f"Complexity classification by LLM failed, using the local prediction: {e}")
+            return prediction.level
 
-    complexity_level = classify_text(description, COMPLEXITY_MATCHING_PROMPT, PersonaSelection).persona_id
+    complexity_classifier.remember(key, complexity_level, source)
     return complexity_level
 
 def get_complexity_level_prompts(complexity_level: int) -> tuple[str,str]:
@@ -71,100 +95,63 @@ def get_complexity_level_prompts(complexity_level: int) -> tuple[str,str]:
     Returns:
         str: The complexity level prompt
     """
-    match complexity_level:
-        case 0:
-            return LVL0_VIZ_PROMPT, LVL0_EXP_PROMPT
-        case 1:
-            return LVL1_VIZ_PROMPT, LVL1_EXP_PROMPT
-        case 2:
-            return LVL2_VIZ_PROMPT, LVL2_EXP_PROMPT
-        case _:
-            return LVL0_VIZ_PROMPT, LVL0_EXP_PROMPT
-
-def generate_visualization(messages: list[Dict[str,str]], complexity_level: int, user_description: str, location: str, chat_id: str, scenario: str, topic: str, options: List[str], lang: str='en') -> str:
-        viz_complexity, _ = get_complexity_level_prompts(complexity_level)
-        try:
-            fig, data = visualization_generation_pipeline(messages, user_description, location, topic, viz_complexity, scenario, options, lang)
-            fig = figure_to_json(fig)
-
-            data_description = ""
-            for data_point in data:
-                data_description += f"{data_point.generate_data_description()}\n\n"
+    viz_prompt, exp_prompt = prompt_assembler.complexity(complexity_level)
+    return viz_prompt.text, exp_prompt.text
 
-            with open(f"{chat_id}.txt", "w") as file:
-                file.write(data_description)
-            
-            return fig
-        except:
-            logging.error(f"Error generating visualization:", exc_info=True)
-            return ""
-
-def process_user_message(message: str, persona: int, location: str, chat_id: str, lang: str='en') -> str:
+async def resolve_session_location(chat_id: str, location: str) -> Optional[Place]:
     """
-    Process the user message and generate a visualization and explanation.
+    Resolve the location of a chat with the local gazetteer, once per session.
 
     Args:
-        message (str): The user message
-        persona (str): The persona name
-        location (str): The area of interest of the user
+        chat_id (str): The chat ID
+        location (str): Location requested by the user
 
     Returns:
-        tuple[str, str]: The visualization as PLotly JSON and explanation
+        Optional[Place]: The resolved place, or None if the location is unknown
     """
+    state = await asyncio.to_thread(session_store.get, chat_id)
+    if state is not None and state.location == location:
+        return state.place
 
-    visualization_need = classify_text(message, VISUALIZATION_NEED_PROMPT, VisualizationNeed)
+    place = gazetteer.resolve(location)
+    if place is None:
+        logging.info(f"Location not found in gazetteer: {location}")
+    await asyncio.to_thread(session_store.update, chat_id, location=location, place=place)
+    return place
 
-    if visualization_need.need_visualization:
-        viz_complexity, exp_complexity = set_complexity_level(persona)
+async def generate_visualization(messages: list[Dict[str,str]], complexity_level: int, user_description: str, location: str, chat_id: str, scenario: str, topic: str, options: List[str], lang: str='en', on_event: Optional[EventCallback] = None) -> str:
+        viz_complexity, _ = get_complexity_level_prompts(complexity_level)
         try:
-            fig, data = visualization_generation_pipeline(message, persona, location, visualization_need.topic_of_interest, viz_complexity, lang)
-            fig = figure_to_json(fig)
-
-            data_description = ""
-            for data_point in data:
-                data_description += f"{data_point.generate_data_description()}\n\n"
-
-            with open(f"{chat_id}.txt", "w") as file:
-                file.write(data_description)
+            place = await resolve_session_location(chat_id, location)
+            state = await asyncio.to_thread(session_store.get, chat_id)
+            coordinates = state.coordinates() if state is not None else None
+            fig, data = await visualization_generation_pipeline(
+                messages, user_description, location, topic, viz_complexity, scenario, options, lang, on_event, coordinates, place
+            )
+            fig = await asyncio.to_thread(figure_to_json, fig)
+
+            data_description = await asyncio.to_thread(describe_data, data)
+
+            await asyncio.to_thread(
+                session_store.update, chat_id, data_description=data_description, data=data, figure=fig
+            )
             
             return fig
         except:
             logging.error(f"Error generating visualization:", exc_info=True)
-            return "", ""
-    else:
-        return "", ""
+            return ""
 
-def process_simple_message(messages: List[any], lang: str='en') -> str:
+def describe_data(data: List[NormalizedOpenMeteoData]) -> str:
     """
-    Process the user message and generate a visualization and explanation.
+    Build the statistical description of the data behind a visualization.
 
     Args:
-        message (str): The user message
-        persona (str): The persona name
-        location (str): The area of interest of the user
+        data (List[NormalizedOpenMeteoData]): The data used for the visualization
 
     Returns:
-        tuple[str, str]: The visualization as PLotly JSON and explanation
+        str: The data description
     """
-
-    visualization_need = classify_text(message, VISUALIZATION_NEED_PROMPT, VisualizationNeed)
-
-    if visualization_need.need_visualization:
-        viz_complexity, exp_complexity = set_complexity_level(persona)
-        try:
-            fig, data = visualization_generation_pipeline(message, persona, location, visualization_need.topic_of_interest, viz_complexity, lang)
-            fig = figure_to_json(fig)
-
-            data_description = ""
-            for data_point in data:
-                data_description += f"{data_point.generate_data_description()}\n\n"
-
-            with open(f"{chat_id}.txt", "w") as file:
-                file.write(data_description)
-            
-            return fig
-        except:
-            logging.error(f"Error generating visualization:", exc_info=True)
-            return "", ""
-    else:
-        return "", ""
+    data_description = ""
+    for data_point in data:
+        data_description += f"{data_point.generate_data_description()}\n\n"
+    return data_description
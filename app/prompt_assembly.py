@@ -0,0 +1,251 @@
+import logging
+import os
+import threading
+
+from dataclasses import dataclass
+from functools import cached_property, lru_cache
+from string import Formatter
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+from .api import API, Endpoint, OpenMeteoAPI
+from .prompts import (
+    API_CATALOG_CONTEXT,
+    OUTPUT_LANGUAGE_PROMPT,
+    ANTHROPIC_STRUCTURED_OUTPUT_PROMPT,
+    LVL0_VIZ_PROMPT,
+    LVL0_EXP_PROMPT,
+    LVL1_VIZ_PROMPT,
+    LVL1_EXP_PROMPT,
+    LVL2_VIZ_PROMPT,
+    LVL2_EXP_PROMPT,
+)
+from .constants import GPT_4o_MINI, TOPIC_ENDPOINTS, PRERENDERED_LANGUAGES, TIKTOKEN_CACHE_DIR
+
+_formatter = Formatter()
+
+COMPLEXITY_PROMPTS = {
+    0: (LVL0_VIZ_PROMPT, LVL0_EXP_PROMPT),
+    1: (LVL1_VIZ_PROMPT, LVL1_EXP_PROMPT),
+    2: (LVL2_VIZ_PROMPT, LVL2_EXP_PROMPT),
+}
+
+
+@lru_cache(maxsize=1)
+def encoder():
+    """
+    The tiktoken encoder, loaded on first use from the bundled BPE cache
+
+    The import and the BPE file loading take a while, and without a cache the file
+    is downloaded, so this isn't done at import but by the warm-up or the first count.
+    """
+    os.environ.setdefault("TIKTOKEN_CACHE_DIR", TIKTOKEN_CACHE_DIR)
+    import tiktoken
+    return tiktoken.encoding_for_model(GPT_4o_MINI)
+
+
+def count_tokens(text: str) -> int:
+    """Number of tokens of a text with the tiktoken encoder"""
+    return len(encoder().encode(text, disallowed_special=()))
+
+
+@dataclass(frozen=True)
+class PromptSegment:
+    """
+    A rendered piece of prompt and its size.
+
+    Attributes:
+        text (str): Rendered text
+        tokens (int): Token count
+    """
+    text: str
+    tokens: int
+
+    @classmethod
+    def of(cls, text: str) -> "PromptSegment":
+        return cls(text, count_tokens(text))
+
+    def __str__(self):
+        return self.text
+
+
+class CompiledPrompt:
+    """
+    A prompt template parsed once into literal segments and fields.
+
+    Rendering concatenates the segments with the values instead of parsing the
+    template again; `partial` bakes values known in advance into the literals.
+    """
+
+    def __init__(self, template: str, parts: Optional[List[Tuple[str, Optional[str], str, Optional[str]]]] = None):
+        self.template = template
+        self._parts = parts if parts is not None else list(_formatter.parse(template))
+        for _, field, _, _ in self._parts:
+            if field is not None and not field.isidentifier():
+                raise ValueError(f"Unsupported prompt field {{{field}}}")
+        self.fields = {field for _, field, _, _ in self._parts if field}
+
+    def partial(self, **values: Any) -> "CompiledPrompt":
+        """
+        Render the given fields now and keep the others
+
+        Returns:
+            CompiledPrompt: A prompt with fewer fields
+        """
+        parts: List[Tuple[str, Optional[str], str, Optional[str]]] = []
+        pending = ""
+        for literal, field, spec, conversion in self._parts:
+            pending += literal
+            if field is None:
+                continue
+            if field in values:
+                pending += self._render_field(values[field], spec, conversion)
+                continue
+            parts.append((pending, field, spec, conversion))
+            pending = ""
+        if pending:
+            parts.append((pending, None, "", None))
+        return CompiledPrompt(self.template, parts)
+
+    def render(self, **values: Any) -> str:
+        """
+        Render the prompt, like `template.format(**values)`
+
+        Raises:
+            KeyError: A field has no value
+        """
+        chunks: List[str] = []
+        for literal, field, spec, conversion in self._parts:
+            chunks.append(literal)
+            if field is not None:
+                chunks.append(self._render_field(values[field], spec, conversion))
+        return "".join(chunks)
+
+    def segment(self, **values: Any) -> PromptSegment:
+        return PromptSegment.of(self.render(**values))
+
+    @staticmethod
+    def _render_field(value: Any, spec: str, conversion: Optional[str]) -> str:
+        if conversion:
+            value = _formatter.convert_field(value, conversion)
+        if not spec and isinstance(value, str):
+            return value
+        return format(value, spec)
+
+
+def render_endpoint(endpoint: Endpoint) -> str:
+    """
+    Render an endpoint compactly: one line per parameter instead of nested dict reprs
+    """
+    lines = [f"{endpoint.url}: {endpoint.description}"]
+    for group, parameters in (endpoint.parameters or {}).items():
+        if not parameters:
+            continue
+        lines.append(f"  {group}:")
+        lines.extend(f"    {name}: {description}" for name, description in parameters.items())
+    return "\n".join(lines)
+
+
+class PromptAssembler:
+    """
+    Static prompt segments, rendered once with their token counts.
+
+    Holds the API catalog (whole, or reduced to the endpoint families of a topic),
+    the complexity level variants and the output language instructions. Final
+    prompts are put together by concatenating these segments.
+    """
+
+    def __init__(self, api: API = OpenMeteoAPI, topic_endpoints: Dict[str, Tuple[str, ...]] = TOPIC_ENDPOINTS):
+        self.api = api
+        self.topic_endpoints = topic_endpoints
+        self._catalogs: Dict[Optional[str], PromptSegment] = {}
+        self._lock = threading.Lock()
+        self._language_prompt = CompiledPrompt(OUTPUT_LANGUAGE_PROMPT)
+        self._catalog_prompt = CompiledPrompt(API_CATALOG_CONTEXT)
+
+    @cached_property
+    def complexity_levels(self) -> Dict[int, Tuple[PromptSegment, PromptSegment]]:
+        """Visualization and explanation prompts per complexity level, rendered on first use"""
+        return {
+            level: (PromptSegment.of(viz), PromptSegment.of(exp)) for level, (viz, exp) in COMPLEXITY_PROMPTS.items()
+        }
+
+    def load(self) -> None:
+        """Render the catalogs of every topic, the complexity levels and the common languages"""
+        self.complexity_levels
+        for topic in [None, *self.topic_endpoints]:
+            self.catalog(topic)
+        for lang in PRERENDERED_LANGUAGES:
+            self.language(lang)
+        logging.info(
+            "Prompt catalog tokens: "
+            + ", ".join(f"{topic or 'all'}={segment.tokens}" for topic, segment in self._catalogs.items())
+        )
+
+    def catalog(self, topic: Optional[str] = None) -> PromptSegment:
+        """
+        API catalog context, restricted to the endpoint families relevant to the topic
+
+        Args:
+            topic (Optional[str]): Scenario topic; unknown topics or None give the whole catalog
+
+        Returns:
+            PromptSegment: Rendered catalog
+        """
+        key = topic if topic in self.topic_endpoints else None
+        segment = self._catalogs.get(key)
+        if segment is None:
+            with self._lock:
+                segment = self._catalogs.get(key)
+                if segment is None:
+                    segment = self._catalog_prompt.segment(API_ENDPOINT_INFORMATION=self._render_endpoints(key))
+                    self._catalogs[key] = segment
+        return segment
+
+    def complexity(self, complexity_level: int) -> Tuple[PromptSegment, PromptSegment]:
+        """Visualization and explanation prompts of a complexity level, level 0 for unknown levels"""
+        return self.complexity_levels.get(complexity_level, self.complexity_levels[0])
+
+    def language(self, lang: Optional[str]) -> PromptSegment:
+        """Output language instruction for a language or Accept-Language header"""
+        return self._language(lang or "en")
+
+    @lru_cache(maxsize=128)
+    def _language(self, lang: str) -> PromptSegment:
+        return PromptSegment.of(self._language_prompt.render(lang=lang))
+
+    @lru_cache(maxsize=64)
+    def structured_output(self, response_format: type) -> PromptSegment:
+        """Instruction to answer with the JSON schema of a response model, rendered once per model"""
+        return PromptSegment.of(ANTHROPIC_STRUCTURED_OUTPUT_PROMPT.format(
+            response_format=f"{response_format.__name__}\n{response_format.model_json_schema()}"
+        ))
+
+    @staticmethod
+    def assemble(*segments: Union[PromptSegment, str], separator: str = "\n") -> PromptSegment:
+        """
+        Concatenate segments; the token count is the sum of theirs, which may differ from
+        a fresh count by a token or so at each boundary
+        """
+        parts = [segment if isinstance(segment, PromptSegment) else PromptSegment.of(segment) for segment in segments]
+        return PromptSegment(
+            separator.join(part.text for part in parts),
+            sum(part.tokens for part in parts) + count_tokens(separator) * max(len(parts) - 1, 0),
+        )
+
+    def token_counts(self) -> Dict[str, int]:
+        """Token counts of the rendered static segments"""
+        counts = {f"catalog:{topic or 'all'}": segment.tokens for topic, segment in self._catalogs.items()}
+        for level, (viz, exp) in self.complexity_levels.items():
+            counts[f"complexity:{level}:visualization"] = viz.tokens
+            counts[f"complexity:{level}:explanation"] = exp.tokens
+        return counts
+
+    def _render_endpoints(self, topic: Optional[str]) -> str:
+        endpoints: Iterable[Endpoint] = self.api.endpoints
+        if topic is not None:
+            urls = self.topic_endpoints[topic]
+            endpoints = [endpoint for endpoint in endpoints if endpoint.url in urls]
+        return f"{self.api.name} API\nEndpoints:\n" + "\n".join(render_endpoint(endpoint) for endpoint in endpoints)
+
+
+prompt_assembler = PromptAssembler()
@@ -87,9 +87,7 @@ Your current task is to determine the needed data from OpenMeteo API for a clima
 The visualization type has been defined by another expert as following:
 {visualization_type}
 
-And the following available data from OpenMeteo API:
-# API Endpoint Information
-{API_ENDPOINT_INFORMATION}
+Only consider the data available from the OpenMeteo API, as described in the API Endpoint Information.
 
 The area of interest mentionned by the user is: {location}. It should be used as the default location if not mentionned in the prompt.
 
@@ -109,7 +107,7 @@ Step 2: Compute 5-year moving average
 """
 
 RETRIEVE_DATA_PROMPT = """
-Your current task is to retrieve the needed data for a climate visualization.
+Your current task is to define the data queries for a climate visualization.
 The visualization type and needed data have already been defined, as following : 
 
 # Visualization Type
@@ -118,23 +116,27 @@ The visualization type and needed data have already been defined, as following :
 # Needed Data
 {needed_data}
 
-# API Endpoint Information
-{API_ENDPOINT_INFORMATION}
-
 # Area of interest
 {location}
 
-Your task is to define the API endpoint and inline-parameters to retrieve the required data.
+Your task is to define one query per dataset: the endpoint URL (without any parameter), the time resolution (hourly or daily), the variables and the date range. The request URLs will be built from your queries.
 If not mentionned, the location should be set to Nagoya, Japan.
+Only set the location of a query when it differs from the area of interest, and only give its latitude and longitude when no coordinates were given for it.
 Be careful about the potential amount of data that could be returned (ex. hourly data of 10 years or more isn't acceptable).
-DON'T HALLUCINATE ON THE PARAMETERS AND THE DATA. IF DATA ISN'T AVAILABLE IN WHAT WAS PROVIDED, DON'T INCLUDE IT.
+DON'T HALLUCINATE ON THE PARAMETERS AND THE DATA. ONLY USE VARIABLES LISTED FOR THE ENDPOINT AND RESOLUTION. IF DATA ISN'T AVAILABLE IN WHAT WAS PROVIDED, DON'T INCLUDE IT.
 
 # Output Example
-Daily minimum, maximum and mean temperature in Nagoya, Japan from 2015-01-18 to 2025-02-01
-url="https://archive-api.open-meteo.com/v1/archive?latitude=52.52&longitude=13.41&start_date=2015-01-18&end_date=2025-02-01&daily=temperature_2m_max,temperature_2m_min,temperature_2m_mean"
+Daily minimum and maximum temperature in Nagoya, Japan from 2015-01-18 to 2025-02-01
+{{"endpoint": "https://archive-api.open-meteo.com/v1/archive", "resolution": "daily", "variables": ["temperature_2m_max", "temperature_2m_min"], "start_date": "2015-01-18", "end_date": "2025-02-01"}}
 
-Hourly PM10 and PM2.5 concentration in Nagoya, Japan from 2015-01-01 to 2025-01-01
-url="https://air-quality-api.open-meteo.com/v1/air-quality?latitude=35.1815&longitude=136.9064&hourly=pm10,pm2_5&start_date=2015-01-01&end_date=2025-01-01"
+Hourly PM10 and PM2.5 concentration in Osaka, Japan from 2023-01-01 to 2024-01-01
+{{"endpoint": "https://air-quality-api.open-meteo.com/v1/air-quality", "resolution": "hourly", "variables": ["pm10", "pm2_5"], "start_date": "2023-01-01", "end_date": "2024-01-01", "location": "Osaka"}}
+"""
+
+API_CATALOG_CONTEXT = """
+# API Endpoint Information
+The OpenMeteo API endpoints available, with their parameters and variables:
+{API_ENDPOINT_INFORMATION}
 """
 
 PROCESS_DATA_PROMPT = """
@@ -188,6 +190,7 @@ NormalizedOpenMeteoData is a dataclass with:
 - metadata: Optional[pd.DataFrame] = Field(description="Dataframe containing data unrelated to time resolution")
 - hourly_data: Optional[pd.DataFrame] = Field(description="Dataframe with hourly data")
 - daily_data: Optional[pd.DataFrame] = Field(description="Dataframe with daily data")
+hourly_data and daily_data are indexed by a DatetimeIndex named 'time' (there is no 'time' column) and their columns are float32.
 
 Data preview: {data_preview}
 
@@ -197,14 +200,19 @@ ALLOWED LIBRARIES - STRICTLY ONLY THESE:
 - All Plotly libraries (plotly.graph_objects as go, plotly.express as px, plotly.subplots...)
 - typing (for List, Optional)
 - Python standard libraries
+- agg, a global aggregation helper (do not import it):
+  - agg.resample(df_or_series, freq, how='mean') with freq 'daily', 'weekly', 'monthly', 'seasonal' or 'yearly'
+  - agg.envelope(series, freq) -> DataFrame with 'min', 'mean' and 'max' columns, to draw a band
+  - agg.lttb(x, y, n_out) -> (x, y) downsampled while keeping the shape of the line
 
 REQUIREMENTS:
 1. Use Plotly to create the visualization
 2. Validate input structure
-3. Optimize for large datasets
+3. Optimize for large datasets: aggregate long hourly series with agg before plotting (traces are capped at {max_points} points in total)
 4. Clear axes labels and title
 5. Include legend for multiple traces
 6. Avoid cluttering visualization
+7. Use template='{template}', the application's shared styling, and don't restyle the background, grid or axes
 
 CRITICAL OUTPUT RULES:
 1. ONLY output the complete visualize() function
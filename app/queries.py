@@ -0,0 +1,308 @@
+import re
+import logging
+
+import numpy as np
+
+from dataclasses import dataclass, replace
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from .api import API, Endpoint, OpenMeteoAPI
+from .ingest import TIME_SERIES_KEYS, TIME_COLUMN, VALUE_DTYPE, to_column_array
+from .geocoding import Place, gazetteer
+from .models import DataQuery
+from .constants import QUERY_CHUNK_MIN_DAYS
+
+RESOLUTIONS = ("hourly", "daily")
+DATE_RANGE_PATTERN = re.compile(r"(\d{4}-\d{2}-\d{2}) and (\d{4}-\d{2}-\d{2})")
+MODELS_PATTERN = re.compile(r"\(([^)]*)\)")
+
+
+@dataclass(frozen=True)
+class ResolvedQuery:
+    """
+    A validated OpenMeteo request for one location.
+
+    Attributes:
+        endpoint (str): Endpoint URL, as listed in `known_apis.json`
+        resolution (str): `hourly` or `daily`
+        variables (Tuple[str, ...]): Sorted variable names
+        start_date (date): First day
+        end_date (date): Last day, inclusive
+        latitude (float): Latitude
+        longitude (float): Longitude
+        models (Tuple[str, ...]): Climate models, for endpoints that require them
+    """
+    endpoint: str
+    resolution: str
+    variables: Tuple[str, ...]
+    start_date: date
+    end_date: date
+    latitude: float
+    longitude: float
+    models: Tuple[str, ...] = ()
+
+    @property
+    def url(self) -> str:
+        params = [
+            ("latitude", f"{self.latitude:g}"),
+            ("longitude", f"{self.longitude:g}"),
+            ("start_date", self.start_date.isoformat()),
+            ("end_date", self.end_date.isoformat()),
+            (self.resolution, ",".join(self.variables)),
+        ]
+        if self.models:
+            params.append(("models", ",".join(self.models)))
+        return f"{self.endpoint}?{urlencode(params, safe=',')}"
+
+
+class QueryBuilder:
+    """
+    Builds OpenMeteo URLs locally from the structured queries chosen by the LLM.
+
+    Queries are validated against the endpoint catalog, requests that overlap for the
+    same endpoint, resolution and location are merged into one, and long ranges on
+    historical endpoints are fetched as calendar-year chunks that stay cacheable
+    across requests, then concatenated back.
+    """
+
+    def __init__(self, api: API = OpenMeteoAPI, chunk_min_days: int = QUERY_CHUNK_MIN_DAYS):
+        self.api = api
+        self.chunk_min_days = chunk_min_days
+
+    def build(self, queries: List[DataQuery], place: Optional[Place] = None) -> List[ResolvedQuery]:
+        """
+        Validate and merge the queries chosen by the LLM
+
+        Args:
+            queries (List[DataQuery]): Structured queries
+            place (Optional[Place]): Area of interest, used when a query has no location of its own
+
+        Returns:
+            List[ResolvedQuery]: The fewest valid requests covering the queries
+        """
+        resolved = [self.validate(query, place) for query in queries]
+        return self.merge([query for query in resolved if query is not None])
+
+    def validate(self, query: DataQuery, place: Optional[Place] = None) -> Optional[ResolvedQuery]:
+        """
+        Check a query against the catalog, dropping unknown variables and clamping dates
+
+        Returns:
+            Optional[ResolvedQuery]: The valid query, or None if nothing usable is left
+        """
+        endpoint = self.api.find_endpoint(query.endpoint)
+        if endpoint is None:
+            logging.warning(f"Dropping query for unknown endpoint {query.endpoint}")
+            return None
+
+        resolution = query.resolution.strip().lower()
+        known_variables = self._variables(endpoint, resolution)
+        variables = tuple(sorted({variable.strip() for variable in query.variables if variable.strip() in known_variables}))
+        dropped = set(query.variables) - set(variables)
+        if dropped:
+            logging.warning(f"Dropping unknown {resolution} variables for {endpoint.url}: {sorted(dropped)}")
+        if not variables:
+            return None
+
+        try:
+            start_date = date.fromisoformat(query.start_date.strip()[:10])
+            end_date = date.fromisoformat(query.end_date.strip()[:10])
+        except ValueError:
+            logging.warning(f"Dropping query with invalid dates {query.start_date} - {query.end_date}")
+            return None
+        if start_date > end_date:
+            start_date, end_date = end_date, start_date
+
+        first_day, last_day = self._date_limits(endpoint)
+        if first_day is not None:
+            start_date = max(start_date, first_day)
+        if last_day is not None:
+            end_date = min(end_date, last_day)
+        if self._is_historical(endpoint):
+            end_date = min(end_date, date.today())
+        if start_date > end_date:
+            logging.warning(f"Dropping query outside the date range of {endpoint.url}")
+            return None
+
+        coordinates = self._coordinates(query, place)
+        if coordinates is None:
+            logging.warning(f"Dropping query without a known location: {query.location}")
+            return None
+
+        models: Tuple[str, ...] = ()
+        known_models = self._models(endpoint)
+        if known_models:
+            models = tuple(sorted(model for model in set(query.models or []) if model in known_models)) or (known_models[0],)
+
+        return ResolvedQuery(endpoint.url, resolution, variables, start_date, end_date, *coordinates, models)
+
+    def merge(self, queries: List[ResolvedQuery]) -> List[ResolvedQuery]:
+        """
+        Merge queries for the same endpoint, resolution, location and models whose date ranges overlap or touch
+
+        Returns:
+            List[ResolvedQuery]: Merged queries, in order of first appearance
+        """
+        groups: Dict[Tuple, List[ResolvedQuery]] = {}
+        for query in queries:
+            groups.setdefault((query.endpoint, query.resolution, query.latitude, query.longitude, query.models), []).append(query)
+
+        merged: List[ResolvedQuery] = []
+        for group in groups.values():
+            group = sorted(group, key=lambda query: query.start_date)
+            current = group[0]
+            for query in group[1:]:
+                if query.start_date <= current.end_date + timedelta(days=1):
+                    current = replace(
+                        current,
+                        end_date=max(current.end_date, query.end_date),
+                        variables=tuple(sorted(set(current.variables) | set(query.variables))),
+                    )
+                else:
+                    merged.append(current)
+                    current = query
+            merged.append(current)
+        return merged
+
+    def parse(self, url: str) -> Optional[ResolvedQuery]:
+        """
+        Read a query back from an endpoint URL
+
+        Returns:
+            Optional[ResolvedQuery]: The query, or None for URLs that don't have a single location and a date range
+        """
+        endpoint = self.api.find_endpoint(url)
+        if endpoint is None:
+            return None
+        params = dict(parse_qsl(urlsplit(url).query))
+        resolutions = [resolution for resolution in RESOLUTIONS if params.get(resolution)]
+        if len(resolutions) != 1:
+            return None
+        try:
+            return ResolvedQuery(
+                endpoint=endpoint.url,
+                resolution=resolutions[0],
+                variables=tuple(sorted(params[resolutions[0]].split(","))),
+                start_date=date.fromisoformat(params["start_date"]),
+                end_date=date.fromisoformat(params["end_date"]),
+                latitude=float(params["latitude"]),
+                longitude=float(params["longitude"]),
+                models=tuple(sorted(params["models"].split(","))) if params.get("models") else (),
+            )
+        except (KeyError, ValueError):
+            return None
+
+    def chunks(self, query: ResolvedQuery) -> List[ResolvedQuery]:
+        """
+        Split a long range on a historical endpoint into calendar years
+
+        Chunks start on January 1st even if the query starts later, so the same chunk
+        serves every request covering that year. `combine` trims the extra days.
+        """
+        endpoint = self.api.find_endpoint(query.endpoint)
+        if endpoint is None or not self._is_historical(endpoint):
+            return [query]
+        if (query.end_date - query.start_date).days < self.chunk_min_days:
+            return [query]
+        return [
+            replace(query, start_date=date(year, 1, 1), end_date=min(date(year, 12, 31), query.end_date))
+            for year in range(query.start_date.year, query.end_date.year + 1)
+        ]
+
+    def fetch_urls(self, url: str) -> List[str]:
+        """
+        URLs to download for an endpoint URL
+
+        Returns:
+            List[str]: The yearly chunks of the URL, or the URL itself
+        """
+        query = self.parse(url)
+        if query is None:
+            return [url]
+        chunks = self.chunks(query)
+        return [url] if len(chunks) == 1 else [chunk.url for chunk in chunks]
+
+    def combine(self, url: str, payloads: List[Optional[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+        """
+        Concatenate the payloads of the chunks returned by `fetch_urls` and trim them to the requested range
+
+        Args:
+            url (str): The endpoint URL
+            payloads (List[Optional[Dict[str, Any]]]): Payload of each chunk, None for failed chunks
+
+        Returns:
+            Optional[Dict[str, Any]]: A payload shaped like a single response, or None if every chunk failed
+        """
+        if len(payloads) == 1:
+            return payloads[0]
+        available = [payload for payload in payloads if payload is not None]
+        if not available:
+            return None
+        if len(available) < len(payloads):
+            logging.warning(f"{len(payloads) - len(available)} of {len(payloads)} chunks failed for {url}")
+
+        query = self.parse(url)
+        combined = {key: value for key, value in available[0].items() if key not in TIME_SERIES_KEYS}
+        for series in TIME_SERIES_KEYS:
+            frames = [payload[series] for payload in available if isinstance(payload.get(series), dict)]
+            if not frames:
+                continue
+            columns = list(dict.fromkeys(column for frame in frames for column in frame))
+            lengths = [len(frame.get(TIME_COLUMN, [])) for frame in frames]
+            data = {
+                column: np.concatenate([
+                    to_column_array(column, frame[column]) if column in frame else np.full(length, np.nan, dtype=VALUE_DTYPE)
+                    for frame, length in zip(frames, lengths)
+                ])
+                for column in columns
+            }
+            if query is not None and TIME_COLUMN in data:
+                times = data[TIME_COLUMN]
+                keep = (times >= np.datetime64(query.start_date)) & (times < np.datetime64(query.end_date + timedelta(days=1)))
+                data = {column: values[keep] for column, values in data.items()}
+            combined[series] = data
+        return combined
+
+    def _coordinates(self, query: DataQuery, place: Optional[Place]) -> Optional[Tuple[float, float]]:
+        if query.latitude is not None and query.longitude is not None:
+            # the model's coordinates win over a name lookup, which may pick a namesake; they are
+            # only snapped to a place within reach, which keeps cache keys stable
+            nearest = gazetteer.nearest(query.latitude, query.longitude)
+            return nearest.coordinates if nearest is not None else (query.latitude, query.longitude)
+        if query.location:
+            resolved = gazetteer.resolve(query.location)
+            if resolved is not None:
+                return resolved.coordinates
+        if place is not None:
+            return place.coordinates
+        return None
+
+    @staticmethod
+    def _variables(endpoint: Endpoint, resolution: str) -> Dict[str, str]:
+        if resolution not in RESOLUTIONS:
+            return {}
+        return (endpoint.parameters or {}).get(f"{resolution}_parameters") or {}
+
+    @staticmethod
+    def _is_historical(endpoint: Endpoint) -> bool:
+        return (endpoint.cache or {}).get("immutable_after_days") is not None
+
+    @staticmethod
+    def _date_limits(endpoint: Endpoint) -> Tuple[Optional[date], Optional[date]]:
+        parameters = endpoint.parameters or {}
+        for group in ("required_parameters", "optional_parameters"):
+            match = DATE_RANGE_PATTERN.search((parameters.get(group) or {}).get("start_date", ""))
+            if match:
+                return date.fromisoformat(match.group(1)), date.fromisoformat(match.group(2))
+        return None, None
+
+    @staticmethod
+    def _models(endpoint: Endpoint) -> List[str]:
+        description = ((endpoint.parameters or {}).get("required_parameters") or {}).get("models", "")
+        match = MODELS_PATTERN.search(description)
+        return [model.strip() for model in match.group(1).split(",")] if match else []
+
+
+query_builder = QueryBuilder()
@@ -0,0 +1,492 @@
+import os
+import time
+import queue
+import marshal
+import asyncio
+import logging
+import threading
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from multiprocessing import shared_memory
+from types import CodeType
+from typing import Any, Dict, List, Optional, Tuple
+
+from .models import NormalizedOpenMeteoData, ProcessedData
+from .constants import (
+    SANDBOX_WORKERS,
+    SANDBOX_TIMEOUT_SECONDS,
+    SANDBOX_MAX_RSS_MB,
+    SANDBOX_WATCHDOG_INTERVAL_SECONDS,
+)
+
+PRELOADED_MODULES = [
+    "numpy",
+    "pandas",
+    "plotly.graph_objects",
+    "plotly.express",
+    "plotly.subplots",
+    "app.models",
+    "app.aggregation",
+    "app.plot_templates",
+]
+
+EXIT_TIMEOUT = 90
+EXIT_MEMORY = 91
+
+FRAME_FIELDS = ("metadata", "hourly_data", "daily_data")
+
+
+class SandboxError(Exception):
+    """Generated code could not be run to completion in the sandbox"""
+
+
+class SandboxTimeout(SandboxError):
+    """Generated code exceeded the wall-clock limit"""
+
+
+#--- Shared memory transport ---#
+
+@dataclass
+class ArrayHandle:
+    """An array stored in the shared block, or pickled inline when it isn't a plain numeric array"""
+    offset: int = 0
+    dtype: str = ""
+    shape: Tuple[int, ...] = ()
+    inline: Any = None
+
+
+@dataclass
+class FrameHandle:
+    columns: List[Any]
+    arrays: List[ArrayHandle]
+    index: ArrayHandle
+    index_name: Any = None
+
+
+@dataclass
+class DataHandle:
+    """Picklable description of a list of NormalizedOpenMeteoData whose numeric columns live in shared memory"""
+    shm_name: Optional[str]
+    entries: List[Dict[str, Optional[FrameHandle]]] = field(default_factory=list)
+
+
+def _is_shareable(array: np.ndarray) -> bool:
+    return isinstance(array, np.ndarray) and array.dtype.kind in "biufcmM"
+
+
+def export_data(data: List[NormalizedOpenMeteoData]) -> Tuple[DataHandle, Optional[shared_memory.SharedMemory]]:
+    """
+    Copy the numeric columns of every frame into a single shared memory block
+
+    Args:
+        data (List[NormalizedOpenMeteoData]): Data to hand to a worker process
+
+    Returns:
+        Tuple[DataHandle, Optional[SharedMemory]]: Handle to send to the worker, and the block the caller must unlink
+    """
+    arrays: List[np.ndarray] = []
+    handles: List[ArrayHandle] = []
+    size = 0
+
+    def register(array: np.ndarray) -> ArrayHandle:
+        nonlocal size
+        if not _is_shareable(array):
+            return ArrayHandle(inline=array)
+        array = np.ascontiguousarray(array)
+        handle = ArrayHandle(offset=size, dtype=array.dtype.str, shape=array.shape)
+        arrays.append(array)
+        handles.append(handle)
+        # keep every array 8-byte aligned
+        size += (array.nbytes + 7) & ~7
+        return handle
+
+    entries = []
+    for entry in data:
+        frames = {}
+        for name in FRAME_FIELDS:
+            df = getattr(entry, name)
+            if df is None:
+                frames[name] = None
+                continue
+            index = ArrayHandle(inline=df.index) if isinstance(df.index, pd.RangeIndex) else register(df.index.to_numpy())
+            frames[name] = FrameHandle(
+                columns=list(df.columns),
+                arrays=[register(df.iloc[:, i].to_numpy()) for i in range(df.shape[1])],
+                index=index,
+                index_name=df.index.name,
+            )
+        entries.append(frames)
+
+    if size == 0:
+        return DataHandle(shm_name=None, entries=entries), None
+
+    shm = shared_memory.SharedMemory(create=True, size=size)
+    for array, handle in zip(arrays, handles):
+        target = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf, offset=handle.offset)
+        target[...] = array
+    return DataHandle(shm_name=shm.name, entries=entries), shm
+
+
+def import_data(handle: DataHandle) -> List[NormalizedOpenMeteoData]:
+    """
+    Rebuild the data described by `export_data`, copying arrays out of shared memory
+    """
+    shm = shared_memory.SharedMemory(name=handle.shm_name) if handle.shm_name else None
+
+    def load(array: ArrayHandle):
+        if array.inline is not None or not array.dtype:
+            return array.inline
+        view = np.ndarray(array.shape, dtype=np.dtype(array.dtype), buffer=shm.buf, offset=array.offset)
+        return view.copy()
+
+    try:
+        data = []
+        for frames in handle.entries:
+            rebuilt = {}
+            for name, frame in frames.items():
+                if frame is None:
+                    rebuilt[name] = None
+                    continue
+                index = pd.Index(load(frame.index), name=frame.index_name)
+                df = pd.DataFrame({i: load(array) for i, array in enumerate(frame.arrays)}, index=index)
+                df.columns = frame.columns
+                rebuilt[name] = df
+            data.append(NormalizedOpenMeteoData(**rebuilt))
+        return data
+    finally:
+        if shm is not None:
+            shm.close()
+
+
+#--- Worker process ---#
+
+_task_deadline: Optional[float] = None
+
+
+def _current_rss(pid: Any = "self") -> Optional[int]:
+    try:
+        with open(f"/proc/{pid}/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _watchdog(max_rss_bytes: int) -> None:
+    """Kill the worker when the running task exceeds its wall-clock or memory limit"""
+    while True:
+        time.sleep(SANDBOX_WATCHDOG_INTERVAL_SECONDS)
+        deadline = _task_deadline
+        if deadline is None:
+            # an idle worker is never killed, the executor recycles one left too large by its last task
+            continue
+        if time.monotonic() > deadline:
+            os._exit(EXIT_TIMEOUT)
+        rss = _current_rss()
+        if rss is not None and rss > max_rss_bytes:
+            os._exit(EXIT_MEMORY)
+
+
+def _init_worker(max_rss_bytes: int) -> None:
+    import plotly.graph_objects  # noqa: F401
+    import plotly.express  # noqa: F401
+    import plotly.subplots  # noqa: F401
+    from .plot_templates import template_registry
+
+    # generated code can then use the published templates by name
+    template_registry.load()
+    threading.Thread(target=_watchdog, args=(max_rss_bytes,), daemon=True).start()
+
+
+def _namespace() -> Dict[str, Any]:
+    """Globals available to generated code"""
+    import datetime
+    import typing
+    import plotly
+    import plotly.graph_objects as go
+    import plotly.express as px
+    from plotly.subplots import make_subplots
+    from dataclasses import dataclass
+    from . import aggregation
+
+    return {
+        "__name__": "generated",
+        "__builtins__": __builtins__,
+        "np": np,
+        "pd": pd,
+        "go": go,
+        "px": px,
+        "plotly": plotly,
+        "make_subplots": make_subplots,
+        "agg": aggregation,
+        "datetime": datetime.datetime,
+        "dataclass": dataclass,
+        "List": typing.List,
+        "Dict": typing.Dict,
+        "Optional": typing.Optional,
+        "NormalizedOpenMeteoData": NormalizedOpenMeteoData,
+        "ProcessedData": ProcessedData,
+    }
+
+
+def run_generated(code: CodeType, entrypoint: str, data: List[NormalizedOpenMeteoData]) -> Any:
+    """
+    Execute generated code and call the function it defines
+
+    Args:
+        code (CodeType): Compiled generated source
+        entrypoint (str): Name of the function to call, e.g. `visualize`
+        data (List[NormalizedOpenMeteoData]): Argument passed to the function
+
+    Returns:
+        Any: Whatever the generated function returned
+    """
+    namespace = _namespace()
+    exec(code, namespace)
+    function = namespace.get(entrypoint)
+    if not callable(function):
+        raise SandboxError(f"Generated code does not define {entrypoint}()")
+    return function(data)
+
+
+def _to_transferable(result: Any) -> Tuple[str, Any]:
+    import plotly.graph_objects as go
+
+    if isinstance(result, go.Figure):
+        return "figure", result.to_dict()
+    if hasattr(result, "main_data") and hasattr(result, "nested_dataframes"):
+        return "processed", (result.main_data, result.nested_dataframes)
+    return "value", result
+
+
+def _run_task(code_bytes: bytes, entrypoint: str, handle: DataHandle, timeout: float) -> Tuple[str, Any]:
+    global _task_deadline
+    _task_deadline = time.monotonic() + timeout
+    try:
+        data = import_data(handle)
+        return _to_transferable(run_generated(marshal.loads(code_bytes), entrypoint, data))
+    finally:
+        _task_deadline = None
+
+
+def _serve(connection, max_rss_bytes: int) -> None:
+    """Worker main loop: run the tasks received on the pipe one at a time, until it closes"""
+    _init_worker(max_rss_bytes)
+    while True:
+        try:
+            task = connection.recv()
+        except EOFError:
+            return
+        try:
+            reply = ("ok", _run_task(*task))
+        except Exception as e:
+            reply = ("error", e)
+        try:
+            connection.send(reply)
+        except Exception:
+            # the result or the exception of the generated code doesn't pickle
+            error = reply[1] if reply[0] == "error" else None
+            connection.send(("error", SandboxError(f"Unpicklable result: {error!r}" if error else "Unpicklable result")))
+
+
+#--- Executor ---#
+
+class _Worker:
+    """A sandbox process, and the pipe it receives tasks and sends results on"""
+
+    def __init__(self, context, max_rss_bytes: int):
+        self.connection, child = context.Pipe()
+        self.process = context.Process(target=_serve, args=(child, max_rss_bytes), daemon=True)
+        self.process.start()
+        child.close()
+
+    def call(self, task: Tuple[Any, ...], timeout: float) -> Tuple[str, Any]:
+        """
+        Send a task and wait for its reply
+
+        Raises:
+            BrokenPipeError: The process was already dead, the task wasn't run
+            TimeoutError: No reply within the timeout, the process is stuck
+            EOFError: The process died
+        """
+        if not self.process.is_alive():
+            raise BrokenPipeError
+        self.connection.send(task)
+        if not self.connection.poll(timeout):
+            raise TimeoutError
+        return self.connection.recv()
+
+    def kill(self) -> None:
+        self.process.kill()
+        self.process.join(1)
+        self.connection.close()
+
+
+class SandboxExecutor:
+    """
+    Runs LLM generated code in a pool of pre-warmed worker processes.
+
+    Workers are forked from a server that already imported pandas, numpy and plotly.
+    Input frames are passed through shared memory, and each task is bounded by a
+    wall-clock limit and a resident memory limit enforced inside the worker.
+    A worker runs one task at a time, so a task that breaks a limit only takes its
+    own worker down: a stuck worker is killed, and a dead one replaced, while the
+    tasks of the other workers carry on.
+    With zero workers, generated code runs in a thread of the web worker instead.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = SANDBOX_WORKERS,
+        timeout: float = SANDBOX_TIMEOUT_SECONDS,
+        max_rss_mb: int = SANDBOX_MAX_RSS_MB,
+    ):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.max_rss_bytes = max_rss_mb * 1024 * 1024
+        self._context = None
+        self._workers: List[_Worker] = []
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        # one thread per worker waits on its pipe; queued tasks wait for a thread
+        self._threads: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        """Start and pre-warm every worker"""
+        if self.max_workers <= 0:
+            return
+        with self._lock:
+            if self._threads is not None:
+                return
+            self._context = multiprocessing.get_context("forkserver")
+            self._context.set_forkserver_preload(PRELOADED_MODULES)
+            self._threads = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="sandbox")
+            for _ in range(self.max_workers):
+                self._spawn()
+
+    def shutdown(self) -> None:
+        """Kill every worker; tasks still running fail with SandboxError"""
+        with self._lock:
+            if self._threads is None:
+                return
+            self._threads.shutdown(wait=False, cancel_futures=True)
+            self._threads = None
+            for worker in self._workers:
+                worker.kill()
+            self._workers = []
+            self._idle = queue.Queue()
+
+    async def run(self, code: CodeType, entrypoint: str, data: List[NormalizedOpenMeteoData]) -> Any:
+        """
+        Run generated code against the given data
+
+        Args:
+            code (CodeType): Compiled generated source
+            entrypoint (str): Name of the function to call
+            data (List[NormalizedOpenMeteoData]): Input data
+
+        Returns:
+            Any: The function result; figures come back as go.Figure, rebuilt off the event loop
+
+        Raises:
+            SandboxTimeout: The code ran longer than the wall-clock limit
+            SandboxError: The worker died, e.g. after exceeding the memory limit
+        """
+        if self.max_workers <= 0:
+            return await asyncio.wait_for(asyncio.to_thread(run_generated, code, entrypoint, data), self.timeout)
+
+        self.start()
+        threads = self._threads
+        if threads is None:
+            raise SandboxError("Sandbox is shut down")
+        handle, shm = export_data(data)
+        try:
+            task = (marshal.dumps(code), entrypoint, handle, self.timeout)
+            status, value = await asyncio.get_running_loop().run_in_executor(threads, self._call, entrypoint, task)
+        finally:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+
+        if status == "error":
+            raise value
+        return value
+
+    def _call(self, entrypoint: str, task: Tuple[Any, ...]) -> Tuple[str, Any]:
+        """
+        Run a task on an idle worker, replacing the worker if the task took it down
+
+        Runs in an executor thread, which also rebuilds the result, so validating a
+        large figure doesn't block the event loop.
+        """
+        idle = self._idle
+        while True:
+            worker = idle.get()
+            try:
+                # the worker enforces the limit itself, the grace period only covers a stuck worker
+                status, value = worker.call(task, self.timeout + 5)
+                break
+            except BrokenPipeError:
+                # the worker died while idle: the task never reached it and goes to another one
+                logging.warning(f"Sandbox worker {worker.process.pid} died while idle, replacing it")
+                if not self._replace(worker, idle):
+                    raise SandboxError("Sandbox is shut down")
+            except TimeoutError:
+                logging.warning(f"Sandbox worker {worker.process.pid} stuck in {entrypoint}(), killing it")
+                self._replace(worker, idle)
+                raise SandboxTimeout(f"{entrypoint}() exceeded {self.timeout:.0f}s")
+            except (EOFError, OSError):
+                worker.process.join(1)
+                exitcode = worker.process.exitcode
+                self._replace(worker, idle)
+                if exitcode == EXIT_TIMEOUT:
+                    raise SandboxTimeout(f"{entrypoint}() exceeded {self.timeout:.0f}s")
+                if exitcode == EXIT_MEMORY:
+                    raise SandboxError(f"{entrypoint}() exceeded {self.max_rss_bytes // 2**20} MB")
+                raise SandboxError(f"{entrypoint}() worker died with exit code {exitcode}")
+
+        # the memory limit is only checked during a task, so the memory a task leaves
+        # behind would count against the next one: such a worker is recycled instead
+        rss = _current_rss(worker.process.pid)
+        if rss is not None and rss > self.max_rss_bytes:
+            logging.info(f"Sandbox worker {worker.process.pid} kept {rss // 2**20} MB after {entrypoint}(), recycling it")
+            self._replace(worker, idle)
+        else:
+            idle.put(worker)
+
+        if status == "error":
+            return status, value
+        return status, self._from_transferable(*value)
+
+    def _spawn(self) -> None:
+        worker = _Worker(self._context, self.max_rss_bytes)
+        self._workers.append(worker)
+        self._idle.put(worker)
+
+    def _replace(self, worker: _Worker, idle: "queue.Queue[_Worker]") -> bool:
+        """Kill a worker and start another in its place; False if the pool was shut down meanwhile"""
+        worker.kill()
+        with self._lock:
+            # after a shutdown, the pool is gone and the worker isn't replaced
+            if idle is not self._idle:
+                return False
+            self._workers.remove(worker)
+            self._spawn()
+            return True
+
+    @staticmethod
+    def _from_transferable(kind: str, value: Any) -> Any:
+        if kind == "figure":
+            import plotly.graph_objects as go
+            return go.Figure(value)
+        if kind == "processed":
+            main_data, nested_dataframes = value
+            return ProcessedData(main_data=main_data, nested_dataframes=nested_dataframes)
+        return value
+
+
+sandbox_executor = SandboxExecutor()
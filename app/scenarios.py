@@ -0,0 +1,258 @@
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+import unicodedata
+
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, Iterable, Optional, Set, Tuple
+
+from .ai import anthropic_client
+from .constants import (
+    USER,
+    AVAILABLE_SCENARIOS,
+    PRERENDERED_LANGUAGES,
+    SCENARIO_POOL_SIZE,
+    SCENARIO_POOL_TTL_SECONDS,
+    SCENARIO_POOL_MAX_KEYS,
+    SCENARIO_POOL_MAX_TRACKED_CHATS,
+    SCENARIO_POOL_CONCURRENCY,
+    SCENARIO_POOL_LOCATIONS,
+)
+from .geocoding import gazetteer
+from .models import ScenarioResponse
+from .prompts import SCENARIO_GENERATION_PROMPT
+from .usage import set_usage_scope
+
+PoolKey = Tuple[str, str, str]
+
+
+async def generate_scenario(location: str, topic: str, lang: Optional[str]) -> ScenarioResponse:
+    """
+    Generate a civic decision-making scenario with the LLM
+
+    Args:
+        location (str): Location of the scenario
+        topic (str): Climate topic one of the options is linked to
+        lang (Optional[str]): Output language or Accept-Language header
+
+    Returns:
+        ScenarioResponse: The scenario, its budget and options
+    """
+    return await anthropic_client.astructured_completion(
+        messages=[
+            {"role": USER, "content": SCENARIO_GENERATION_PROMPT.format(
+                climate_topic=topic,
+                location=location
+            )},],
+        response_format=ScenarioResponse,
+        system_prompt=f"You are a policy maker in {location} and you have to create a realistic scenario to assess citizen's decision making in public budget spending / allocation. Depending on the language, adapt the currency for the budget. (e.g. JPY for Japanese, USD for English)",
+        lang=lang
+    )
+
+
+def language_tag(lang: Optional[str]) -> str:
+    """Primary language of an Accept-Language header, e.g. `ja` for `ja-JP,ja;q=0.9`"""
+    tag = (lang or "").split(",")[0].split(";")[0].split("-")[0].strip().lower()
+    return tag or "en"
+
+
+def scenario_fingerprint(scenario: ScenarioResponse) -> str:
+    text = unicodedata.normalize("NFKC", scenario.scenario).casefold()
+    return hashlib.sha256(" ".join(text.split()).encode()).hexdigest()
+
+
+@dataclass
+class PooledScenarios:
+    """
+    Ready scenarios of a location, topic and language.
+
+    Attributes:
+        location (str): Location the scenarios are generated for
+        scenarios (Deque[Tuple[float, str, ScenarioResponse]]): Creation time, fingerprint and scenario, oldest first
+        refill (Optional[asyncio.Task]): Running refill, if any
+    """
+    location: str
+    scenarios: Deque[Tuple[float, str, ScenarioResponse]] = field(default_factory=deque)
+    refill: Optional[asyncio.Task] = None
+
+
+class ScenarioPool:
+    """
+    Scenarios generated ahead of time, handed out when a session starts.
+
+    Pools are keyed by gazetteer place, topic and language. Each keeps up to `size`
+    distinct scenarios younger than `ttl` seconds and is refilled in the background
+    when one is taken. A chat never gets the same scenario twice. When a pool is
+    empty, or the location isn't in the gazetteer, the scenario is generated live.
+    """
+
+    def __init__(
+        self,
+        size: int = SCENARIO_POOL_SIZE,
+        ttl: float = SCENARIO_POOL_TTL_SECONDS,
+        max_keys: int = SCENARIO_POOL_MAX_KEYS,
+        max_tracked_chats: int = SCENARIO_POOL_MAX_TRACKED_CHATS,
+        concurrency: int = SCENARIO_POOL_CONCURRENCY,
+    ):
+        self.size = size
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.max_tracked_chats = max_tracked_chats
+        self._pools: "OrderedDict[PoolKey, PooledScenarios]" = OrderedDict()
+        self._served: "OrderedDict[str, Set[str]]" = OrderedDict()
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._warmup: Optional[asyncio.Task] = None
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "generated": 0, "duplicates": 0, "expired": 0, "failures": 0}
+
+    def start(self, locations: Iterable[str] = SCENARIO_POOL_LOCATIONS, languages: Iterable[str] = PRERENDERED_LANGUAGES) -> None:
+        """Fill the pools of the common locations, for every topic and language, in the background"""
+        keys = [
+            (location, topic, lang)
+            for location in locations
+            for topic in AVAILABLE_SCENARIOS
+            for lang in languages
+        ]
+        if keys:
+            self._warmup = asyncio.create_task(self._warm(keys))
+
+    async def stop(self) -> None:
+        """Cancel the warm-up and running refills"""
+        tasks = [pool.refill for pool in self._pools.values() if pool.refill is not None]
+        if self._warmup is not None:
+            tasks.append(self._warmup)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._warmup = None
+
+    async def get(self, chat_id: str, location: str, topic: str, lang: Optional[str]) -> ScenarioResponse:
+        """
+        Hand out a pooled scenario, or generate one if none is ready
+
+        Args:
+            chat_id (str): Chat the scenario is for
+            location (str): Location requested by the user
+            topic (str): Climate topic
+            lang (Optional[str]): Accept-Language header
+
+        Returns:
+            ScenarioResponse: The scenario
+        """
+        key = self.key(location, topic, lang)
+        if key is None:
+            return await self._generate_live(chat_id, location, topic, lang)
+
+        pool = self._pool(key, location)
+        scenario = self._take(pool, chat_id)
+        self._schedule_refill(key, pool)
+        if scenario is None:
+            return await self._generate_live(chat_id, location, topic, lang)
+        return scenario
+
+    def key(self, location: str, topic: str, lang: Optional[str]) -> Optional[PoolKey]:
+        """Pool of a request, None for locations outside the gazetteer and unknown topics"""
+        if topic not in AVAILABLE_SCENARIOS:
+            return None
+        place = gazetteer.resolve(location)
+        if place is None:
+            return None
+        return place.name, topic, language_tag(lang)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats, pools=len(self._pools), ready=sum(len(pool.scenarios) for pool in self._pools.values()))
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    async def _warm(self, keys: Iterable[Tuple[str, str, str]]) -> None:
+        for location, topic, lang in keys:
+            key = self.key(location, topic, lang)
+            if key is None:
+                logging.warning(f"Scenario pool location not found in gazetteer: {location}")
+                continue
+            self._schedule_refill(key, self._pool(key, location))
+
+    def _pool(self, key: PoolKey, location: str) -> PooledScenarios:
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = self._pools[key] = PooledScenarios(location=location)
+                if len(self._pools) > self.max_keys:
+                    _, evicted = self._pools.popitem(last=False)
+                    if evicted.refill is not None:
+                        evicted.refill.cancel()
+            self._pools.move_to_end(key)
+            return pool
+
+    def _take(self, pool: PooledScenarios, chat_id: str) -> Optional[ScenarioResponse]:
+        now = time.time()
+        with self._lock:
+            while pool.scenarios and now - pool.scenarios[0][0] > self.ttl:
+                pool.scenarios.popleft()
+                self._stats["expired"] += 1
+            served = self._served_to(chat_id)
+            for entry in pool.scenarios:
+                if entry[1] not in served:
+                    pool.scenarios.remove(entry)
+                    served.add(entry[1])
+                    self._stats["hits"] += 1
+                    return entry[2]
+            self._stats["misses"] += 1
+            return None
+
+    def _served_to(self, chat_id: str) -> Set[str]:
+        served = self._served.get(chat_id)
+        if served is None:
+            served = self._served[chat_id] = set()
+            if len(self._served) > self.max_tracked_chats:
+                self._served.popitem(last=False)
+        self._served.move_to_end(chat_id)
+        return served
+
+    async def _generate_live(self, chat_id: str, location: str, topic: str, lang: Optional[str]) -> ScenarioResponse:
+        scenario = await generate_scenario(location, topic, lang)
+        if scenario is not None and scenario_fingerprint(scenario) in self._served.get(chat_id, ()):
+            # the chat already had this one, another try is very likely to differ
+            scenario = await generate_scenario(location, topic, lang) or scenario
+        if scenario is not None:
+            with self._lock:
+                self._served_to(chat_id).add(scenario_fingerprint(scenario))
+        return scenario
+
+    def _schedule_refill(self, key: PoolKey, pool: PooledScenarios) -> None:
+        if len(pool.scenarios) >= self.size or (pool.refill is not None and not pool.refill.done()):
+            return
+        pool.refill = asyncio.create_task(self._refill(key, pool))
+
+    async def _refill(self, key: PoolKey, pool: PooledScenarios) -> None:
+        _, topic, lang = key
+        set_usage_scope("scenario_pool")
+        # a few extra attempts make up for duplicates, failures stop the refill until the next request
+        for _ in range(2 * self.size):
+            if len(pool.scenarios) >= self.size:
+                return
+            try:
+                async with self._semaphore:
+                    scenario = await generate_scenario(pool.location, topic, lang)
+            except Exception as e:
+                logging.warning(f"Scenario pool refill failed for {key}: {e}")
+                with self._lock:
+                    self._stats["failures"] += 1
+                return
+            if scenario is None:
+                return
+            fingerprint = scenario_fingerprint(scenario)
+            with self._lock:
+                if any(entry[1] == fingerprint for entry in pool.scenarios):
+                    self._stats["duplicates"] += 1
+                    continue
+                pool.scenarios.append((time.time(), fingerprint, scenario))
+                self._stats["generated"] += 1
+
+
+scenario_pool = ScenarioPool()
@@ -0,0 +1,215 @@
+import time
+import pickle
+import sqlite3
+import logging
+import threading
+
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass, field, replace
+from typing import List, Optional, Tuple
+
+from .models import NormalizedOpenMeteoData
+from .geocoding import Place
+from .constants import (
+    SESSION_STORE_BACKEND,
+    SESSION_STORE_PATH,
+    SESSION_MAX_ENTRIES,
+    SESSION_MAX_MEMORY_MB,
+    SESSION_TTL_SECONDS,
+)
+
+
+@dataclass
+class SessionState:
+    """
+    Per-chat state shared between routes.
+
+    Attributes:
+        data_description (str): Statistical description of the data behind the last visualization
+        data (List[NormalizedOpenMeteoData]): Data fetched for the last visualization
+        figure (Optional[str]): Plotly JSON of the last visualization
+        location (str): Location requested by the user
+        place (Optional[Place]): Gazetteer place `location` resolved to
+        updated_at (float): Last write, as a UNIX timestamp
+    """
+    data_description: str = ""
+    data: List[NormalizedOpenMeteoData] = field(default_factory=list)
+    figure: Optional[str] = None
+    location: str = ""
+    place: Optional[Place] = None
+    updated_at: float = field(default_factory=time.time)
+
+    def coordinates(self) -> Optional[Tuple[float, float]]:
+        """Latitude and longitude of the session location, or of the data behind the last visualization"""
+        if self.place is not None:
+            return self.place.coordinates
+        for entry in self.data:
+            metadata = entry.metadata
+            if metadata is not None and {"latitude", "longitude"} <= set(metadata.columns) and len(metadata):
+                return float(metadata["latitude"].iloc[0]), float(metadata["longitude"].iloc[0])
+        return None
+
+    def size_in_bytes(self) -> int:
+        size = len(self.data_description) + len(self.figure or "")
+        for entry in self.data:
+            for df in (entry.metadata, entry.hourly_data, entry.daily_data):
+                if df is not None:
+                    size += int(df.memory_usage(index=True).sum())
+        return size
+
+
+class SessionStore(ABC):
+    """
+    Abstract store for per-chat session state
+    """
+
+    @abstractmethod
+    def get(self, chat_id: str) -> Optional[SessionState]:
+        pass
+
+    @abstractmethod
+    def set(self, chat_id: str, state: SessionState) -> None:
+        pass
+
+    @abstractmethod
+    def delete(self, chat_id: str) -> None:
+        pass
+
+    def update(self, chat_id: str, **changes) -> SessionState:
+        """
+        Merge changes into the state of a chat, creating it if needed
+
+        Args:
+            chat_id (str): The chat ID
+            **changes: SessionState fields to overwrite
+
+        Returns:
+            SessionState: The stored state
+        """
+        state = replace(self.get(chat_id) or SessionState(), **changes, updated_at=time.time())
+        self.set(chat_id, state)
+        return state
+
+
+class MemorySessionStore(SessionStore):
+    """
+    In-memory LRU session store with TTL, bounded by entry count and approximate size.
+
+    An optional backend is written through on every update and read through on a miss,
+    so sessions survive evictions and restarts.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = SESSION_MAX_ENTRIES,
+        max_bytes: int = SESSION_MAX_MEMORY_MB * 1024 * 1024,
+        ttl: float = SESSION_TTL_SECONDS,
+        backend: Optional[SessionStore] = None,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.backend = backend
+        self._entries: OrderedDict[str, Tuple[SessionState, int]] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, chat_id: str) -> Optional[SessionState]:
+        with self._lock:
+            entry = self._entries.get(chat_id)
+            if entry is not None:
+                state, _ = entry
+                if state.updated_at + self.ttl >= time.time():
+                    self._entries.move_to_end(chat_id)
+                    return state
+                self._remove(chat_id)
+
+        if self.backend is None:
+            return None
+        state = self.backend.get(chat_id)
+        if state is not None:
+            self._insert(chat_id, state)
+        return state
+
+    def set(self, chat_id: str, state: SessionState) -> None:
+        self._insert(chat_id, state)
+        if self.backend is not None:
+            self.backend.set(chat_id, state)
+
+    def delete(self, chat_id: str) -> None:
+        with self._lock:
+            self._remove(chat_id)
+        if self.backend is not None:
+            self.backend.delete(chat_id)
+
+    def _insert(self, chat_id: str, state: SessionState) -> None:
+        size = state.size_in_bytes()
+        with self._lock:
+            self._remove(chat_id)
+            self._entries[chat_id] = (state, size)
+            self._size += size
+            while len(self._entries) > 1 and (len(self._entries) > self.max_entries or self._size > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, chat_id: str) -> None:
+        entry = self._entries.pop(chat_id, None)
+        if entry is not None:
+            self._size -= entry[1]
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Session store persisted in a local SQLite file
+    """
+
+    def __init__(self, path: str = SESSION_STORE_PATH, ttl: float = SESSION_TTL_SECONDS):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS sessions (chat_id TEXT PRIMARY KEY, state BLOB NOT NULL, updated_at REAL NOT NULL)"
+            )
+
+    def get(self, chat_id: str) -> Optional[SessionState]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT state FROM sessions WHERE chat_id = ? AND updated_at >= ?",
+                (chat_id, time.time() - self.ttl),
+            ).fetchone()
+        if row is None:
+            return None
+        try:
+            return pickle.loads(row[0])
+        except Exception as e:
+            logging.warning(f"Discarding unreadable session {chat_id}: {str(e)}")
+            self.delete(chat_id)
+            return None
+
+    def set(self, chat_id: str, state: SessionState) -> None:
+        blob = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO sessions (chat_id, state, updated_at) VALUES (?, ?, ?)",
+                (chat_id, blob, state.updated_at),
+            )
+            self._connection.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.ttl,))
+
+    def delete(self, chat_id: str) -> None:
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM sessions WHERE chat_id = ?", (chat_id,))
+
+
+def build_session_store() -> SessionStore:
+    """
+    Build the session store configured by SESSION_STORE_BACKEND (`memory` or `sqlite`)
+    """
+    backend = None
+    if SESSION_STORE_BACKEND == "sqlite":
+        backend = SQLiteSessionStore(SESSION_STORE_PATH)
+    return MemorySessionStore(backend=backend)
+
+
+session_store = build_session_store()
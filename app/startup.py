@@ -0,0 +1,96 @@
+import os
+import time
+import logging
+import threading
+
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+from .constants import COLD_START_TARGET_SECONDS
+
+
+def process_age() -> Optional[float]:
+    """Seconds since the process started, None where /proc isn't available"""
+    try:
+        with open("/proc/self/stat", "r") as file:
+            # the command name, in parentheses, may contain spaces; starttime is the 22nd field
+            start_ticks = int(file.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime", "r") as file:
+            uptime = float(file.read().split()[0])
+        return uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class StartupProfile:
+    """
+    Cold start timings: when the app was imported and ready to serve, relative to the
+    process start, and the duration of every warm-up step.
+
+    The LLM SDKs and the tokenizer are imported, and clients, prompts, templates and
+    the sandbox built, on first use; the warm-up does it ahead of the first request,
+    before serving in eager mode, in the background in lazy mode. pandas and numpy
+    are still imported with the app, since the data models are typed with them.
+    """
+
+    def __init__(self, target: float = COLD_START_TARGET_SECONDS):
+        self.target = target
+        self.imported: Optional[float] = None
+        self.ready: Optional[float] = None
+        self.warmed_up: Optional[float] = None
+        self._steps: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def mark_imported(self) -> None:
+        self.imported = process_age()
+
+    def mark_ready(self) -> None:
+        """Record that the app serves requests, warning when it took longer than the target"""
+        self.ready = process_age()
+        if self.ready is None:
+            return
+        logging.info(f"Ready {self.ready:.2f}s after process start, app imported at {self.imported or 0:.2f}s")
+        if self.ready > self.target:
+            logging.warning(f"Cold start of {self.ready:.2f}s is over the {self.target:.2f}s target")
+
+    @contextmanager
+    def step(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._steps[name] = time.perf_counter() - start
+
+    def warm_up(self, steps: Iterable[Tuple[str, Callable[[], Any]]]) -> None:
+        """
+        Run the warm-up steps in order, timing each; a failing step is logged and skipped
+
+        Args:
+            steps (Iterable[Tuple[str, Callable[[], Any]]]): Step names and functions
+        """
+        start = time.perf_counter()
+        for name, function in steps:
+            try:
+                with self.step(name):
+                    function()
+            except Exception as e:
+                logging.warning(f"Warm-up step {name} failed: {e}")
+        self.warmed_up = process_age()
+        logging.info(f"Warm-up done in {time.perf_counter() - start:.2f}s: " + ", ".join(
+            f"{name}={seconds * 1000:.0f}ms" for name, seconds in self._steps.items()
+        ))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            steps = dict(self._steps)
+        return {
+            "imported": self.imported,
+            "ready": self.ready,
+            "warmed_up": self.warmed_up,
+            "target": self.target,
+            "steps": steps,
+        }
+
+
+startup_profile = StartupProfile()
@@ -0,0 +1,151 @@
+import json
+import asyncio
+import logging
+
+from typing import Any, AsyncGenerator, AsyncIterator, Awaitable, Callable, List, Optional
+
+from .constants import (
+    EVENT_TOKEN,
+    EVENT_DONE,
+    EVENT_ERROR,
+    STREAM_FLUSH_INTERVAL_SECONDS,
+    STREAM_FLUSH_MAX_CHARS,
+    STREAM_HEARTBEAT_SECONDS,
+)
+
+EventCallback = Callable[[str, Any], Awaitable[None]]
+
+# Keep proxies from buffering the stream
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+# SSE comment line, ignored by EventSource clients, that keeps idle connections open
+HEARTBEAT_FRAME = ": keep-alive\n\n"
+
+
+def format_sse(event: str, data: Any) -> str:
+    """
+    Format a Server-Sent Event frame
+
+    Args:
+        event (str): Event name
+        data (Any): JSON serializable payload
+
+    Returns:
+        str: SSE frame
+    """
+    payload = json.dumps(data, ensure_ascii=False, default=str)
+    lines = "\n".join(f"data: {line}" for line in payload.splitlines() or [""])
+    return f"event: {event}\n{lines}\n\n"
+
+
+async def event_stream(producer: Callable[[EventCallback], Awaitable[None]]) -> AsyncGenerator[str, None]:
+    """
+    Run a producer in the background and yield the events it emits as SSE frames.
+
+    The producer is cancelled if the client disconnects before it finishes.
+
+    Args:
+        producer (Callable): Coroutine function receiving an `emit(event, data)` callback
+
+    Yields:
+        str: SSE frames, in emission order
+    """
+    queue: asyncio.Queue[Optional[tuple[str, Any]]] = asyncio.Queue()
+
+    async def emit(event: str, data: Any) -> None:
+        await queue.put((event, data))
+
+    async def run() -> None:
+        try:
+            await producer(emit)
+        finally:
+            await queue.put(None)
+
+    task = asyncio.create_task(run())
+    try:
+        while (item := await queue.get()) is not None:
+            yield format_sse(*item)
+        await task
+    finally:
+        if not task.done():
+            task.cancel()
+
+
+async def text_event_stream(
+    chunks: AsyncIterator[str],
+    flush_interval: float = STREAM_FLUSH_INTERVAL_SECONDS,
+    flush_max_chars: int = STREAM_FLUSH_MAX_CHARS,
+    heartbeat: float = STREAM_HEARTBEAT_SECONDS,
+) -> AsyncGenerator[str, None]:
+    """
+    Stream text chunks, e.g. LLM tokens, as SSE frames.
+
+    Chunks are read in the background and coalesced into `token` events, sent once
+    `flush_interval` seconds passed since the first buffered chunk or `flush_max_chars`
+    characters are buffered. A heartbeat comment is sent when nothing was sent for
+    `heartbeat` seconds, e.g. while the first token is awaited. The stream ends with
+    a `done` event, or an `error` event if reading the chunks fails.
+
+    When the client disconnects, the response is cancelled and so is the reading of
+    the chunks, which closes the upstream stream.
+
+    Args:
+        chunks (AsyncIterator[str]): Text chunks
+        flush_interval (float): Longest time a chunk waits to be sent, in seconds
+        flush_max_chars (int): Buffered characters sent right away
+        heartbeat (float): Idle time before a heartbeat, in seconds
+
+    Yields:
+        str: SSE frames
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue[Any] = asyncio.Queue()
+    end = object()
+
+    async def read() -> None:
+        try:
+            async for chunk in chunks:
+                queue.put_nowait(chunk)
+        except Exception as e:
+            logging.error(f"Error while streaming: {e}", exc_info=True)
+            queue.put_nowait(e)
+        finally:
+            queue.put_nowait(end)
+
+    reader = asyncio.create_task(read())
+    getter: Optional[asyncio.Task] = None
+    buffer: List[str] = []
+    buffered = 0
+    flush_at = 0.0
+    last_frame = loop.time()
+    try:
+        while True:
+            wait = (flush_at if buffer else last_frame + heartbeat) - loop.time()
+            getter = getter or asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait({getter}, timeout=max(wait, 0))
+            if not done:
+                # nothing new within the window: send what is buffered, or a heartbeat
+                yield format_sse(EVENT_TOKEN, "".join(buffer)) if buffer else HEARTBEAT_FRAME
+                buffer, buffered, last_frame = [], 0, loop.time()
+                continue
+
+            item, getter = getter.result(), None
+            if item is end or isinstance(item, Exception):
+                if buffer:
+                    yield format_sse(EVENT_TOKEN, "".join(buffer))
+                yield format_sse(EVENT_DONE, {}) if item is end else format_sse(EVENT_ERROR, {"detail": "Internal Server Error"})
+                return
+
+            if not buffer:
+                flush_at = loop.time() + flush_interval
+            buffer.append(item)
+            buffered += len(item)
+            if buffered >= flush_max_chars:
+                yield format_sse(EVENT_TOKEN, "".join(buffer))
+                buffer, buffered, last_frame = [], 0, loop.time()
+    finally:
+        if getter is not None:
+            getter.cancel()
+        if not reader.done():
+            logging.info("Client disconnected, cancelling the upstream stream")
+            reader.cancel()
@@ -0,0 +1,274 @@
+import threading
+import weakref
+
+import numpy as np
+import pandas as pd
+
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from .constants import STATS_BASELINE_YEARS, STATS_RECENT_YEARS, STATS_CACHE_MAX_ENTRIES
+
+# Meteorological seasons, indexed by `(month % 12) // 3`
+SEASONS = ("DJF", "MAM", "JJA", "SON")
+
+YEAR = np.timedelta64(31556952, "s")
+
+
+@dataclass(frozen=True)
+class ColumnStatistics:
+    """
+    Summary statistics of a numeric column.
+
+    Attributes:
+        name (str): Column name
+        count (int): Number of valid values
+        mean (float): Mean value
+        minimum (float): Minimum value
+        maximum (float): Maximum value
+        first (float): First valid value
+        last (float): Last valid value
+        trend_per_decade (Optional[float]): Least squares slope, per 10 years, None without a time index
+        baseline_mean (Optional[float]): Mean over the baseline period
+        recent_mean (Optional[float]): Mean over the recent period
+        seasonal_means (Dict[str, float]): Mean per meteorological season with data
+    """
+    name: str
+    count: int
+    mean: float
+    minimum: float
+    maximum: float
+    first: float
+    last: float
+    trend_per_decade: Optional[float] = None
+    baseline_mean: Optional[float] = None
+    recent_mean: Optional[float] = None
+    seasonal_means: Dict[str, float] = field(default_factory=dict)
+
+    @property
+    def anomaly(self) -> Optional[float]:
+        """Recent mean minus baseline mean"""
+        if self.baseline_mean is None or self.recent_mean is None:
+            return None
+        return self.recent_mean - self.baseline_mean
+
+    @property
+    def change_percent(self) -> float:
+        """Change from the first to the last value, in percent of the first"""
+        if not np.isfinite(self.first) or self.first == 0:
+            return 0.0
+        return (self.last - self.first) / self.first * 100
+
+
+@dataclass(frozen=True)
+class FrameSummary:
+    """
+    Summary statistics of every numeric column of a dataframe.
+
+    Attributes:
+        rows (int): Number of rows
+        start (Any): First index value
+        end (Any): Last index value
+        baseline (Optional[Tuple[pd.Timestamp, pd.Timestamp]]): Baseline period, None for short or untimed data
+        recent (Optional[Tuple[pd.Timestamp, pd.Timestamp]]): Recent period compared to the baseline
+        columns (List[ColumnStatistics]): Statistics per numeric column
+    """
+    rows: int
+    start: Any
+    end: Any
+    baseline: Optional[Tuple[pd.Timestamp, pd.Timestamp]]
+    recent: Optional[Tuple[pd.Timestamp, pd.Timestamp]]
+    columns: List[ColumnStatistics]
+
+    def describe(self) -> List[str]:
+        """One line per column: mean, range, then trend, anomaly and seasonal means when known"""
+        lines = []
+        for column in self.columns:
+            parts = [f"mean={column.mean:.2f}", f"min={column.minimum:.2f}", f"max={column.maximum:.2f}"]
+            if column.trend_per_decade is not None:
+                parts.append(f"trend={column.trend_per_decade:+.2f}/decade")
+            if column.anomaly is not None:
+                parts.append(f"anomaly={column.anomaly:+.2f} ({self.format_period(self.recent)} vs {self.format_period(self.baseline)})")
+            if column.seasonal_means:
+                parts.append("seasonal means: " + " ".join(f"{season}={mean:.2f}" for season, mean in column.seasonal_means.items()))
+            lines.append(f"{column.name}: " + ", ".join(parts))
+        return lines
+
+    @staticmethod
+    def format_period(period: Optional[Tuple[pd.Timestamp, pd.Timestamp]]) -> str:
+        return f"{period[0]:%Y-%m-%d} to {period[1]:%Y-%m-%d}" if period else ""
+
+
+def _period(index: pd.DatetimeIndex, years: np.ndarray, rows: np.ndarray) -> Tuple[pd.Timestamp, pd.Timestamp]:
+    positions = np.flatnonzero(rows)
+    return index[positions[years[positions].argmin()]], index[positions[years[positions].argmax()]]
+
+
+def _optional(value: float) -> Optional[float]:
+    return float(value) if np.isfinite(value) else None
+
+
+def summarize_frame(
+    df: pd.DataFrame,
+    baseline_years: float = STATS_BASELINE_YEARS,
+    recent_years: float = STATS_RECENT_YEARS,
+) -> FrameSummary:
+    """
+    Compute the summary statistics of every numeric column of a dataframe at once
+
+    The values are read once as a 2D array. Counts, sums, sums of squared times and
+    cross products, per season, for the baseline and recent periods and overall,
+    come from one matrix product with a row group matrix, which gives the means,
+    seasonal means, anomalies and least squares slopes of all columns together.
+
+    Args:
+        df (pd.DataFrame): Dataframe, with a DatetimeIndex for trends, seasons and anomalies
+        baseline_years (float): Length of the baseline period at the start of the data, at most half of it
+        recent_years (float): Length of the recent period at the end of the data, at most half of it
+
+    Returns:
+        FrameSummary: The statistics
+    """
+    numeric = df.select_dtypes(include="number")
+    rows = len(df)
+    start = df.index.min() if rows else None
+    end = df.index.max() if rows else None
+    if numeric.shape[1] == 0 or rows == 0:
+        return FrameSummary(rows, start, end, None, None, [])
+
+    values = numeric.to_numpy(dtype=np.float64, na_value=np.nan)
+    valid = np.isfinite(values)
+    filled = np.where(valid, values, 0.0)
+
+    # columns of the group matrix: all rows, then time, time², baseline, recent and the seasons for timed data
+    timed = isinstance(df.index, pd.DatetimeIndex) and not df.index.hasnans
+    baseline = recent = None
+    if not timed:
+        group_matrix = np.ones((rows, 1))
+    else:
+        times = df.index.values
+        years = (times - times.min()) / YEAR
+        span = years.max()
+        periods = span >= 2
+        group_matrix = np.zeros((rows, 3 + 2 * periods + len(SEASONS)))
+        group_matrix[:, 0] = 1.0
+        group_matrix[:, 1] = years
+        group_matrix[:, 2] = years * years
+        if periods:
+            baseline_rows = years < min(baseline_years, span / 2)
+            recent_rows = years >= span - min(recent_years, span / 2)
+            group_matrix[:, 3] = baseline_rows
+            group_matrix[:, 4] = recent_rows
+            baseline = _period(df.index, years, baseline_rows)
+            recent = _period(df.index, years, recent_rows)
+        group_matrix[np.arange(rows), 3 + 2 * periods + (df.index.month.to_numpy() % 12) // 3] = 1.0
+
+    # sums and counts of valid values in one product
+    totals = group_matrix.T @ np.hstack([filled, valid])
+    sums, counts = totals[:, :values.shape[1]], totals[:, values.shape[1]:]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = sums / counts
+        if timed:
+            # slope of y over years: (n·Σxy - Σx·Σy) / (n·Σx² - (Σx)²), Σx and Σx² over valid rows only
+            n, sum_y, sum_xy = counts[0], sums[0], sums[1]
+            sum_x, sum_xx = counts[1], counts[2]
+            slopes = (n * sum_xy - sum_x * sum_y) / (n * sum_xx - sum_x ** 2) * 10
+
+    minimum = np.where(valid, values, np.inf).min(axis=0)
+    maximum = np.where(valid, values, -np.inf).max(axis=0)
+    first = values[valid.argmax(axis=0), np.arange(values.shape[1])]
+    last = values[rows - 1 - valid[::-1].argmax(axis=0), np.arange(values.shape[1])]
+
+    season_offset = 5 if baseline is not None else 3
+    columns = []
+    for position, name in enumerate(numeric.columns):
+        if counts[0, position] == 0:
+            columns.append(ColumnStatistics(str(name), 0, np.nan, np.nan, np.nan, np.nan, np.nan))
+            continue
+        columns.append(ColumnStatistics(
+            name=str(name),
+            count=int(counts[0, position]),
+            mean=float(means[0, position]),
+            minimum=float(minimum[position]),
+            maximum=float(maximum[position]),
+            first=float(first[position]),
+            last=float(last[position]),
+            trend_per_decade=_optional(slopes[position]) if timed else None,
+            baseline_mean=_optional(means[3, position]) if baseline is not None else None,
+            recent_mean=_optional(means[4, position]) if baseline is not None else None,
+            seasonal_means={
+                season: float(means[season_offset + index, position])
+                for index, season in enumerate(SEASONS)
+                if timed and counts[season_offset + index, position] > 0
+            },
+        ))
+    return FrameSummary(rows, start, end, baseline, recent, columns)
+
+
+class FrameStatistics:
+    """
+    Summary statistics of dataframes, computed once per dataframe.
+
+    Dataframes aren't hashable, so entries are keyed by identity and dropped when
+    the dataframe is garbage collected. Ingested data isn't modified in place, a
+    dataframe whose shape changed is summarized again.
+
+    The garbage collector can free a dataframe while this thread holds the lock, so
+    the weakref callback only queues the entry, which is dropped the next time the
+    lock is taken.
+    """
+
+    def __init__(self, max_entries: int = STATS_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: Dict[int, Tuple[weakref.ref, Tuple[int, int], FrameSummary]] = {}
+        self._lock = threading.Lock()
+        self._forgotten: Deque[Tuple[int, weakref.ref]] = deque()
+        self._stats = {"hits": 0, "misses": 0}
+
+    def summarize(self, df: pd.DataFrame) -> FrameSummary:
+        """
+        Statistics of a dataframe, from the cache when it was already summarized
+
+        Args:
+            df (pd.DataFrame): Dataframe
+
+        Returns:
+            FrameSummary: The statistics
+        """
+        key = id(df)
+        with self._lock:
+            self._drop_forgotten()
+            entry = self._entries.get(key)
+            if entry is not None and entry[0]() is df and entry[1] == df.shape:
+                self._stats["hits"] += 1
+                return entry[2]
+            self._stats["misses"] += 1
+
+        summary = summarize_frame(df)
+        reference = weakref.ref(df, lambda ref, key=key: self._forgotten.append((key, ref)))
+        with self._lock:
+            self._drop_forgotten()
+            if len(self._entries) >= self.max_entries:
+                self._entries.pop(next(iter(self._entries)))
+            self._entries[key] = (reference, df.shape, summary)
+        return summary
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._drop_forgotten()
+            stats = dict(self._stats, entries=len(self._entries))
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    def _drop_forgotten(self) -> None:
+        """Drop the entries of collected dataframes; the caller holds the lock"""
+        while self._forgotten:
+            key, reference = self._forgotten.popleft()
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] is reference:
+                del self._entries[key]
+
+
+frame_statistics = FrameStatistics()
@@ -0,0 +1,170 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import threading
+
+from collections import OrderedDict, defaultdict
+from contextvars import ContextVar
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, List, Optional, Tuple
+
+from .constants import USAGE_LOG_PATH, USAGE_FLUSH_INTERVAL_SECONDS, USAGE_MAX_TRACKED_CHATS
+
+usage_route: ContextVar[Optional[str]] = ContextVar("usage_route", default=None)
+usage_chat_id: ContextVar[Optional[str]] = ContextVar("usage_chat_id", default=None)
+
+
+def set_usage_scope(route: str, chat_id: Optional[str] = None) -> None:
+    """
+    Attribute the LLM calls made by the current request to a route and chat
+
+    Args:
+        route (str): API route handling the request
+        chat_id (Optional[str]): Chat the request belongs to
+    """
+    usage_route.set(route)
+    usage_chat_id.set(chat_id)
+
+
+@dataclass
+class UsageTotals:
+    calls: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    # prompt caching: tokens written to and read from the provider's cache
+    cache_creation_input_tokens: int = 0
+    cache_read_input_tokens: int = 0
+
+    def add(self, other: "UsageTotals") -> None:
+        for name, value in asdict(other).items():
+            setattr(self, name, getattr(self, name) + value)
+
+
+class UsageMeter:
+    """
+    Thread-safe, in-memory LLM token accounting.
+
+    Usage is aggregated per model, per route and per chat. Deltas are flushed
+    periodically by a background task to an append-only JSON lines file, so the
+    LLM call path never touches the disk.
+    """
+
+    def __init__(
+        self,
+        path: str = USAGE_LOG_PATH,
+        flush_interval: float = USAGE_FLUSH_INTERVAL_SECONDS,
+        max_tracked_chats: int = USAGE_MAX_TRACKED_CHATS,
+    ):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_tracked_chats = max_tracked_chats
+        self._lock = threading.Lock()
+        self._total = UsageTotals()
+        self._by_model: Dict[str, UsageTotals] = defaultdict(UsageTotals)
+        self._by_route: Dict[str, UsageTotals] = defaultdict(UsageTotals)
+        self._by_chat: OrderedDict[str, UsageTotals] = OrderedDict()
+        self._pending: Dict[Tuple[str, Optional[str], Optional[str]], UsageTotals] = defaultdict(UsageTotals)
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, model: str, **tokens: int) -> None:
+        """
+        Record one LLM call, attributed to the route and chat of the current request
+
+        Args:
+            model (str): Model that served the call
+            **tokens (int): Token counts, e.g. `input_tokens` and `output_tokens`
+        """
+        usage = UsageTotals(calls=1, **{name: value or 0 for name, value in tokens.items()})
+        route = usage_route.get()
+        chat_id = usage_chat_id.get()
+
+        with self._lock:
+            self._total.add(usage)
+            self._by_model[model].add(usage)
+            self._by_route[route or "unknown"].add(usage)
+            if chat_id:
+                self._by_chat.setdefault(chat_id, UsageTotals()).add(usage)
+                self._by_chat.move_to_end(chat_id)
+                while len(self._by_chat) > self.max_tracked_chats:
+                    self._by_chat.popitem(last=False)
+            self._pending[(model, route, chat_id)].add(usage)
+
+    def totals(self, chat_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Aggregated usage since the process started
+
+        Args:
+            chat_id (Optional[str]): Only report the given chat
+
+        Returns:
+            Dict[str, Any]: Totals overall, per model, per route and per chat
+        """
+        with self._lock:
+            if chat_id is not None:
+                return asdict(self._by_chat.get(chat_id, UsageTotals()))
+            return {
+                "total": asdict(self._total),
+                "by_model": {name: asdict(usage) for name, usage in self._by_model.items()},
+                "by_route": {name: asdict(usage) for name, usage in self._by_route.items()},
+                "by_chat": {name: asdict(usage) for name, usage in self._by_chat.items()},
+            }
+
+    def flush(self) -> int:
+        """
+        Append the usage recorded since the last flush to the usage log
+
+        Returns:
+            int: Number of records written
+        """
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(UsageTotals)
+        if not pending:
+            return 0
+
+        timestamp = time.time()
+        lines: List[str] = [
+            json.dumps({"timestamp": timestamp, "model": model, "route": route, "chat_id": chat_id, **asdict(usage)})
+            for (model, route, chat_id), usage in pending.items()
+        ]
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "a") as file:
+                file.write("\n".join(lines) + "\n")
+        except OSError:
+            # keep the records for the next flush
+            with self._lock:
+                for key, usage in pending.items():
+                    self._pending[key].add(usage)
+            raise
+        return len(lines)
+
+    def start(self) -> None:
+        """Start the background flusher on the running event loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run_flusher())
+
+    async def stop(self) -> None:
+        """Stop the background flusher and flush what is left"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.to_thread(self.flush)
+
+    async def _run_flusher(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception as e:
+                logging.error(f"Error flushing usage log: {str(e)}")
+
+
+usage_meter = UsageMeter()
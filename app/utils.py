@@ -1,12 +1,27 @@
-import json
+import base64
+import inspect
 import logging
 
 from functools import wraps
 from typing import Callable, Any, TypeVar
 
+import orjson
+import numpy as np
 import plotly.graph_objects as go
 import plotly
 
+from .constants import FIGURE_BINARY_ARRAYS, FIGURE_BINARY_MIN_LENGTH, DEFAULT_PLOT_TEMPLATE
+from .plot_templates import template_registry
+
+# Subplot kinds whose template defaults are only kept when the layout uses them
+TEMPLATE_SUBPLOT_KEYS = ("geo", "mapbox", "map", "polar", "scene", "ternary", "smith")
+
+# Trace types that always draw with a color scale
+COLORSCALE_TRACE_TYPES = {
+    "heatmap", "heatmapgl", "contour", "contourcarpet", "histogram2d", "histogram2dcontour",
+    "surface", "choropleth", "choroplethmapbox", "densitymapbox", "volume", "isosurface", "cone", "streamtube",
+}
+
 T = TypeVar('T')
 
 def handle_exceptions(
@@ -28,81 +43,177 @@ def handle_exceptions(
         Callable: Decorated function
     """
     def decorator(func: Callable[..., T]) -> Callable[..., T]:
+        def handle(e: Exception) -> Any:
+            if log_exception:
+                logging.error(
+                    f"Error in {func.__name__}: {str(e)}",
+                    exc_info=True
+                )
+            if reraise:
+                raise
+            return default_return
+
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs) -> T:
+                try:
+                    return await func(*args, **kwargs)
+                except specific_exceptions as e:
+                    return handle(e)
+            return async_wrapper
+
         @wraps(func)
         def wrapper(*args, **kwargs) -> T:
             try:
                 return func(*args, **kwargs)
             except specific_exceptions as e:
-                if log_exception:
-                    logging.error(
-                        f"Error in {func.__name__}: {str(e)}",
-                        exc_info=True
-                    )
-                if reraise:
-                    raise
-                return default_return
+                return handle(e)
         return wrapper
     return decorator
 
     
-def figure_to_json(fig: go.Figure) -> str:
+def _binary_array(value: Any) -> Any:
     """
-    Turn a Plotly figure to a JSON serializable dictionary.
+    Encode a numeric array as a Plotly typed array spec, `{"dtype", "bdata", "shape"}`
+
+    Returns the value unchanged when it isn't a plain numeric array long enough to be worth it.
+    """
+    array = value
+    if isinstance(value, (list, tuple)):
+        if len(value) < FIGURE_BINARY_MIN_LENGTH or not isinstance(value[0], (int, float)) or isinstance(value[0], bool):
+            return value
+        array = np.asarray(value)
+    if not isinstance(array, np.ndarray) or array.size < FIGURE_BINARY_MIN_LENGTH or array.ndim > 2:
+        return value
+
+    kind = array.dtype.kind
+    if kind == "f":
+        array = array.astype(np.float32 if array.dtype.itemsize <= 4 else np.float64, copy=False)
+    elif kind in "iu":
+        if array.dtype.itemsize > 4:
+            fits = array.min() >= np.iinfo(np.int32).min and array.max() <= np.iinfo(np.int32).max
+            array = array.astype(np.int32 if fits else np.float64)
+    else:
+        return value
+
+    array = np.ascontiguousarray(array, dtype=array.dtype.newbyteorder("<"))
+    spec = {
+        "dtype": f"{array.dtype.kind}{array.dtype.itemsize}",
+        "bdata": base64.b64encode(array.tobytes()).decode("ascii"),
+    }
+    if array.ndim == 2:
+        spec["shape"] = f"{array.shape[0]},{array.shape[1]}"
+    return spec
+
+
+def _encode_trace(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {key: _encode_trace(item) for key, item in value.items()}
+    encoded = _binary_array(value)
+    if encoded is value and isinstance(value, (list, tuple)):
+        return [_encode_trace(item) if isinstance(item, dict) else item for item in value]
+    return encoded
+
+
+def _uses_colorscale(trace: dict) -> bool:
+    if trace.get("type") in COLORSCALE_TRACE_TYPES or "coloraxis" in trace:
+        return True
+    marker = trace.get("marker") or {}
+    return "colorscale" in marker or "coloraxis" in marker or isinstance(marker.get("color"), (list, tuple, np.ndarray))
+
+
+def prune_template(figure: dict) -> dict:
+    """
+    Drop the parts of the layout template the figure can't use, in place
+
+    Templates carry defaults for every trace type and subplot kind, which is most
+    of the payload of a small figure. Only the trace types present, the subplot
+    kinds the layout uses and, if a trace needs them, color scales are kept.
+
+    Args:
+        figure (dict): Figure as returned by `go.Figure.to_dict()`
+
+    Returns:
+        dict: The same figure
+    """
+    template = (figure.get("layout") or {}).get("template")
+    if not isinstance(template, dict):
+        return figure
+
+    traces = figure.get("data") or []
+    trace_types = {trace.get("type", "scatter") for trace in traces}
+    if isinstance(template.get("data"), dict):
+        template["data"] = {name: value for name, value in template["data"].items() if name in trace_types}
+
+    template_layout = template.get("layout")
+    if isinstance(template_layout, dict):
+        used = set(figure["layout"])
+        for trace in traces:
+            used.update(str(trace.get(key, "")) for key in ("subplot", "geo", "scene", "polar", "ternary"))
+        for subplot in TEMPLATE_SUBPLOT_KEYS:
+            if not any(key == subplot or (key.startswith(subplot) and key[len(subplot):].isdigit()) for key in used):
+                template_layout.pop(subplot, None)
+        if not any(_uses_colorscale(trace) for trace in traces):
+            template_layout.pop("colorscale", None)
+            template_layout.pop("coloraxis", None)
+    return figure
+
+
+def _json_default(value: Any) -> Any:
+    return _PLOTLY_ENCODER.default(value)
+
+
+_PLOTLY_ENCODER = plotly.utils.PlotlyJSONEncoder()
+
+
+def figure_to_json(fig: go.Figure, binary: bool = FIGURE_BINARY_ARRAYS) -> str:
+    """
+    Turn a Plotly figure to a compact JSON string.
+
+    Numeric trace arrays are encoded as base64 typed arrays, which Plotly.js decodes
+    natively, and the rest is serialized by orjson. A published template is replaced
+    by its name in `layout.template`, to be fetched from `/templates/{name}`; any other
+    template is pruned to what the figure uses.
 
     Args:
         fig: The figure to convert
+        binary: Encode numeric trace arrays as typed arrays instead of JSON numbers
 
     Returns:
-        dict: The JSON serializable dictionary
+        str: The JSON string, empty if the figure could not be converted
 
     """
     try:
-        fig_json = json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder)
-        return fig_json
+        figure = fig.to_dict()
+        if not template_registry.detach(figure):
+            prune_template(figure)
+        if binary:
+            figure["data"] = [_encode_trace(trace) for trace in figure.get("data") or []]
+        return orjson.dumps(
+            figure, default=_json_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        ).decode()
 
     except Exception as e:
         logging.error(f"Error converting figure to JSON: {e}")
         return ""
     
-def enhance_plotly_figure(fig: go.Figure) -> go.Figure:
+def enhance_plotly_figure(fig: go.Figure, template: str = DEFAULT_PLOT_TEMPLATE) -> go.Figure:
     """
     Function to improve accessibility and styling of a plotly figure.
 
+    The layout, grid, axes and title styling live in a published template, so the
+    figure only references it and `figure_to_json` sends its name instead of a copy.
+
     Args:
         fig: The Plotly figure to enhance
+        template: Name of the published template to apply
 
     Returns:
         go.Figure: The enhanced Plotly figure
 
     """
-    # 1. Improve Layout and Background
-    fig.update_layout(
-        template="simple_white",  # Clean, professional template
-        autosize=True,
-        margin=dict(l=50, r=50, t=80, b=50),
-        paper_bgcolor='white',
-        plot_bgcolor='white',
-        font=dict(size=12),  # Readable base font size
-    )
-
-    # 2. Enhance Grid and Axes
-    fig.update_xaxes(
-        showgrid=True,
-        gridwidth=1,
-        gridcolor='#E5E5E5',
-        zeroline=True,
-        zerolinewidth=1,
-        zerolinecolor='#808080'
-    )
-    
-    fig.update_yaxes(
-        showgrid=True,
-        gridwidth=1,
-        gridcolor='#E5E5E5',
-        zeroline=True,
-        zerolinewidth=1,
-        zerolinecolor='#808080'
-    )
+    # 1. Layout, background, grid, axes and title through the shared template
+    fig.layout.template = template_registry.get(template).template
 
     """
     # 3. Improve Interactivity
@@ -124,29 +235,4 @@ def enhance_plotly_figure(fig: go.Figure) -> go.Figure:
     )
     """
 
-    # 5. Enhanced Accessibility - Generic improvements
-    fig.update_layout(
-        title=dict(
-            font=dict(size=16),  # Larger title font
-            x=0.5,  # Centered title
-            xanchor='center'
-        )
-    )
-
     return fig
-
-
-def dict_to_json_file(conversation_id: int, data: dict) -> None:
-    """
-    Convert a dictionary to a JSON string.
-
-    Args:
-        data: The dictionary to convert
-
-    Returns:
-        str: The JSON string
-
-    """
-    with open(f"conversation_{conversation_id}.json", "a") as f:
-        json.dump(data, f)
-        logging.info(f"Data saved to conversation_{conversation_id}.json")
\ No newline at end of file
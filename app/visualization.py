@@ -1,19 +1,33 @@
-import requests
+import asyncio
 import logging
 
 import plotly.graph_objects as go
-import plotly.express as px
-from plotly.subplots import make_subplots
-import numpy as np
-from datetime import datetime
-
-import pandas as pd
-
-from typing import List, Dict
-
-from .constants import USER, DEVELOPER
+from datetime import datetime, timedelta
+
+from typing import List, Dict, Optional, Tuple
+
+from .constants import (
+    USER,
+    DEVELOPER,
+    EVENT_PLAN,
+    EVENT_DATA_REQUIREMENTS,
+    EVENT_ENDPOINTS,
+    EVENT_DATA,
+    SPECULATIVE_MAX_FETCHES,
+    FIGURE_MAX_POINTS,
+    DEFAULT_PLOT_TEMPLATE,
+)
 from .utils import handle_exceptions
-from .api import OpenMeteoAPI
+from .prompt_assembly import CompiledPrompt, prompt_assembler
+from .fetch import openmeteo_fetcher
+from .ingest import normalize_openmeteo_payload
+from .previews import data_previewer
+from .aggregation import downsample_figure
+from .cache import CachedPlan, plan_cache, visualization_code_cache
+from .sandbox import sandbox_executor
+from .geocoding import Place
+from .queries import ResolvedQuery, query_builder
+from .streaming import EventCallback
 from .prompts import (
     DETERMINE_VISUALIZATION_TYPE_PROMPT,
     DETERMINE_NEEDED_DATA_PROMPT,
@@ -27,17 +41,36 @@ from .models import (
     DataProcessingType,
     APIEndpoint,
     APIEndpointResponse,
+    DataQueryResponse,
     NormalizedOpenMeteoData,
     ProcessedData,
-    LLMMessageType
 )
 from .ai import anthropic_client
 
-
+# Query most likely to be planned for each scenario topic: endpoint, resolution, variables, years of history
+SPECULATIVE_QUERIES = {
+    "Temperature": (
+        "https://archive-api.open-meteo.com/v1/archive", "daily", ("temperature_2m_max", "temperature_2m_min"), 10
+    ),
+    "Air Pollution": (
+        "https://air-quality-api.open-meteo.com/v1/air-quality", "hourly", ("pm10", "pm2_5"), 1
+    ),
+}
+
+# Templates parsed once, with the values known at startup already rendered
+VISUALIZATION_TYPE_TEMPLATE = CompiledPrompt(DETERMINE_VISUALIZATION_TYPE_PROMPT)
+SCENARIO_TEMPLATE = CompiledPrompt(SCENARIO_EXPLANATION)
+NEEDED_DATA_TEMPLATE = CompiledPrompt(DETERMINE_NEEDED_DATA_PROMPT)
+RETRIEVE_DATA_TEMPLATE = CompiledPrompt(RETRIEVE_DATA_PROMPT)
+PROCESS_DATA_TEMPLATE = CompiledPrompt(PROCESS_DATA_PROMPT)
+BUILD_VISUALIZATION_TEMPLATE = CompiledPrompt(BUILD_VISUALIZATION_PROMPT).partial(
+    max_points=FIGURE_MAX_POINTS,
+    template=DEFAULT_PLOT_TEMPLATE,
+)
 
 
 @handle_exceptions()
-def determine_visualization_type(
+async def determine_visualization_type(
     messages: list[Dict[str,str]],
     topic_of_interest: str,
     persona: str,
@@ -58,7 +91,7 @@ def determine_visualization_type(
     Returns:
         VisualizationType: Detailed visualization specification
     """
-    system_prompt = DETERMINE_VISUALIZATION_TYPE_PROMPT.format(
+    system_prompt = VISUALIZATION_TYPE_TEMPLATE.render(
         topic_of_interest=topic_of_interest,
         persona=persona,
         location=location,
@@ -66,11 +99,11 @@ def determine_visualization_type(
     )
 
     messages.extend([
-        {"role": DEVELOPER, "content": SCENARIO_EXPLANATION.format(scenario=scenario, options=options)},
+        {"role": DEVELOPER, "content": SCENARIO_TEMPLATE.render(scenario=scenario, options=options)},
         {"role": USER, "content": system_prompt},
     ])
 
-    response = anthropic_client.structured_completion(
+    response = await anthropic_client.astructured_completion(
         messages=messages,
         response_format=VisualizationType,
         max_tokens=1000,
@@ -80,8 +113,8 @@ def determine_visualization_type(
 
 
 @handle_exceptions()
-def determine_needed_data(
-    prompt: str, visualization_type: VisualizationType, location: str
+async def determine_needed_data(
+    prompt: str, visualization_type: VisualizationType, location: str, topic_of_interest: Optional[str] = None
 ) -> DataProcessingType:
     """
     Determine data requirements for the visualization
@@ -89,119 +122,105 @@ def determine_needed_data(
     Args:
         prompt (str): User's visualization request
         visualization (VisualizationType): Visualization details
+        topic_of_interest (Optional[str]): Scenario topic, selects the endpoint families shown to the LLM
 
     Returns:
         DataProcessingType: Data processing and API endpoint specifications
     """
 
-    system_prompt = DETERMINE_NEEDED_DATA_PROMPT.format(
+    system_prompt = NEEDED_DATA_TEMPLATE.render(
         visualization_type=visualization_type,
         location=location,
-        API_ENDPOINT_INFORMATION=OpenMeteoAPI.__str__(),
     )
 
-    response = anthropic_client.structured_completion(
+    response = await anthropic_client.astructured_completion(
         messages=[
             {"role": USER, "content": system_prompt},
             {"role": USER, "content": prompt},
         ],
         response_format=DataProcessingType,
+        context=[prompt_assembler.catalog(topic_of_interest).text],
         max_tokens=3000,
         temperature=.5
     )
     return response
 
 
-def build_data_retrieval(
-    visualization_type: VisualizationType, needed_data: str, location: str
-) -> list[APIEndpoint]:
+async def build_data_retrieval(
+    visualization_type: VisualizationType,
+    needed_data: str,
+    location: str,
+    place: Optional[Place] = None,
+    topic_of_interest: Optional[str] = None,
+) -> APIEndpointResponse:
     """
     Build data retrieval queries for the specified visualization and data requirements
 
+    The LLM only picks endpoints, variables and date ranges; the URLs are built and
+    validated locally by the query builder.
+
     Args:
         visualization (VisualizationType): Visualization details
         needed_data (str): Data requirements
+        place (Optional[Place]): Location resolved by the gazetteer
+        topic_of_interest (Optional[str]): Scenario topic, selects the endpoint families shown to the LLM
 
     Returns:
-        list[APIEndpoint]: List of API endpoints to query
+        APIEndpointResponse: API endpoints to query
     """
-    system_prompt = RETRIEVE_DATA_PROMPT.format(location=location,visualization_type=visualization_type, needed_data=needed_data, API_ENDPOINT_INFORMATION=OpenMeteoAPI.__str__())
+    system_prompt = RETRIEVE_DATA_TEMPLATE.render(
+        location=str(place) if place is not None else location,
+        visualization_type=visualization_type,
+        needed_data=needed_data,
+    )
 
-    response = anthropic_client.structured_completion(
+    response = await anthropic_client.astructured_completion(
         messages=[
             {"role": USER, "content": system_prompt},
         ],
-        response_format=APIEndpointResponse,
+        response_format=DataQueryResponse,
+        context=[prompt_assembler.catalog(topic_of_interest).text],
         max_tokens=800,
         temperature=.4
     )
+    if response is None:
+        return None
 
-    return response
+    queries = query_builder.build(response.queries, place)
+    return APIEndpointResponse(endpoints=[APIEndpoint(url=query.url) for query in queries])
 
 
-def retrieve_data(api_endpoints: APIEndpointResponse) -> List[NormalizedOpenMeteoData]:
+async def retrieve_data(api_endpoints: APIEndpointResponse) -> List[NormalizedOpenMeteoData]:
     """
-    Retrieve data from multiple API OpenMeteo endpoints
+    Retrieve data from multiple API OpenMeteo endpoints concurrently
     
     Args:
         api_endpoints (APIEndpointResponse): Object containing list of API endpoints to query
         
     Returns:
-        List[NormalizedOpenMeteoData]: List of normalized data objects
+        List[NormalizedOpenMeteoData]: List of normalized data objects, in endpoint order
     """
-    consolidated_data: List[NormalizedOpenMeteoData] = []
-    
-    for endpoint in api_endpoints.endpoints:
-        try:
-            response = requests.get(endpoint.url)
-            
-            if not response.status_code == 200:
-                raise ValueError(f"Invalid response status code {response.status_code} from {endpoint.url}")
-                
-            json_data = response.json()
-            if json_data is None:
-                raise ValueError(f"Null JSON response from {endpoint.url}")
-                
-            metadata_df = pd.DataFrame()
-            hourly_df = pd.DataFrame()
-            daily_df = pd.DataFrame()
-            
-            if 'hourly' in json_data:
-                hourly_df = pd.DataFrame(json_data.pop('hourly'))
-                
-            # Handle daily data if present
-            if 'daily' in json_data:
-                daily_df = pd.DataFrame(json_data.pop('daily'))
-            
-            # Create metadata DataFrame from remaining scalar values
-            # Convert to a single-row DataFrame with an explicit index
+    urls = [endpoint.url for endpoint in api_endpoints.endpoints]
+    # long ranges are fetched as yearly chunks, all chunks of all endpoints at once
+    chunk_urls = [query_builder.fetch_urls(url) for url in urls]
+    payloads = iter(await openmeteo_fetcher.fetch_all([chunk_url for chunks in chunk_urls for chunk_url in chunks]))
 
-            metadata_df = pd.DataFrame([json_data])
-            
-            # Create normalized data object with all fields initialized
-            normalized_data = NormalizedOpenMeteoData(
-                metadata=metadata_df,
-                hourly_data=hourly_df,
-                daily_data=daily_df
-            )
-            
-            consolidated_data.append(normalized_data)
-            
-        except requests.RequestException as e:
-            print(f"API Request Error for {endpoint.url}: {str(e)}")
-            continue
-        except ValueError as e:
-            print(f"Data Validation Error for {endpoint.url}: {str(e)}")
+    consolidated_data: List[NormalizedOpenMeteoData] = []
+    for url, chunks in zip(urls, chunk_urls):
+        json_data = query_builder.combine(url, [next(payloads) for _ in chunks])
+        if json_data is None:
             continue
+        try:
+            consolidated_data.append(normalize_openmeteo_payload(json_data))
         except Exception as e:
-            print(f"Unexpected Error for {endpoint.url}: {str(e)}")
+            logging.warning(f"Unexpected Error for {url}: {str(e)}")
             continue
             
     return consolidated_data
 
 
 @handle_exceptions()
-def process_data(
+async def process_data(
     visualization_type: VisualizationType, processing_steps: str, data: list[NormalizedOpenMeteoData]
 ) -> ProcessedData:
     """
@@ -215,16 +234,16 @@ def process_data(
         ProcessedData: Processed data ready for visualization
     """
 
-    data_description = [entry.__str__() for entry in data]
+    data_description = data_previewer.preview(data)
 
-    system_prompt = PROCESS_DATA_PROMPT.format(
+    system_prompt = PROCESS_DATA_TEMPLATE.render(
         visualization_type=visualization_type, 
         processing_steps=processing_steps, 
         data_description=data_description,
     )
 
     # Use LLM to dynamically generate data processing code
-    response = anthropic_client.completion(
+    response = await anthropic_client.acompletion(
         messages=[
             {"role": USER, "content": system_prompt},
         ],
@@ -233,8 +252,8 @@ def process_data(
     )
 
     try:
-        exec(response)
-        processed_data: ProcessedData = locals().get("process_raw_data")(data)
+        code = compile(response, "<process_raw_data>", "exec")
+        processed_data: ProcessedData = await sandbox_executor.run(code, "process_raw_data", data)
         return processed_data
 
     except Exception as e:
@@ -244,15 +263,26 @@ def process_data(
 
 
 @handle_exceptions()
-def process_and_viz(data: List[NormalizedOpenMeteoData], visualization_type, complexity_level, processing_steps, lang:str = 'en') -> go.Figure:
-    prompt = BUILD_VISUALIZATION_PROMPT.format(
+async def process_and_viz(data: List[NormalizedOpenMeteoData], visualization_type, complexity_level, processing_steps, lang:str = 'en') -> go.Figure:
+    fingerprint = visualization_code_cache.fingerprint(visualization_type, complexity_level, processing_steps, data, lang)
+    cached_code = visualization_code_cache.get(fingerprint)
+    if cached_code is not None:
+        try:
+            fig = await sandbox_executor.run(cached_code.code, "visualize", data)
+            logging.info("Rendered visualization from cached code")
+            return await _bound_figure(fig)
+        except Exception as e:
+            logging.warning(f"Cached visualize() failed, regenerating: {e}")
+            visualization_code_cache.invalidate(fingerprint)
+
+    prompt = BUILD_VISUALIZATION_TEMPLATE.render(
         visualization_type=visualization_type,
         complexity_level=complexity_level,
         processing_steps=processing_steps,
-        data_preview=data.__str__()
+        data_preview=data_previewer.preview(data),
     )
  
-    response = anthropic_client.completion(
+    response = await anthropic_client.acompletion(
         messages=[
             {"role": USER, "content": prompt},
         ],
@@ -260,18 +290,62 @@ def process_and_viz(data: List[NormalizedOpenMeteoData], visualization_type, com
         max_tokens=8192
     )
 
-    print(response)
-    exec(response)
-    fig = locals().get("visualize")(data)
+    logging.debug(f"Generated visualization code:\n{response}")
+    code = compile(response, "<visualize>", "exec")
+    fig = await sandbox_executor.run(code, "visualize", data)
 
-    print(fig)
+    if isinstance(fig, go.Figure):
+        visualization_code_cache.set(fingerprint, response, code)
 
+    return await _bound_figure(fig)
 
 
-    return fig
+async def _bound_figure(fig):
+    """Downsample the traces of a figure to the point budget, off the event loop"""
+    if not isinstance(fig, go.Figure):
+        return fig
+    return await asyncio.to_thread(downsample_figure, fig)
+
+def likely_endpoints(
+    topic_of_interest: str,
+    location: str,
+    complexity_level: str,
+    options: List[str],
+    coordinates: Optional[Tuple[float, float]] = None,
+) -> List[str]:
+    """
+    Guess which endpoints the planning stages will ask for, to prefetch them while the LLM is still planning
+
+    Args:
+        topic_of_interest (str): Specific climate topic
+        location (str): Location of interest
+        complexity_level (str): Complexity level prompt
+        options (List[str]): Scenario options
+        coordinates (Optional[Tuple[float, float]]): Latitude and longitude of the location, if known
+
+    Returns:
+        List[str]: Endpoint URLs, most likely first
+    """
+    urls = plan_cache.recent_endpoints(topic_of_interest, location, complexity_level, options, SPECULATIVE_MAX_FETCHES)
+
+    query = SPECULATIVE_QUERIES.get(topic_of_interest)
+    if coordinates is not None and query is not None and len(urls) < SPECULATIVE_MAX_FETCHES:
+        base_url, frequency, variables, years = query
+        # the archive lags a few days behind
+        end_date = datetime.now().date() - timedelta(days=5)
+        start_date = end_date.replace(year=end_date.year - years, month=1, day=1)
+        urls.append(ResolvedQuery(base_url, frequency, variables, start_date, end_date, *coordinates).url)
+
+    return urls
+
+
+async def _emit(on_event: Optional[EventCallback], event: str, data) -> None:
+    if on_event is not None:
+        await on_event(event, data)
+
 
 @handle_exceptions(default_return=(None, None))
-def visualization_generation_pipeline(
+async def visualization_generation_pipeline(
     messages: list[Dict[str,str]],
     persona: str,
     location: str,
@@ -280,36 +354,99 @@ def visualization_generation_pipeline(
     scenario: str,
     options: List[str],
     lang: str = 'en',
+    on_event: Optional[EventCallback] = None,
+    coordinates: Optional[Tuple[float, float]] = None,
+    place: Optional[Place] = None,
 ) -> tuple[go.Figure, List[NormalizedOpenMeteoData]]:
     """
     Comprehensive visualization generation pipeline
 
+    The stages run in order: visualization type, data requirements, endpoints, data
+    and figure. While the LLM plans, the first chunk of the most likely endpoint is
+    prefetched, and the data stage joins that download; a wrong guess is cancelled
+    and costs at most one upstream request.
+
     Args:
         prompt (str): User's visualization request
         persona (str): User persona
         complexity_level (ComplexityLevel): Visualization complexity
+        on_event (Optional[EventCallback]): Called with progress events as each stage completes
+        coordinates (Optional[Tuple[float, float]]): Latitude and longitude of the location, if known
+        place (Optional[Place]): Location resolved by the gazetteer
 
     Returns:
         tuple: Generated figure and processed data
     """
-    visualization_details: VisualizationType = determine_visualization_type(
-        messages, topic_of_interest, persona, location, complexity_level, scenario, options
-    )
-    logging.info(f"Visualization details: {visualization_details}")
-
-    prompt = messages[-1]['content']
+    user_message = messages[-1]['content'] if messages else ""
+    if place is not None:
+        coordinates = place.coordinates
+
+    cached_plan = plan_cache.get(topic_of_interest, location, complexity_level, options, user_message)
+    speculative_urls = [] if cached_plan is not None else [
+        query_builder.fetch_urls(url)[0]
+        for url in likely_endpoints(topic_of_interest, location, complexity_level, options, coordinates)
+    ][:SPECULATIVE_MAX_FETCHES]
+    for url in speculative_urls:
+        openmeteo_fetcher.prefetch(url)
 
-    data_requirements: DataProcessingType = determine_needed_data(prompt, visualization_details, location)
-    logging.info(f"Data requirements: {data_requirements}")
+    try:
+        if cached_plan is not None:
+            logging.info("Reusing cached visualization plan")
+            visualization_details = cached_plan.visualization_type
+            data_requirements = cached_plan.data_requirements
+            api_endpoints = cached_plan.api_endpoints
+            await _emit(on_event, EVENT_PLAN, visualization_details.model_dump())
+            await _emit(on_event, EVENT_DATA_REQUIREMENTS, data_requirements.model_dump())
+            await _emit(on_event, EVENT_ENDPOINTS, [endpoint.url for endpoint in api_endpoints.endpoints])
+        else:
+            visualization_details = await determine_visualization_type(
+                messages, topic_of_interest, persona, location, complexity_level, scenario, options
+            )
+            logging.info(f"Visualization details: {visualization_details}")
+            await _emit(on_event, EVENT_PLAN, visualization_details.model_dump())
 
-    api_endpoints = build_data_retrieval(
-        visualization_details, data_requirements.needed_data, location
-    )
+            data_requirements = await determine_needed_data(user_message, visualization_details, location, topic_of_interest)
+            logging.info(f"Data requirements: {data_requirements}")
+            await _emit(on_event, EVENT_DATA_REQUIREMENTS, data_requirements.model_dump())
 
-    logging.info(f"Raw data: {api_endpoints}")
-    normalized_data = retrieve_data(api_endpoints)
+            api_endpoints = await build_data_retrieval(
+                visualization_details, data_requirements.needed_data, location, place, topic_of_interest
+            )
+            await _emit(on_event, EVENT_ENDPOINTS, [endpoint.url for endpoint in api_endpoints.endpoints])
+
+            if visualization_details and data_requirements and api_endpoints and api_endpoints.endpoints:
+                plan_cache.set(
+                    topic_of_interest, location, complexity_level, options, user_message,
+                    CachedPlan(visualization_details, data_requirements, api_endpoints)
+                )
+
+        logging.info(f"Raw data: {api_endpoints}")
+        needed = {
+            openmeteo_fetcher.key(url)
+            for endpoint in api_endpoints.endpoints
+            for url in query_builder.fetch_urls(endpoint.url)
+        }
+        unneeded = [url for url in speculative_urls if openmeteo_fetcher.key(url) not in needed]
+        speculative_urls = [url for url in speculative_urls if openmeteo_fetcher.key(url) in needed]
+        _release_prefetches(unneeded)
+
+        normalized_data = await retrieve_data(api_endpoints)
+        await _emit(on_event, EVENT_DATA, [
+            {
+                "hourly_rows": len(entry.hourly_data) if entry.hourly_data is not None else 0,
+                "daily_rows": len(entry.daily_data) if entry.daily_data is not None else 0,
+            }
+            for entry in normalized_data
+        ])
+    finally:
+        # downloads the data stage joined are done by now, only abandoned guesses remain
+        _release_prefetches(speculative_urls)
+
+    fig = await process_and_viz(normalized_data, visualization_details, complexity_level, data_requirements.data_processing_steps, lang)
+    return fig, normalized_data
 
-    # Execute visualization generation
-    fig = process_and_viz(normalized_data, visualization_details, complexity_level, data_requirements.data_processing_steps, lang)
 
-    return fig, normalized_data
+def _release_prefetches(urls: List[str]) -> None:
+    cancelled = sum(openmeteo_fetcher.release_prefetch(url) for url in urls)
+    if cancelled:
+        logging.info(f"Cancelled {cancelled} unused speculative download(s)")
@@ -0,0 +1,51 @@
+"""
+Evaluate the local complexity classifier against its labelled examples.
+
+Reports cross-validated accuracy, and for each confidence threshold the share of
+inputs answered locally and their accuracy, the others going to the LLM.
+
+Usage:
+    python benchmarks/complexity.py [--folds 5] [--repeats 5]
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+THRESHOLDS = (0.0, 0.5, 0.6, 0.7, 0.8)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--repeats", type=int, default=5, help="fold assignments averaged over")
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    from app.complexity import complexity_classifier
+    from app.constants import COMPLEXITY_CONFIDENCE_THRESHOLD
+
+    print(f"{'threshold':>10} {'accuracy':>9} {'local':>7} {'local accuracy':>15}")
+    for threshold in THRESHOLDS:
+        results = [complexity_classifier.evaluate(args.folds, threshold, seed) for seed in range(args.repeats)]
+        mean = {key: np.mean([result[key] for result in results]) for key in results[0]}
+        marker = " <" if threshold == COMPLEXITY_CONFIDENCE_THRESHOLD else ""
+        print(f"{threshold:>10.2f} {mean['accuracy']:>9.1%} {mean['coverage']:>7.1%} {mean['confident_accuracy']:>15.1%}{marker}")
+
+    start = time.perf_counter()
+    complexity_classifier.load()
+    print(f"\ntraining: {(time.perf_counter() - start) * 1000:.1f} ms")
+    timings = []
+    for _ in range(1000):
+        start = time.perf_counter()
+        complexity_classifier.predict("Retired nurse who enjoys gardening, not familiar with science", "70")
+        timings.append(time.perf_counter() - start)
+    print(f"prediction: {np.median(timings) * 1e6:.1f} µs (median)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,419 @@
+"""
+Offline end-to-end benchmark of the API.
+
+Starts the local stand-ins of benchmarks/stubs.py and the app under uvicorn, pointed
+at them, then replays the conversations of mock.json as every persona of
+personas.json, N sessions at a time. A session calls /chat/persona and /scenario,
+then /chat/visualization/stream after each message of the conversation, and
+/chat/description of the last figure.
+
+Reports p50/p95 latency per route and per stage (the visualization pipeline events
+and the first explanation token, from the start of the request), throughput, and
+the peak RSS of the app with its sandbox workers. Each concurrency level runs
+against a freshly started app with empty caches. Results can be saved, and compared
+to a saved baseline: a p95 latency or peak RSS over it by more than the tolerance
+exits with status 1.
+
+The app needs its tokenizer BPE file cached (TIKTOKEN_CACHE_DIR), as in the Docker
+image, to run without network access.
+
+Usage:
+    python benchmarks/e2e.py [--concurrency 1,4] [--repeat 1] [--plain]
+                             [--llm-latency 0.8] [--token-latency 0.01] [--openmeteo-latency 0.15] [--recordings DIR]
+                             [--output results.json] [--baseline results.json] [--tolerance 0.2]
+"""
+import os
+import re
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+import httpx
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STUBS = os.path.join(ROOT, "benchmarks", "stubs.py")
+
+LOCATION = "Nagoya"
+AIR_QUALITY_KEYWORDS = ("pollution", "air quality", "smog")
+# 1x1 transparent PNG, the figure image the front end would send
+IMAGE = "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=="
+# latencies below this many seconds don't count as regressions, whatever the tolerance
+NOISE_FLOOR_SECONDS = 0.05
+
+
+class Recorder:
+    """Latencies per route and per stage, and request counts"""
+
+    def __init__(self):
+        self.routes: Dict[str, List[float]] = defaultdict(list)
+        self.stages: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    def route(self, route: str, seconds: float, ok: bool) -> None:
+        self.routes[route].append(seconds)
+        if not ok:
+            self.errors[route] += 1
+
+    def stage(self, stage: str, seconds: float) -> None:
+        self.stages[stage].append(seconds)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "routes": {route: dict(_percentiles(values), errors=self.errors[route]) for route, values in self.routes.items()},
+            "stages": {stage: _percentiles(values) for stage, values in self.stages.items()},
+        }
+
+
+class RSSSampler:
+    """Peak resident memory of a process and its descendants, sampled from /proc"""
+
+    def __init__(self, pid: int, interval: float = 0.1):
+        self.pid = pid
+        self.interval = interval
+        self.peak_bytes = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._sample())
+
+    async def stop(self) -> int:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self.peak_bytes = max(self.peak_bytes, self.current())
+        return self.peak_bytes
+
+    def current(self) -> int:
+        return sum(_rss(pid) for pid in _process_tree(self.pid))
+
+    async def _sample(self) -> None:
+        while True:
+            self.peak_bytes = max(self.peak_bytes, self.current())
+            await asyncio.sleep(self.interval)
+
+
+def _process_tree(root: int) -> List[int]:
+    parents = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat", "r") as file:
+                    parents[int(entry)] = int(file.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+    tree, frontier = [root], [root]
+    while frontier:
+        frontier = [pid for pid, parent in parents.items() if parent in frontier]
+        tree.extend(frontier)
+    return tree
+
+
+def _rss(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status", "r") as file:
+            for line in file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def _percentiles(values: List[float]) -> Dict[str, float]:
+    return {
+        "count": len(values),
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+        "max": float(np.max(values)),
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def _wait_until_up(url: str, process: subprocess.Popen, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"{url} exited with status {process.returncode}")
+            try:
+                if (await client.get(url)).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"{url} not up after {timeout:.0f}s")
+
+
+def load_sessions(repeat: int) -> List[Dict[str, Any]]:
+    """Every conversation of mock.json for every persona of personas.json, `repeat` times"""
+    with open(os.path.join(ROOT, "mock.json"), "r", encoding="utf-8") as file:
+        conversations = json.load(file)
+    with open(os.path.join(ROOT, "personas.json"), "r", encoding="utf-8") as file:
+        personas = json.load(file)
+    sessions = []
+    for iteration in range(repeat):
+        for conversation in conversations:
+            text = " ".join(message["message"] for message in conversation["messages"]).lower()
+            for persona in personas:
+                age = re.search(r"(\d+)-year-old", persona["tuning"])
+                sessions.append({
+                    "chat_id": f"bench-{iteration}-{conversation['conversation_id']}-{persona['name']}",
+                    "description": persona["tuning"],
+                    "age_group": age.group(1) if age else "",
+                    "topic": "Air Pollution" if any(keyword in text for keyword in AIR_QUALITY_KEYWORDS) else "Temperature",
+                    "messages": [
+                        {"role": "user", "content": f"{message['persona']}: {message['message']}"}
+                        for message in conversation["messages"]
+                    ],
+                })
+    return sessions
+
+
+async def _timed_post(client: httpx.AsyncClient, recorder: Recorder, route: str, body: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    started = time.perf_counter()
+    try:
+        response = await client.post(route, json=body)
+        ok = response.status_code == 200
+    except httpx.HTTPError:
+        response, ok = None, False
+    recorder.route(route, time.perf_counter() - started, ok)
+    return response.json() if ok else None
+
+
+async def _timed_stream(client: httpx.AsyncClient, recorder: Recorder, route: str, body: Dict[str, Any], stage_prefix: str) -> bool:
+    """Read a server-sent event stream, recording when each event type first arrives"""
+    started = time.perf_counter()
+    seen, ok = set(), True
+    try:
+        async with client.stream("POST", route, json=body) as response:
+            ok = response.status_code == 200
+            async for line in response.aiter_lines():
+                if not line.startswith("event: "):
+                    continue
+                event = line[len("event: "):]
+                ok = ok and event != "error"
+                if event not in seen:
+                    seen.add(event)
+                    recorder.stage(f"{stage_prefix}:{event}", time.perf_counter() - started)
+    except httpx.HTTPError:
+        ok = False
+    recorder.route(route, time.perf_counter() - started, ok)
+    return ok
+
+
+async def run_session(client: httpx.AsyncClient, recorder: Recorder, session: Dict[str, Any], plain: bool) -> None:
+    persona = await _timed_post(client, recorder, "/chat/persona", {
+        "description": session["description"],
+        "age_group": session["age_group"],
+    })
+    scenario = await _timed_post(client, recorder, "/scenario", {
+        "chat_id": session["chat_id"],
+        "age_group": session["age_group"],
+        "location": LOCATION,
+        "user_description": session["description"],
+        "topic": session["topic"],
+    })
+    if persona is None or scenario is None:
+        return
+
+    for count in range(1, len(session["messages"]) + 1):
+        body = {
+            "chat_id": session["chat_id"],
+            "complexity_level": persona["complexity_level"],
+            "user_description": session["description"],
+            "location": LOCATION,
+            "messages": session["messages"][:count],
+            "scenario": scenario["scenario"],
+            "topic": session["topic"],
+            "options": scenario["options"],
+        }
+        if plain:
+            await _timed_post(client, recorder, "/chat/visualization", body)
+        else:
+            await _timed_stream(client, recorder, "/chat/visualization/stream", body, "visualization")
+
+    await _timed_stream(client, recorder, "/chat/description", {
+        "chat_id": session["chat_id"],
+        "image": IMAGE,
+        "complexity_level": persona["complexity_level"],
+        "scenario": scenario["scenario"],
+        "options": scenario["options"],
+    }, "description")
+
+
+async def run_level(concurrency: int, sessions: List[Dict[str, Any]], stub_url: str, plain: bool) -> Dict[str, Any]:
+    """Start a fresh app, replay the sessions `concurrency` at a time and summarize"""
+    workdir = tempfile.mkdtemp(prefix="e2e-")
+    port = _free_port()
+    env = dict(
+        os.environ,
+        ANTHROPIC_API_KEY="stub",
+        OPENAI_API_KEY="stub",
+        ANTHROPIC_BASE_URL=stub_url,
+        OPENAI_BASE_URL=f"{stub_url}/v1",
+        OPENMETEO_BASE_URL=f"{stub_url}/openmeteo",
+        OPENMETEO_CACHE_DIR=os.path.join(workdir, "openmeteo"),
+        USAGE_LOG_PATH=os.path.join(workdir, "usage.jsonl"),
+        SESSION_STORE_PATH=os.path.join(workdir, "sessions.sqlite3"),
+    )
+    log_path = os.path.join(workdir, "app.log")
+    with open(log_path, "w") as log:
+        app = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+            cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT,
+        )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        await _wait_until_up(f"{base_url}/stats/startup", app)
+        async with httpx.AsyncClient(base_url=base_url, timeout=300) as client:
+            # measure a warm app, as a deployment serves most of its requests
+            while (await client.get("/stats/startup")).json()["warmed_up"] is None:
+                await asyncio.sleep(0.1)
+
+            await client.get(f"{stub_url}/stats", params={"reset": 1})
+            recorder = Recorder()
+            sampler = RSSSampler(app.pid)
+            sampler.start()
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def bounded(session: Dict[str, Any]) -> None:
+                async with semaphore:
+                    await run_session(client, recorder, session, plain)
+
+            started = time.perf_counter()
+            await asyncio.gather(*(bounded(session) for session in sessions))
+            elapsed = time.perf_counter() - started
+            peak_rss = await sampler.stop()
+
+            startup = (await client.get("/stats/startup")).json()
+            caches = (await client.get("/stats/cache")).json()
+            upstream = (await client.get(f"{stub_url}/stats")).json()
+    except Exception:
+        print(f"app log: {log_path}", file=sys.stderr)
+        raise
+    finally:
+        app.terminate()
+        try:
+            app.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            app.kill()
+
+    requests = sum(len(values) for values in recorder.routes.values())
+    return dict(
+        recorder.summary(),
+        throughput={
+            "seconds": elapsed,
+            "sessions_per_second": len(sessions) / elapsed,
+            "requests_per_second": requests / elapsed,
+        },
+        peak_rss_mb=peak_rss / 2**20,
+        startup=startup,
+        cache_hit_rates={name: stats.get("hit_rate") for name, stats in caches.items()},
+        upstream_calls=upstream,
+    )
+
+
+def report(concurrency: int, result: Dict[str, Any]) -> None:
+    print(f"\n== {concurrency} concurrent session(s) ==")
+    print(f"{'route / stage':<40} {'n':>5} {'err':>4} {'p50 ms':>9} {'p95 ms':>9}")
+    for route, stats in result["routes"].items():
+        print(f"{route:<40} {stats['count']:>5} {stats['errors']:>4} {stats['p50'] * 1000:>9.0f} {stats['p95'] * 1000:>9.0f}")
+    for stage, stats in sorted(result["stages"].items(), key=lambda item: item[1]["p50"]):
+        print(f"  {stage:<38} {stats['count']:>5} {'':>4} {stats['p50'] * 1000:>9.0f} {stats['p95'] * 1000:>9.0f}")
+    throughput = result["throughput"]
+    print(
+        f"throughput: {throughput['sessions_per_second']:.2f} sessions/s, {throughput['requests_per_second']:.2f} requests/s"
+        f" over {throughput['seconds']:.1f}s"
+    )
+    print(f"peak RSS (app and workers): {result['peak_rss_mb']:.0f} MB")
+    for service, calls in result["upstream_calls"].items():
+        print(f"{service} calls: " + ", ".join(f"{kind}={count}" for kind, count in sorted(calls.items())))
+    print("cache hit rates: " + ", ".join(f"{name}={rate:.0%}" for name, rate in result["cache_hit_rates"].items() if rate is not None))
+
+
+def regressions(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """p95 latencies and peak RSS over the baseline by more than the tolerance, at the concurrency levels of both"""
+    found = []
+    for level, result in results["levels"].items():
+        reference = baseline.get("levels", {}).get(level)
+        if reference is None:
+            continue
+        for kind in ("routes", "stages"):
+            for name, stats in result[kind].items():
+                before = reference[kind].get(name)
+                if before is None:
+                    continue
+                if stats["p95"] > before["p95"] * (1 + tolerance) and stats["p95"] - before["p95"] > NOISE_FLOOR_SECONDS:
+                    found.append(f"[{level}] {name} p95 {before['p95'] * 1000:.0f} -> {stats['p95'] * 1000:.0f} ms")
+        if result["peak_rss_mb"] > reference["peak_rss_mb"] * (1 + tolerance):
+            found.append(f"[{level}] peak RSS {reference['peak_rss_mb']:.0f} -> {result['peak_rss_mb']:.0f} MB")
+    return found
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    stub_port = _free_port()
+    stub_url = f"http://127.0.0.1:{stub_port}"
+    stub = subprocess.Popen([
+        sys.executable, STUBS,
+        "--port", str(stub_port),
+        "--llm-latency", str(args.llm_latency),
+        "--token-latency", str(args.token_latency),
+        "--openmeteo-latency", str(args.openmeteo_latency),
+        *(["--recordings", args.recordings] if args.recordings else []),
+    ], cwd=ROOT)
+    try:
+        await _wait_until_up(f"{stub_url}/stats", stub)
+        sessions = load_sessions(args.repeat)
+        levels = {}
+        for concurrency in args.concurrency:
+            levels[str(concurrency)] = await run_level(concurrency, sessions, stub_url, args.plain)
+            report(concurrency, levels[str(concurrency)])
+    finally:
+        stub.terminate()
+        stub.wait(timeout=10)
+    return {"config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")}, "levels": levels}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=lambda value: [int(level) for level in value.split(",")], default=[1, 4], help="comma separated levels")
+    parser.add_argument("--repeat", type=int, default=1, help="times every session is replayed")
+    parser.add_argument("--plain", action="store_true", help="call /chat/visualization instead of its streaming variant, without stages")
+    parser.add_argument("--llm-latency", type=float, default=0.8)
+    parser.add_argument("--token-latency", type=float, default=0.01)
+    parser.add_argument("--openmeteo-latency", type=float, default=0.15)
+    parser.add_argument("--recordings", help="recorded OpenMeteo payloads, benchmarks/fixtures/openmeteo by default")
+    parser.add_argument("--output", help="save the results to this JSON file")
+    parser.add_argument("--baseline", help="results JSON file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative increase over the baseline")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+    if args.baseline:
+        with open(args.baseline, "r") as file:
+            found = regressions(results, json.load(file), args.tolerance)
+        if found:
+            print("\nregressions:\n" + "\n".join(found))
+            sys.exit(1)
+        print("\nno regression")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Compare the legacy and columnar ingestion of OpenMeteo payloads.
+
+Each path runs in its own process on the same synthetic hourly archive response,
+so peak RSS is measured independently.
+
+Usage:
+    python benchmarks/ingestion.py [--years 40] [--variables 4]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import subprocess
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODES = ("legacy", "columnar")
+
+
+def build_payload(years: int, variables: int) -> bytes:
+    """Synthetic archive response with `years` of hourly data, shaped like OpenMeteo's"""
+    start = np.datetime64("1985-01-01T00:00")
+    times = np.arange(start, start + np.timedelta64(years * 8766, "h"), np.timedelta64(1, "h"))
+    rng = np.random.default_rng(0)
+    hourly = {"time": times.astype(str).tolist()}
+    for i in range(variables):
+        values = np.round(rng.normal(15, 8, len(times)), 1).tolist()
+        values[::997] = [None] * len(values[::997])
+        hourly[f"variable_{i}"] = values
+    payload = {
+        "latitude": 35.18,
+        "longitude": 136.91,
+        "generationtime_ms": 1.0,
+        "utc_offset_seconds": 0,
+        "timezone": "GMT",
+        "hourly_units": {name: "°C" for name in hourly},
+        "hourly": hourly,
+    }
+    return json.dumps(payload).encode()
+
+
+def ingest_legacy(content: bytes):
+    import pandas as pd
+
+    json_data = json.loads(content)
+    hourly_df = pd.DataFrame(json_data.pop("hourly"))
+    metadata_df = pd.DataFrame([json_data])
+    return metadata_df, hourly_df
+
+
+def ingest_columnar(content: bytes):
+    from app.ingest import decode_payload, normalize_openmeteo_payload
+
+    data = normalize_openmeteo_payload(decode_payload(content))
+    return data.metadata, data.hourly_data
+
+
+def run(mode: str, path: str) -> None:
+    with open(path, "rb") as file:
+        content = file.read()
+    # imports and the payload itself are not part of the measurement
+    import pandas  # noqa: F401
+    import app.ingest  # noqa: F401
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    started = time.perf_counter()
+    _, hourly_df = (ingest_legacy if mode == "legacy" else ingest_columnar)(content)
+    elapsed = time.perf_counter() - started
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({
+        "mode": mode,
+        "rows": len(hourly_df),
+        "parse_seconds": round(elapsed, 3),
+        "peak_rss_mb": round(peak / 1024, 1),
+        "rss_increase_mb": round((peak - baseline) / 1024, 1),
+        "frame_mb": round(hourly_df.memory_usage(index=True, deep=True).sum() / 2**20, 1),
+    }))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--years", type=int, default=40)
+    parser.add_argument("--variables", type=int, default=4)
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--payload", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    if args.mode:
+        run(args.mode, args.payload)
+        return
+
+    path = os.path.join(ROOT, ".cache", "benchmark_payload.json")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as file:
+        file.write(build_payload(args.years, args.variables))
+    print(f"Payload: {os.path.getsize(path) / 2**20:.1f} MB, {args.years} years x {args.variables} hourly variables")
+
+    try:
+        for mode in MODES:
+            result = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--mode", mode, "--payload", path],
+                check=True, capture_output=True, text=True,
+            )
+            print(result.stdout.strip())
+    finally:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
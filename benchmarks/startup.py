@@ -0,0 +1,73 @@
+"""
+Profile the cold import of the app, per module.
+
+Each run imports `app.main` in a fresh interpreter with `-X importtime` and reports
+the median cumulative import time of the app modules and of the third-party
+packages they pull in. Exits with status 1 when the median total is over the
+cold start target, so it can gate a deploy.
+
+Usage:
+    python benchmarks/startup.py [--runs 5] [--top 15] [--target 3]
+"""
+import os
+import sys
+import re
+import argparse
+import subprocess
+
+from collections import defaultdict
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)")
+
+
+def profile_import() -> dict:
+    """Cumulative import seconds of `app.main`, the app modules and the top-level packages, from one run"""
+    env = dict(os.environ, OPENAI_API_KEY=os.environ.get("OPENAI_API_KEY", "x"), ANTHROPIC_API_KEY=os.environ.get("ANTHROPIC_API_KEY", "x"))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main"],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+    modules = {}
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match is None:
+            continue
+        _, cumulative, indent, name = match.groups()
+        # app modules at any depth, other packages only where first imported as a whole
+        if name.startswith("app.") or name == "app" or ("." not in name and name not in modules):
+            modules[name] = int(cumulative) / 1e6
+    return modules
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="modules listed")
+    parser.add_argument("--target", type=float, default=None, help="seconds, COLD_START_TARGET_SECONDS by default")
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    from app.constants import COLD_START_TARGET_SECONDS
+    target = args.target if args.target is not None else COLD_START_TARGET_SECONDS
+
+    timings = defaultdict(list)
+    for _ in range(args.runs):
+        for name, seconds in profile_import().items():
+            timings[name].append(seconds)
+    medians = {name: float(np.median(values)) for name, values in timings.items()}
+    total = medians.pop("app.main")
+
+    print(f"{'module':<32} {'ms':>8} {'share':>6}")
+    for name, seconds in sorted(medians.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"{name:<32} {seconds * 1000:>8.1f} {seconds / total:>6.1%}")
+    print(f"\nimport app.main: {total * 1000:.1f} ms (median of {args.runs}), target {target * 1000:.0f} ms")
+    if total > target:
+        print("over target")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
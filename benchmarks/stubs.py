@@ -0,0 +1,294 @@
+"""
+Local stand-ins for the Anthropic, OpenAI and OpenMeteo APIs, for offline benchmarks.
+
+LLM calls get canned answers from fixtures/llm_responses.json after a configurable
+latency: structured outputs are picked by the response model named in the prompt
+and the conversation keywords, code generation gets a `visualize` function and
+anything else a short text, which is streamed word by word when asked. OpenMeteo requests are answered with recorded
+payloads when there is one, synthetic payloads shaped like OpenMeteo's otherwise.
+
+Point the app at it with:
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8765
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1
+    OPENMETEO_BASE_URL=http://127.0.0.1:8765/openmeteo
+
+Usage:
+    python benchmarks/stubs.py [--port 8765] [--llm-latency 0.8] [--token-latency 0.01]
+                               [--openmeteo-latency 0.15] [--recordings DIR] [--record]
+"""
+import os
+import json
+import time
+import asyncio
+import hashlib
+import argparse
+
+from collections import Counter
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qsl, urlencode
+
+import numpy as np
+import pandas as pd
+import uvicorn
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# level, seasonal amplitude, trend per year and lower bound of synthetic variables, by name fragment
+SYNTHETIC_SERIES = (
+    ("temperature", 15.0, 9.0, 0.04, None),
+    ("dew_point", 10.0, 8.0, 0.03, None),
+    ("humidity", 70.0, 10.0, 0.0, 0.0),
+    ("precipitation", 4.0, 3.0, 0.01, 0.0),
+    ("rain", 4.0, 3.0, 0.01, 0.0),
+    ("wind", 12.0, 3.0, 0.0, 0.0),
+    ("pm2_5", 12.0, 4.0, -0.3, 0.0),
+    ("pm10", 20.0, 6.0, -0.4, 0.0),
+    ("dioxide", 18.0, 5.0, -0.2, 0.0),
+    ("ozone", 60.0, 20.0, 0.2, 0.0),
+)
+UNITS = {"temperature": "°C", "dew_point": "°C", "humidity": "%", "precipitation": "mm", "rain": "mm", "wind": "km/h"}
+
+
+class LLMStub:
+    """
+    Canned Anthropic messages and OpenAI chat completions.
+
+    Attributes:
+        latency (float): Seconds before the first token
+        token_latency (float): Seconds per output token, about 4 characters
+    """
+
+    def __init__(self, fixtures: Dict[str, Any], latency: float, token_latency: float):
+        self.fixtures = fixtures
+        self.latency = latency
+        self.token_latency = token_latency
+        self.calls = Counter()
+
+    def answer(self, text: str, response_format: Optional[str] = None) -> str:
+        """Canned answer for a prompt, JSON for structured outputs"""
+        variant = next(
+            (name for name, keywords in self.fixtures["variants"].items() if any(keyword in text.lower() for keyword in keywords)),
+            None,
+        )
+        structured = dict(self.fixtures["structured"]["default"], **self.fixtures["structured"].get(variant, {}))
+        if response_format is None:
+            # the app names the response model right before its JSON schema
+            response_format = next((name for name in structured if f"{name}\n" in text), None)
+        if response_format is not None:
+            self.calls[response_format] += 1
+            # `{n}` numbers the answers, e.g. so that scenarios differ as a model's would
+            return json.dumps(structured[response_format], ensure_ascii=False).replace("{n}", str(self.calls[response_format]))
+        if "visualize" in text:
+            self.calls["code"] += 1
+            return self.fixtures["code"]
+        self.calls["text"] += 1
+        return self.fixtures["text"]
+
+    async def anthropic_messages(self, request: Request) -> Response:
+        body = await request.json()
+        text = _message_text(body.get("messages", []))
+        answer = self.answer(text)
+        usage = {"input_tokens": _tokens(json.dumps(body)), "output_tokens": _tokens(answer)}
+        message = {
+            "id": f"msg_{hashlib.md5(text.encode()).hexdigest()[:24]}",
+            "type": "message",
+            "role": "assistant",
+            "model": body.get("model", "stub"),
+            "content": [],
+            "stop_reason": None,
+            "stop_sequence": None,
+            "usage": dict(usage, output_tokens=0),
+        }
+        if not body.get("stream"):
+            await asyncio.sleep(self.latency + self.token_latency * usage["output_tokens"])
+            return JSONResponse(dict(message, content=[{"type": "text", "text": answer}], stop_reason="end_turn", usage=usage))
+
+        async def events():
+            await asyncio.sleep(self.latency)
+            yield _sse("message_start", {"type": "message_start", "message": message})
+            yield _sse("content_block_start", {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}})
+            for word in answer.split(" "):
+                await asyncio.sleep(self.token_latency * _tokens(word))
+                delta = {"type": "text_delta", "text": f"{word} "}
+                yield _sse("content_block_delta", {"type": "content_block_delta", "index": 0, "delta": delta})
+            yield _sse("content_block_stop", {"type": "content_block_stop", "index": 0})
+            yield _sse("message_delta", {
+                "type": "message_delta",
+                "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                "usage": {"output_tokens": usage["output_tokens"]},
+            })
+            yield _sse("message_stop", {"type": "message_stop"})
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    async def openai_chat_completions(self, request: Request) -> Response:
+        body = await request.json()
+        response_format = (body.get("response_format") or {}).get("json_schema", {}).get("name")
+        answer = self.answer(_message_text(body.get("messages", [])), response_format)
+        prompt_tokens, completion_tokens = _tokens(json.dumps(body)), _tokens(answer)
+        await asyncio.sleep(self.latency + self.token_latency * completion_tokens)
+        return JSONResponse({
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": answer, "refusal": None},
+                "finish_reason": "stop",
+                "logprobs": None,
+            }],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens},
+        })
+
+
+class OpenMeteoStub:
+    """
+    OpenMeteo endpoints served from recorded payloads, or synthetic ones.
+
+    Requests arrive as `/openmeteo/{host}/{path}?{query}`. Recordings are JSON files
+    named after a hash of the host, path and sorted query; with `record`, missing
+    ones are downloaded from OpenMeteo and saved.
+    """
+
+    def __init__(self, recordings: str, latency: float, record: bool = False):
+        self.recordings = recordings
+        self.latency = latency
+        self.record = record
+        self.calls = Counter()
+
+    async def endpoint(self, request: Request) -> Response:
+        host, path = request.path_params["host"], request.path_params["path"]
+        query = sorted(parse_qsl(request.url.query))
+        digest = hashlib.sha256(f"{host}/{path}?{urlencode(query)}".encode()).hexdigest()
+        recording = os.path.join(self.recordings, f"{digest}.json")
+        await asyncio.sleep(self.latency)
+
+        if os.path.exists(recording):
+            self.calls["recorded"] += 1
+            with open(recording, "rb") as file:
+                return Response(file.read(), media_type="application/json")
+        if self.record:
+            import httpx
+            async with httpx.AsyncClient(timeout=60) as client:
+                response = await client.get(f"https://{host}/{path}", params=query)
+            if response.status_code == 200:
+                os.makedirs(self.recordings, exist_ok=True)
+                with open(recording, "wb") as file:
+                    file.write(response.content)
+            self.calls["recorded"] += 1
+            return Response(response.content, status_code=response.status_code, media_type="application/json")
+
+        self.calls["synthetic"] += 1
+        payload = await asyncio.to_thread(synthetic_payload, dict(query), int(digest[:16], 16))
+        return JSONResponse(payload)
+
+
+def synthetic_payload(params: Dict[str, str], seed: int) -> Dict[str, Any]:
+    """Payload with a seasonal cycle, a trend and noise per requested variable, shaped like OpenMeteo's"""
+    rng = np.random.default_rng(seed)
+    end = pd.Timestamp(params.get("end_date", "2024-12-31"))
+    start = pd.Timestamp(params.get("start_date", end - pd.Timedelta(days=int(params.get("past_days", 92)))))
+    models = [model for model in params.get("models", "").split(",") if model]
+    payload = {
+        "latitude": float(params.get("latitude", 0)),
+        "longitude": float(params.get("longitude", 0)),
+        "generationtime_ms": 0.5,
+        "utc_offset_seconds": 0,
+        "timezone": "GMT",
+        "timezone_abbreviation": "GMT",
+        "elevation": 50.0,
+    }
+    for resolution, frequency, time_format in (("hourly", "h", "%Y-%m-%dT%H:%M"), ("daily", "D", "%Y-%m-%d")):
+        variables = [variable for variable in params.get(resolution, "").split(",") if variable]
+        if not variables:
+            continue
+        times = pd.date_range(start, end + pd.Timedelta(days=1), freq=frequency, inclusive="left")
+        years = ((times - times[0]) / pd.Timedelta(days=365.25)).to_numpy()
+        season = np.sin(2 * np.pi * (times.dayofyear.to_numpy() - 110) / 365.25)
+        series = {"time": times.strftime(time_format).tolist()}
+        units = {"time": "iso8601"}
+        for variable in variables:
+            level, amplitude, trend, minimum = next(
+                (values for name, *values in SYNTHETIC_SERIES if name in variable), (10.0, 3.0, 0.0, None)
+            )
+            for column in [f"{variable}_{model}" for model in models] or [variable]:
+                values = level + amplitude * season + trend * years + rng.normal(0, amplitude / 3, len(times))
+                if minimum is not None:
+                    values = np.maximum(values, minimum)
+                values = np.round(values, 1).astype(object)
+                values[rng.random(len(times)) < 0.002] = None
+                series[column] = values.tolist()
+                units[column] = next((unit for name, unit in UNITS.items() if name in variable), "μg/m³")
+        payload[resolution] = series
+        payload[f"{resolution}_units"] = units
+    return payload
+
+
+def _message_text(messages: List[Dict[str, Any]]) -> str:
+    parts = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+        elif isinstance(content, list):
+            parts.extend(block.get("text", "") for block in content if isinstance(block, dict))
+    return "\n".join(parts)
+
+
+def _tokens(text: str) -> int:
+    return max(len(text) // 4, 1)
+
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def create_app(
+    llm_latency: float = 0.8,
+    token_latency: float = 0.01,
+    openmeteo_latency: float = 0.15,
+    recordings: str = os.path.join(FIXTURES, "openmeteo"),
+    record: bool = False,
+) -> Starlette:
+    with open(os.path.join(FIXTURES, "llm_responses.json"), "r", encoding="utf-8") as file:
+        llm = LLMStub(json.load(file), llm_latency, token_latency)
+    openmeteo = OpenMeteoStub(recordings, openmeteo_latency, record)
+
+    async def stats(request: Request) -> Response:
+        """Calls since the last reset, `?reset=1` starts counting again"""
+        calls = {"llm": dict(llm.calls), "openmeteo": dict(openmeteo.calls)}
+        if request.query_params.get("reset"):
+            llm.calls.clear()
+            openmeteo.calls.clear()
+        return JSONResponse(calls)
+
+    return Starlette(routes=[
+        Route("/v1/messages", llm.anthropic_messages, methods=["POST"]),
+        Route("/v1/chat/completions", llm.openai_chat_completions, methods=["POST"]),
+        Route("/openmeteo/{host}/{path:path}", openmeteo.endpoint),
+        Route("/stats", stats),
+    ])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--llm-latency", type=float, default=0.8, help="seconds before the first token")
+    parser.add_argument("--token-latency", type=float, default=0.01, help="seconds per output token")
+    parser.add_argument("--openmeteo-latency", type=float, default=0.15, help="seconds per OpenMeteo request")
+    parser.add_argument("--recordings", default=os.path.join(FIXTURES, "openmeteo"), help="recorded OpenMeteo payloads")
+    parser.add_argument("--record", action="store_true", help="download and save missing recordings from OpenMeteo")
+    args = parser.parse_args()
+
+    app = create_app(args.llm_latency, args.token_latency, args.openmeteo_latency, args.recordings, args.record)
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()